@@ -0,0 +1,182 @@
+"""
+取り込み処理 (ecs/ingest-data) のオフラインベンチマーク
+
+合成コーパスを FakeS3Client、埋め込みを FakeBedrockRuntime、OpenSearch を OpenSearchStub に置き換えて
+OpenSearchController.ingest_data() を実行し、スループットとステージごとの統計を計測する。
+ingest-data の依存パッケージ (requirements.txt) がインストールされた環境で実行する。
+
+    python3 packages/cdk/benchmark/bench_ingest.py --files 200 --set embed_workers=16
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "ecs", "ingest-data", "app")
+)
+
+from corpus import generate_corpus  # noqa: E402
+from fakes import FakeBedrockRuntime, FakeS3Client  # noqa: E402
+from opensearch_stub import OpenSearchStub  # noqa: E402
+
+BUCKET = "bench-docs"
+MODELS = {
+    "titan": "amazon.titan-embed-text-v2:0",
+    "cohere": "cohere.embed-multilingual-v3",
+}
+
+
+def parse_overrides(values):
+    """
+    --set key=value の値を cfg 用の dict に変換する。値は int、float、文字列の順に解釈する
+    """
+    overrides = {}
+    for value in values:
+        key, _, raw = value.partition("=")
+        for cast in (int, float, str):
+            try:
+                overrides[key] = cast(raw)
+                break
+            except ValueError:
+                continue
+    return overrides
+
+
+def run(
+    files=100,
+    mean_chars=4000,
+    model="titan",
+    dimension=1024,
+    bedrock_latency_ms=50,
+    throttle_rate=0.0,
+    bedrock_max_tps=0,
+    s3_latency_ms=20,
+    opensearch_latency_ms=5,
+    reject_rate=0.0,
+    overrides=None,
+    seed=0,
+):
+    # utils と opensearch はモジュールの読み込み時に boto3 クライアントを作るため、ここで import する
+    import utils
+    from opensearch import OpenSearchController
+
+    corpus = generate_corpus(files, mean_chars=mean_chars, seed=seed)
+    s3 = FakeS3Client(BUCKET, corpus, latency_ms=s3_latency_ms)
+    utils.s3_client = s3
+    bedrock = FakeBedrockRuntime(
+        latency_ms=bedrock_latency_ms,
+        throttle_rate=throttle_rate,
+        max_tps=bedrock_max_tps,
+        dimension=dimension,
+        seed=seed,
+    )
+
+    cfg = {
+        "host_http": "http://127.0.0.1",
+        "index_name": "bench",
+        "dimension": dimension,
+        "model_id": MODELS[model],
+        "docs_url": f"s3://{BUCKET}/docs/",
+        "bedrock_region": "us-east-1",
+        "max_chunk_length": 400,
+        "index_create_wait": 0,
+        "report_interval": 3600,
+        "embedding_cache_uri": "",
+        "manifest_uri": "",
+        # ベンチマークの出力に EMF のログを混ぜない
+        "metrics_emf": False,
+    }
+    cfg.update(overrides or {})
+
+    with OpenSearchStub(
+        latency_ms=opensearch_latency_ms, reject_rate=reject_rate
+    ) as stub:
+        controller = OpenSearchController(
+            cfg, bedrock_runtime=bedrock, aos_client=stub.client(timeout=60)
+        )
+        start = time.perf_counter()
+        controller.ingest_data()
+        elapsed = time.perf_counter() - start
+
+        pipeline = controller.pipeline.snapshot() if controller.pipeline else {}
+        index_stats = controller.index_stats.snapshot()
+        spans = controller.metrics.snapshot()["spans"]
+        opensearch_stats = stub.state.stats()
+
+    input_bytes = sum(len(data) for data in corpus.values())
+    return {
+        "files": files,
+        "input_mb": round(input_bytes / 1024 / 1024, 3),
+        "model": model,
+        "wall_seconds": round(elapsed, 3),
+        "files_per_sec": round(files / elapsed, 3),
+        "chunks_per_sec": round(index_stats["units"] / elapsed, 3),
+        # Linux では KB 単位
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "stages": pipeline,
+        "spans": spans,
+        "bedrock": bedrock.stats(),
+        "s3_requests": s3.requests,
+        "opensearch": opensearch_stats,
+        "cfg": {k: v for k, v in cfg.items() if k in (overrides or {})},
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--mean-chars", type=int, default=4000)
+    parser.add_argument("--model", choices=list(MODELS), default="titan")
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=50)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--bedrock-max-tps", type=float, default=0)
+    parser.add_argument("--s3-latency-ms", type=float, default=20)
+    parser.add_argument("--opensearch-latency-ms", type=float, default=5)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="OpenSearchController の cfg を上書きする (例: embed_workers=16)",
+    )
+
+
+def run_from_args(args):
+    return run(
+        files=args.files,
+        mean_chars=args.mean_chars,
+        model=args.model,
+        dimension=args.dimension,
+        bedrock_latency_ms=args.bedrock_latency_ms,
+        throttle_rate=args.throttle_rate,
+        bedrock_max_tps=args.bedrock_max_tps,
+        s3_latency_ms=args.s3_latency_ms,
+        opensearch_latency_ms=args.opensearch_latency_ms,
+        reject_rate=args.reject_rate,
+        overrides=parse_overrides(args.set),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    result = run_from_args(args)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+検索用 Lambda (lambda/search-documents) のオフラインベンチマーク
+
+OpenSearchStub に合成コーパスを登録し、Bedrock を FakeBedrockRuntime に置き換えて handler() を呼び出す。
+検索方法と検索単位の組み合わせごとに p50 / p95 / p99 のレイテンシを計測する。
+スタブの検索は総当たりのため、計測値は OpenSearch のレイテンシではなく Lambda 側の処理時間の比較に使う。
+
+    python3 packages/cdk/benchmark/bench_search.py --queries 200 --bedrock-latency-ms 80
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "lambda", "search-documents")
+)
+
+from corpus import generate_corpus, generate_queries  # noqa: E402
+from fakes import FakeBedrockRuntime, fake_embedding  # noqa: E402
+from opensearch_stub import OpenSearchStub  # noqa: E402
+
+INDEX_NAME = "bench"
+MODEL_ID = "amazon.titan-embed-text-v2:0"
+CASES = [
+    {"searchMethod": "keyword", "searchResultUnit": "chunk"},
+    {"searchMethod": "keyword", "searchResultUnit": "document"},
+    {"searchMethod": "vector", "searchResultUnit": "chunk"},
+    {"searchMethod": "vector", "searchResultUnit": "document"},
+    {"searchMethod": "hybrid", "searchResultUnit": "chunk"},
+    {"searchMethod": "hybrid", "searchResultUnit": "document"},
+    {"searchMethod": "hybrid", "searchResultUnit": "chunk", "hybridMode": "concurrent"},
+    # document 単位で各ドキュメントの上位のチャンクを 2 件追加で返す (collapse の inner_hits)
+    {"searchMethod": "keyword", "searchResultUnit": "document", "extraChunks": 2},
+    {"searchMethod": "hybrid", "searchResultUnit": "document", "extraChunks": 2},
+    # 5 つのサービスのうち 1 つに絞り込む (チャンクの約 20%)
+    {"searchMethod": "keyword", "searchResultUnit": "chunk", "filters": {"service": "kendra"}},
+    {"searchMethod": "vector", "searchResultUnit": "chunk", "filters": {"service": "kendra"}},
+    {"searchMethod": "hybrid", "searchResultUnit": "chunk", "filters": {"service": "kendra"}},
+    {"searchMethod": "hybrid", "searchResultUnit": "document", "filters": {"service": "kendra"}},
+]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+    }
+
+
+def build_index(files, dimension, chunk_length=400, seed=0):
+    """
+    取り込み処理と同じフィールドを持つドキュメントを作る。ベクトルは FakeBedrockRuntime と同じ関数で計算する
+    """
+    docs = {}
+    for key, data in generate_corpus(files, seed=seed).items():
+        _, service, doc_name = key.split("/")
+        text = data.decode("utf-8")
+        for i in range(0, len(text), chunk_length):
+            chunk = text[i : i + chunk_length]
+            docs[f"{doc_name}-{i // chunk_length}"] = {
+                "keyword": chunk,
+                "service": service,
+                "docs_root": f"s3://bench-docs/docs/{service}",
+                "doc_name": doc_name,
+                "vector": fake_embedding(chunk, dimension),
+            }
+    body = {
+        "mappings": {
+            "_meta": {"model_id": MODEL_ID},
+            "properties": {
+                "vector": {"type": "knn_vector", "dimension": dimension},
+                "docs_root": {"type": "keyword"},
+                "doc_name": {"type": "keyword"},
+                "keyword": {"type": "text"},
+                "service": {"type": "keyword"},
+            },
+        }
+    }
+    return body, docs
+
+
+def call(index, body, resource="/search"):
+    event = {"resource": resource, "body": json.dumps(body, ensure_ascii=False)}
+    start = time.perf_counter()
+    response = index.handler(event, None)
+    elapsed = (time.perf_counter() - start) * 1000
+    if response["statusCode"] != 200:
+        raise RuntimeError(f"{response['statusCode']}: {response['body']}")
+    return elapsed, response
+
+
+def run(
+    files=200,
+    queries=100,
+    dimension=256,
+    bedrock_latency_ms=50,
+    opensearch_latency_ms=5,
+    batch_size=10,
+    seed=0,
+):
+    os.environ.setdefault("BEDROCK_REGION", "us-east-1")
+    os.environ.setdefault("OPENSEARCH_ENDPOINT", "127.0.0.1")
+    # 検索のたびに EMF のログを出力しない
+    os.environ.setdefault("EMIT_METRICS", "false")
+    import index
+
+    bedrock = FakeBedrockRuntime(
+        latency_ms=bedrock_latency_ms, dimension=dimension, seed=seed
+    )
+    index.bedrock_runtime = bedrock
+
+    mapping, docs = build_index(files, dimension, seed=seed)
+    texts = generate_queries(queries, seed=seed)
+    results = {"files": files, "chunks": len(docs), "dimension": dimension}
+
+    with OpenSearchStub(latency_ms=opensearch_latency_ms) as stub:
+        stub.create_index(INDEX_NAME, mapping, docs)
+        index.aos_client = stub.client(timeout=60)
+
+        cases = []
+        for case in CASES:
+            # キャッシュの有無で結果が変わらないよう、ケースごとに埋め込みのキャッシュを空にする
+            index.embedding_cache = type(index.embedding_cache)(
+                index.embedding_cache.max_entries
+            )
+            index.result_cache.clear()
+            latencies = []
+            degraded = 0
+            returned = 0
+            # 絞り込み条件に一致しない結果の数 (0 であること)
+            filter_violations = 0
+            services = case.get("filters", {}).get("service")
+            if isinstance(services, str):
+                services = [services]
+            for text in texts:
+                elapsed, response = call(
+                    index, dict(case, indexName=INDEX_NAME, text=text)
+                )
+                latencies.append(elapsed)
+                degraded += "X-Search-Degraded" in response["headers"]
+                search_results = json.loads(response["body"])
+                returned += len(search_results)
+                if services:
+                    filter_violations += sum(
+                        r["service"] not in services for r in search_results
+                    )
+            cases.append(
+                dict(
+                    case,
+                    degraded=degraded,
+                    results_per_query=round(returned / len(texts), 2),
+                    filter_violations=filter_violations,
+                    **summarize(latencies),
+                )
+            )
+        results["cases"] = cases
+
+        # 同じクエリを再送信した場合 (検索結果のキャッシュにヒットする場合) のレイテンシ
+        case = dict(CASES[4], indexName=INDEX_NAME)
+        index.result_cache.clear()
+        for text in texts:
+            call(index, dict(case, text=text))
+        latencies = [call(index, dict(case, text=text))[0] for text in texts]
+        results["result_cache"] = dict(
+            index.result_cache.stats(), **summarize(latencies)
+        )
+
+        latencies = []
+        for i in range(0, len(texts), batch_size):
+            elapsed, _ = call(
+                index,
+                {
+                    "indexName": INDEX_NAME,
+                    "texts": texts[i : i + batch_size],
+                    "searchMethods": ["keyword", "vector", "hybrid"],
+                    "searchResultUnit": "chunk",
+                },
+                resource="/search/batch",
+            )
+            latencies.append(elapsed)
+        results["batch"] = dict(batch_size=batch_size, **summarize(latencies))
+        results["opensearch"] = stub.state.stats()
+
+    results["bedrock"] = bedrock.stats()
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=50)
+    parser.add_argument("--opensearch-latency-ms", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=10)
+
+
+def run_from_args(args):
+    return run(
+        files=args.files,
+        queries=args.queries,
+        dimension=args.dimension,
+        bedrock_latency_ms=args.bedrock_latency_ms,
+        opensearch_latency_ms=args.opensearch_latency_ms,
+        batch_size=args.batch_size,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    result = run_from_args(args)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+ベクトルの保存形式 (INGEST_VECTOR_STORAGE) ごとの再現率、サイズ、検索レイテンシの比較
+
+既定では合成ベクトルを各保存形式でエンコードし、総当たり検索の上位 k 件が float の正解とどれだけ一致するか (recall@k)、
+1 ベクトルあたりの保存サイズと bulk リクエストの JSON サイズを計測する。
+--opensearch-url を指定すると、実際の OpenSearch (ローカルの Docker など) に保存形式ごとのインデックスを作成し、
+k-NN 検索のレイテンシと再現率を計測する。
+
+    python3 packages/cdk/benchmark/bench_vectors.py --docs 2000 --dimension 256
+    python3 packages/cdk/benchmark/bench_vectors.py --opensearch-url http://localhost:9200 --storages float byte fp16
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "ecs", "ingest-data", "app")
+)
+
+from vector_codec import VECTOR_STORAGE, encode_vector, knn_mapping  # noqa: E402
+
+# 1 次元あたりの保存サイズ (バイト)。binary は 1 ビット
+BYTES_PER_DIMENSION = {
+    "float": 4,
+    "byte": 1,
+    "fp16": 2,
+    "lucene_sq": 1,
+    "binary": 1 / 8,
+}
+
+
+def generate_vectors(num_docs, num_queries, dimension, clusters=50, seed=0):
+    """
+    実際の埋め込みに近づけるため、トピックの中心の周りに分布する正規化済みのベクトルを作る
+    """
+    rng = random.Random(seed)
+
+    def unit(vector):
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    centers = [unit([rng.gauss(0, 1) for _ in range(dimension)]) for _ in range(clusters)]
+
+    def sample(spread):
+        center = rng.choice(centers)
+        noise = [rng.gauss(0, spread / math.sqrt(dimension)) for _ in range(dimension)]
+        return unit([c + n for c, n in zip(center, noise)])
+
+    docs = [sample(1.0) for _ in range(num_docs)]
+    queries = [sample(1.2) for _ in range(num_queries)]
+    return docs, queries
+
+
+def to_fp16(vector):
+    # faiss の SQfp16 で保存される値
+    return list(struct.unpack(f"{len(vector)}e", struct.pack(f"{len(vector)}e", *vector)))
+
+
+def scalar_quantize(vectors, bits=7, quantile=0.99):
+    """
+    lucene_sq の近似。全ベクトルの値の分位点で範囲を決め、7 ビットの整数に量子化する
+    """
+    values = sorted(abs(v) for vector in vectors for v in vector)
+    limit = values[int(len(values) * quantile) - 1] or 1.0
+    levels = 2 ** (bits - 1) - 1
+
+    def quantize(vector):
+        return [max(-levels, min(levels, round(v / limit * levels))) for v in vector]
+
+    return quantize
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a)) or 1.0
+    nb = math.sqrt(sum(y * y for y in b)) or 1.0
+    return dot / (na * nb)
+
+
+def inner_product(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def hamming_similarity(a, b):
+    # 符号付き 8 ビット整数の列を 1 つの整数にして XOR のビット数を数える
+    xa = int.from_bytes(bytes(v & 0xFF for v in a), "big")
+    xb = int.from_bytes(bytes(v & 0xFF for v in b), "big")
+    return -(xa ^ xb).bit_count()
+
+
+def encoder_for(storage, docs):
+    if storage == "lucene_sq":
+        return scalar_quantize(docs), cosine
+    if storage == "fp16":
+        return (lambda v: to_fp16(encode_vector(v, storage, decimals=None))), inner_product
+    if storage == "binary":
+        return (lambda v: encode_vector(v, storage)), hamming_similarity
+    return (lambda v: encode_vector(v, storage, decimals=None)), cosine
+
+
+def top_k(query, vectors, similarity, k):
+    scored = sorted(
+        range(len(vectors)), key=lambda i: similarity(query, vectors[i]), reverse=True
+    )
+    return scored[:k]
+
+
+def recall(expected, actual):
+    return len(set(expected) & set(actual)) / len(expected)
+
+
+def run_offline(storages, docs, queries, k, decimals):
+    truth = [top_k(q, docs, cosine, k) for q in queries]
+    results = []
+    for storage in storages:
+        encode, similarity = encoder_for(storage, docs)
+        start = time.perf_counter()
+        encoded_docs = [encode(v) for v in docs]
+        encode_us = (time.perf_counter() - start) / len(docs) * 1e6
+        encoded_queries = [encode(q) for q in queries]
+
+        recalls = [
+            recall(expected, top_k(q, encoded_docs, similarity, k))
+            for q, expected in zip(encoded_queries, truth)
+        ]
+        # bulk に送る値 (lucene_sq はサーバー側で量子化するため float を送る)
+        payload_storage = "float" if storage == "lucene_sq" else storage
+        bulk_bytes = sum(
+            len(json.dumps(encode_vector(v, payload_storage, decimals=decimals)))
+            for v in docs
+        ) / len(docs)
+        results.append(
+            {
+                "storage": storage,
+                f"recall@{k}": round(sum(recalls) / len(recalls), 4),
+                "bytes_per_vector": math.ceil(
+                    BYTES_PER_DIMENSION[storage] * len(docs[0])
+                ),
+                "bulk_json_bytes_per_vector": round(bulk_bytes, 1),
+                "encode_us_per_vector": round(encode_us, 1),
+            }
+        )
+    return results
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+def run_online(url, storages, docs, queries, k, decimals):
+    from opensearchpy import OpenSearch, helpers
+
+    client = OpenSearch(hosts=[url], timeout=120)
+    version = client.info()["version"]["number"]
+    dimension = len(docs[0])
+    truth = [top_k(q, docs, cosine, k) for q in queries]
+
+    results = []
+    for storage in storages:
+        index = f"bench-vectors-{storage}"
+        if client.indices.exists(index=index):
+            client.indices.delete(index=index)
+        client.indices.create(
+            index=index,
+            body={
+                "settings": {"index": {"knn": True, "number_of_replicas": 0}},
+                "mappings": {
+                    "properties": {
+                        "vector": knn_mapping(
+                            storage, dimension, {"m": 16, "ef_construction": 100}
+                        )
+                    }
+                },
+            },
+        )
+        start = time.perf_counter()
+        helpers.bulk(
+            client,
+            (
+                {
+                    "_index": index,
+                    "_id": str(i),
+                    "vector": encode_vector(v, storage, decimals=decimals),
+                }
+                for i, v in enumerate(docs)
+            ),
+            chunk_size=200,
+        )
+        client.indices.refresh(index=index)
+        client.indices.forcemerge(index=index, max_num_segments=1)
+        index_seconds = time.perf_counter() - start
+
+        latencies = []
+        recalls = []
+        for query, expected in zip(queries, truth):
+            body = {
+                "size": k,
+                "_source": False,
+                "query": {
+                    "knn": {
+                        "vector": {
+                            "vector": encode_vector(query, storage, decimals=None),
+                            "k": k,
+                        }
+                    }
+                },
+            }
+            start = time.perf_counter()
+            response = client.search(index=index, body=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            actual = [int(hit["_id"]) for hit in response["hits"]["hits"]]
+            recalls.append(recall(expected, actual))
+
+        stats = client.indices.stats(index=index, metric="store")
+        results.append(
+            {
+                "storage": storage,
+                f"recall@{k}": round(sum(recalls) / len(recalls), 4),
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "index_seconds": round(index_seconds, 3),
+                "store_bytes": stats["_all"]["primaries"]["store"]["size_in_bytes"],
+            }
+        )
+        client.indices.delete(index=index)
+    return {"opensearch_version": version, "results": results}
+
+
+def add_arguments(parser):
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--decimals", type=int, default=6)
+    parser.add_argument(
+        "--storages", nargs="+", choices=list(VECTOR_STORAGE), default=list(VECTOR_STORAGE)
+    )
+    parser.add_argument("--opensearch-url", type=str, default="")
+
+
+def run_from_args(args):
+    docs, queries = generate_vectors(args.docs, args.queries, args.dimension)
+    result = {
+        "docs": args.docs,
+        "queries": args.queries,
+        "dimension": args.dimension,
+        "offline": run_offline(args.storages, docs, queries, args.k, args.decimals),
+    }
+    if args.opensearch_url:
+        result["online"] = run_online(
+            args.opensearch_url, args.storages, docs, queries, args.k, args.decimals
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    result = run_from_args(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
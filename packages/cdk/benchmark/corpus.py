@@ -0,0 +1,80 @@
+"""
+ベンチマーク用の日本語・英語の合成コーパス
+"""
+
+import random
+
+
+JA_WORDS = [
+    "検索", "文書", "ベクトル", "埋め込み", "インデックス", "クラスター", "設定",
+    "データ", "取り込み", "モデル", "日本語", "全文検索", "結果", "処理",
+]
+EN_WORDS = [
+    "search", "document", "vector", "embedding", "index", "cluster", "setting",
+    "data", "ingest", "model", "query", "result", "latency", "throughput",
+]
+SERVICES = ["bedrock", "comprehend", "kendra", "opensearch", "s3"]
+
+# 複数のファイルに繰り返し現れる定型文 (ヘッダー、フッター、免責事項など)
+BOILERPLATE = [
+    "本資料の内容は予告なく変更される場合があります。",
+    "All rights reserved. This document is provided for informational purposes only. ",
+    "お問い合わせはサポートセンターまでご連絡ください。",
+]
+
+
+def generate_text(kind, size, seed=0):
+    """
+    Args:
+        kind (str): "ja" (日本語)、"en" (英語)、"nopunct" (句読点のない日本語)
+        size (int): 文字数
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        if kind == "ja":
+            sentence = "".join(rng.choices(JA_WORDS, k=rng.randint(5, 30)))
+            sentence += rng.choice(["。", "。", "。", "！", "？", "\n"])
+        elif kind == "en":
+            sentence = " ".join(rng.choices(EN_WORDS, k=rng.randint(5, 30)))
+            sentence = sentence.capitalize() + rng.choice([". ", ". ", "? ", "! "])
+        else:
+            # 句読点のないテキスト (表や箇条書きを抽出した PDF など)
+            sentence = "".join(rng.choices(JA_WORDS, k=20))
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:size]
+
+
+def generate_corpus(
+    num_files, mean_chars=4000, ja_ratio=0.7, boilerplate_ratio=0.3, seed=0
+):
+    """
+    S3 のドキュメントバケットと同じ構成 ({service}/{file}.txt) の合成コーパスを作る
+
+    Returns:
+        dict: S3 キー (docs/{service}/doc-00000.txt) とファイルの中身 (bytes) の対応
+    """
+    rng = random.Random(seed)
+    corpus = {}
+    for i in range(num_files):
+        kind = "ja" if rng.random() < ja_ratio else "en"
+        size = max(100, int(rng.expovariate(1 / mean_chars)))
+        text = generate_text(kind, size, seed=seed * 1_000_003 + i)
+        if rng.random() < boilerplate_ratio:
+            text = rng.choice(BOILERPLATE) + "\n" + text + "\n" + rng.choice(BOILERPLATE)
+        service = SERVICES[i % len(SERVICES)]
+        corpus[f"docs/{service}/doc-{i:05d}.txt"] = text.encode("utf-8")
+    return corpus
+
+
+def generate_queries(num_queries, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        if rng.random() < 0.7:
+            queries.append("".join(rng.choices(JA_WORDS, k=rng.randint(1, 4))))
+        else:
+            queries.append(" ".join(rng.choices(EN_WORDS, k=rng.randint(1, 4))))
+    return queries
@@ -0,0 +1,255 @@
+"""
+ネットワークを使わずにベンチマークを実行するための Bedrock と S3 の代替クライアント
+"""
+
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+def fake_embedding(text, dimension):
+    """
+    テキストのハッシュを種にした単位ベクトル。同じテキストには常に同じベクトルを返す
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimension)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _encode(vector, embedding_type):
+    # Cohere の int8 / binary 形式を模したもの (実際の量子化の方法とは異なる)
+    if embedding_type == "int8":
+        scale = 127 / (max(abs(v) for v in vector) or 1.0)
+        return [int(round(v * scale)) for v in vector]
+    if embedding_type == "binary":
+        packed = []
+        for i in range(0, len(vector), 8):
+            byte = 0
+            for v in vector[i : i + 8]:
+                byte = (byte << 1) | (1 if v > 0 else 0)
+            packed.append(byte - 256 if byte > 127 else byte)
+        return packed
+    return vector
+
+
+class FakeBedrockRuntime:
+    """
+    bedrock-runtime クライアントの代替。Titan と Cohere の invoke_model のレスポンス形式を返す
+
+    Args:
+        latency_ms (float): 1 リクエストあたりの平均レイテンシ
+        jitter_ms (float): レイテンシのばらつき
+        throttle_rate (float): ThrottlingException を返す確率
+        max_tps (float): 1 秒あたりのリクエスト数がこれを超えると ThrottlingException を返す (0 の場合は制限しない)
+        dimension (int): ベクトルの次元数
+    """
+
+    def __init__(
+        self,
+        latency_ms=50,
+        jitter_ms=10,
+        throttle_rate=0.0,
+        max_tps=0,
+        dimension=1024,
+        seed=0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.max_tps = max_tps
+        self.dimension = dimension
+        self.requests = 0
+        self.throttled = 0
+        self.texts = 0
+        self._rng = random.Random(seed)
+        self._window = []
+        self._lock = threading.Lock()
+
+    def _throttle(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 1.0]
+            over_quota = self.max_tps and len(self._window) >= self.max_tps
+            if over_quota or self._rng.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+            self._window.append(now)
+            return False
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        if self._throttle():
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                "InvokeModel",
+            )
+
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms))
+        time.sleep(delay / 1000)
+
+        request = json.loads(body)
+        if "cohere" in modelId:
+            texts = request["texts"]
+            with self._lock:
+                self.texts += len(texts)
+            vectors = [fake_embedding(t, self.dimension) for t in texts]
+            response = {
+                "embeddings": {
+                    embedding_type: [_encode(v, embedding_type) for v in vectors]
+                    for embedding_type in request.get("embedding_types", ["float"])
+                }
+            }
+        else:
+            with self._lock:
+                self.texts += 1
+            response = {
+                "embedding": fake_embedding(request["inputText"], self.dimension)
+            }
+        return {"body": io.BytesIO(json.dumps(response).encode("utf-8"))}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "texts": self.texts,
+            }
+
+
+class _NoSuchKey(Exception):
+    pass
+
+
+class _Exceptions:
+    NoSuchKey = _NoSuchKey
+
+
+class FakeS3Client:
+    """
+    S3 クライアントの代替。オブジェクトはメモリ上に保持する
+
+    Args:
+        bucket (str): バケット名
+        objects (dict): キーとオブジェクトの中身 (bytes) の対応
+        latency_ms (float): 1 リクエストあたりのレイテンシ
+        bandwidth_mbps (float): ダウンロードの帯域 (MB/s)。0 の場合は制限しない
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self, bucket, objects, latency_ms=20, bandwidth_mbps=0):
+        self.bucket = bucket
+        self.objects = dict(objects)
+        self.latency_ms = latency_ms
+        self.bandwidth_mbps = bandwidth_mbps
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _wait(self, size=0):
+        with self._lock:
+            self.requests += 1
+        delay = self.latency_ms / 1000
+        if self.bandwidth_mbps:
+            delay += size / (self.bandwidth_mbps * 1024 * 1024)
+        time.sleep(delay)
+
+    def _get(self, Bucket, Key):
+        if Bucket != self.bucket or Key not in self.objects:
+            raise _NoSuchKey(Key)
+        return self.objects[Key]
+
+    @staticmethod
+    def _etag(data):
+        return '"' + hashlib.md5(data).hexdigest() + '"'
+
+    def list_objects_v2(
+        self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs
+    ):
+        self._wait()
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [
+                {
+                    "Key": key,
+                    "ETag": self._etag(self.objects[key]),
+                    "Size": len(self.objects[key]),
+                }
+                for key in page
+            ],
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation_name):
+        return _ListObjectsV2Paginator(self)
+
+    def head_object(self, Bucket, Key):
+        self._wait()
+        data = self._get(Bucket, Key)
+        return {"ContentLength": len(data), "ETag": self._etag(data)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        data = self._get(Bucket, Key)
+        if IfMatch and IfMatch.strip('"') != self._etag(data).strip('"'):
+            raise ClientError(
+                {"Error": {"Code": "PreconditionFailed", "Message": "ETag mismatch"}},
+                "GetObject",
+            )
+        if Range:
+            # "bytes=start-end" 形式
+            start, end = Range.split("=")[1].split("-")
+            data = data[int(start) : int(end) + 1]
+        self._wait(len(data))
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def download_file(self, Bucket, Key, Filename):
+        data = self._get(Bucket, Key)
+        self._wait(len(data))
+        with open(Filename, "wb") as f:
+            f.write(data)
+
+    def download_fileobj(self, Bucket, Key, Fileobj):
+        data = self._get(Bucket, Key)
+        self._wait(len(data))
+        Fileobj.write(data)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._wait()
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.read()
+
+    def upload_file(self, Filename, Bucket, Key):
+        self._wait()
+        with open(Filename, "rb") as f:
+            self.objects[Key] = f.read()
+
+
+class _ListObjectsV2Paginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        if PaginationConfig and PaginationConfig.get("PageSize"):
+            kwargs["MaxKeys"] = PaginationConfig["PageSize"]
+        token = None
+        while True:
+            if token:
+                kwargs["ContinuationToken"] = token
+            response = self.client.list_objects_v2(**kwargs)
+            yield response
+            if not response.get("IsTruncated"):
+                break
+            token = response["NextContinuationToken"]
+
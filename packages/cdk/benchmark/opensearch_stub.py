@@ -0,0 +1,468 @@
+"""
+ベンチマーク用の OpenSearch 互換 HTTP スタブ
+
+取り込み処理と検索用 Lambda が使う API だけを、メモリ上のデータで簡易的に実装する。
+スコアは本物の BM25 や HNSW ではないため、スループットとレイテンシの計測にのみ使用する。
+受け取ったリクエストはエンドポイントごとに件数、バイト数、処理時間を記録する。
+"""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _tokens(text):
+    # 英語は単語、日本語は文字の bigram をトークンとみなす
+    words = re.findall(r"[A-Za-z0-9]+", text.lower())
+    ja = re.sub(r"[A-Za-z0-9\s]+", "", text)
+    return set(words) | {ja[i : i + 2] for i in range(len(ja) - 1)}
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a)) or 1.0
+    nb = math.sqrt(sum(y * y for y in b)) or 1.0
+    return dot / (na * nb)
+
+
+class StubState:
+    def __init__(self, latency_ms=0, reject_rate=0.0, store_vectors=True, seed=0):
+        self.latency_ms = latency_ms
+        self.reject_rate = reject_rate
+        self.store_vectors = store_vectors
+        self.indices = {}
+        self.aliases = {}
+        self.pipelines = {}
+        self.cluster_settings = {"persistent": {}, "transient": {}}
+        self.records = {}
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def record(self, endpoint, size, elapsed):
+        with self.lock:
+            entry = self.records.setdefault(
+                endpoint, {"requests": 0, "bytes": 0, "seconds": 0.0}
+            )
+            entry["requests"] += 1
+            entry["bytes"] += size
+            entry["seconds"] += elapsed
+
+    def stats(self):
+        with self.lock:
+            return {
+                endpoint: {
+                    "requests": entry["requests"],
+                    "bytes": entry["bytes"],
+                    "avg_ms": round(entry["seconds"] / entry["requests"] * 1000, 3),
+                }
+                for endpoint, entry in self.records.items()
+            }
+
+    def resolve(self, name):
+        return self.aliases.get(name, name)
+
+    def reject(self):
+        with self.lock:
+            return self._rng.random() < self.reject_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload=None):
+        data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _dispatch(self):
+        started_at = time.perf_counter()
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        raw = self._body()
+
+        if self.state.latency_ms:
+            time.sleep(self.state.latency_ms / 1000)
+
+        endpoint = f"{self.command} /" + "/".join(
+            p if p.startswith("_") else "{index}" for p in parts
+        )
+        try:
+            status, payload = self._route(parts, params, raw)
+        except KeyError as e:
+            status, payload = 404, {"error": {"type": "index_not_found_exception", "reason": str(e)}, "status": 404}
+        self._send(status, payload)
+        self.state.record(endpoint, len(raw), time.perf_counter() - started_at)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+    def _route(self, parts, params, raw):
+        state = self.state
+        method = self.command
+        body = json.loads(raw) if raw and parts[-1:] not in (["_bulk"], ["_msearch"]) else {}
+
+        if not parts:
+            return 200, {"version": {"number": "2.13.0", "distribution": "opensearch"}}
+        if parts[0] == "_bulk":
+            return 200, self._bulk(raw)
+        if parts[0] == "_msearch":
+            return 200, self._msearch(raw)
+        if parts[0] in ("_cluster", "_search", "_plugins", "_aliases", "_alias", "_cat", "_tasks"):
+            return self._admin(parts, body)
+
+        name = parts[0]
+        index = state.resolve(name)
+        rest = parts[1:]
+
+        if not rest:
+            if method == "HEAD":
+                return (200 if index in state.indices else 404), None
+            if method == "PUT":
+                with state.lock:
+                    state.indices[index] = {"body": body, "docs": {}}
+                return 200, {"acknowledged": True, "index": index}
+            if method == "DELETE":
+                with state.lock:
+                    del state.indices[index]
+                return 200, {"acknowledged": True}
+            return 200, {index: state.indices[index]["body"]}
+        if rest[0] == "_alias":
+            # エイリアスでも実際のインデックスでも、実際のインデックス名をキーにして返す
+            with state.lock:
+                state.indices[index]
+                aliases = {alias: {} for alias, target in state.aliases.items() if target == index}
+            return 200, {index: {"aliases": aliases}}
+        if rest[0] == "_mapping":
+            mappings = state.indices[index]["body"].setdefault("mappings", {})
+            if method == "PUT":
+                with state.lock:
+                    if "_meta" in body:
+                        mappings["_meta"] = body["_meta"]
+                    mappings.setdefault("properties", {}).update(body.get("properties", {}))
+                return 200, {"acknowledged": True}
+            return 200, {index: {"mappings": mappings}}
+        if rest[0] == "_settings":
+            settings = state.indices[index].setdefault("settings", {})
+            if method == "PUT":
+                with state.lock:
+                    for key, value in body.get("index", body).items():
+                        settings[f"index.{key}"] = str(value)
+                return 200, {"acknowledged": True}
+            return 200, {index: {"settings": settings}}
+        if rest[0] == "_forcemerge" and params.get("wait_for_completion") == "false":
+            state.indices[index]
+            return 200, {"task": "stub:1"}
+        if rest[0] == "_search":
+            return 200, self._search(index, body, params.get("search_pipeline"))
+        if rest[0] == "_count":
+            return 200, {"count": len(state.indices[index]["docs"])}
+        # _settings, _refresh, _forcemerge など
+        state.indices[index]
+        return 200, {"acknowledged": True}
+
+    def _admin(self, parts, body):
+        state = self.state
+        if parts[0] == "_search" and len(parts) > 2:
+            with state.lock:
+                if self.command == "GET":
+                    pipeline = state.pipelines[parts[2]]
+                    return 200, {parts[2]: pipeline}
+                state.pipelines[parts[2]] = body
+            return 200, {"acknowledged": True}
+        if parts[0] == "_aliases":
+            with state.lock:
+                for action in body.get("actions", []):
+                    for op, spec in action.items():
+                        if op == "add":
+                            state.aliases[spec["alias"]] = spec["index"]
+                        elif op == "remove":
+                            state.aliases.pop(spec["alias"], None)
+                        elif op == "remove_index":
+                            del state.indices[spec["index"]]
+            return 200, {"acknowledged": True}
+        if parts[0] == "_alias":
+            with state.lock:
+                if parts[1] not in state.aliases:
+                    return 404, {"error": "alias not found", "status": 404}
+                index = state.aliases[parts[1]]
+            return 200, {index: {"aliases": {parts[1]: {}}}}
+        if parts[0] == "_tasks":
+            return 200, {"completed": True, "task": {}}
+        if parts[0] == "_cluster" and parts[1:] == ["settings"]:
+            with state.lock:
+                if self.command == "PUT":
+                    for scope in ("persistent", "transient"):
+                        for key, value in body.get(scope, {}).items():
+                            if value is None:
+                                state.cluster_settings[scope].pop(key, None)
+                            else:
+                                state.cluster_settings[scope][key] = str(value)
+                    return 200, {"acknowledged": True}
+                return 200, {scope: dict(values) for scope, values in state.cluster_settings.items()}
+        if parts[0] == "_cat":
+            return 200, [
+                {"index": name, "docs.count": str(len(idx["docs"]))}
+                for name, idx in state.indices.items()
+            ]
+        return 200, {"acknowledged": True}
+
+    def _bulk(self, raw):
+        state = self.state
+        lines = raw.decode("utf-8").splitlines()
+        items = []
+        i = 0
+        while i < len(lines):
+            if not lines[i].strip():
+                i += 1
+                continue
+            action = json.loads(lines[i])
+            op, meta = next(iter(action.items()))
+            index = state.resolve(meta["_index"])
+            _id = meta.get("_id") or f"auto-{time.monotonic_ns()}-{i}"
+            if op == "delete":
+                i += 1
+                with state.lock:
+                    found = state.indices[index]["docs"].pop(_id, None)
+                items.append({op: {"_index": index, "_id": _id, "status": 200 if found else 404}})
+                continue
+
+            source = json.loads(lines[i + 1])
+            i += 2
+            if state.reject():
+                items.append(
+                    {op: {"_index": index, "_id": _id, "status": 429, "error": {"type": "es_rejected_execution_exception"}}}
+                )
+                continue
+            if not state.store_vectors:
+                source.pop("vector", None)
+            with state.lock:
+                docs = state.indices[index]["docs"]
+                if op == "update" and _id not in docs:
+                    items.append(
+                        {op: {"_index": index, "_id": _id, "status": 404, "error": {"type": "document_missing_exception"}}}
+                    )
+                    continue
+                if op == "update" and "script" in source:
+                    # SHARED_DOCS_SCRIPT と同じ処理 (painless は実行しない)
+                    params = source["script"]["params"]
+                    names = [
+                        name
+                        for name in docs[_id].get("shared_docs", [])
+                        if name not in params["remove"]
+                    ]
+                    names += [name for name in params["add"] if name not in names]
+                    if names:
+                        docs[_id]["shared_docs"] = names
+                    else:
+                        docs[_id].pop("shared_docs", None)
+                elif op == "update":
+                    docs[_id].update(source.get("doc", {}))
+                else:
+                    docs[_id] = source
+            items.append({op: {"_index": index, "_id": _id, "status": 201, "result": "created"}})
+
+        errors = any(next(iter(item.values()))["status"] >= 300 for item in items)
+        return {"took": 1, "errors": errors, "items": items}
+
+    def _msearch(self, raw):
+        lines = [line for line in raw.decode("utf-8").splitlines() if line.strip()]
+        responses = []
+        for header, body in zip(lines[0::2], lines[1::2]):
+            header = json.loads(header)
+            index = self.state.resolve(header["index"])
+            try:
+                responses.append(
+                    self._search(index, json.loads(body), header.get("search_pipeline"))
+                )
+            except KeyError as e:
+                responses.append({"error": {"type": "index_not_found_exception", "reason": str(e)}, "status": 404})
+        return {"took": 1, "responses": responses}
+
+    def _score(self, query, doc):
+        if "match" in query:
+            terms = _tokens(query["match"]["keyword"]["query"])
+            return len(terms & _tokens(doc.get("keyword", ""))) or None
+        if "knn" in query:
+            knn_filter = query["knn"]["vector"].get("filter")
+            if knn_filter is not None and not self._matches(knn_filter, doc):
+                return None
+            vector = doc.get("vector")
+            if vector is None:
+                return random.random()
+            return (1 + _cosine(query["knn"]["vector"]["vector"], vector)) / 2
+        if "hybrid" in query:
+            scores = [self._score(q, doc) for q in query["hybrid"]["queries"]]
+            scores = [s for s in scores if s is not None]
+            return sum(scores) / len(scores) if scores else None
+        if "bool" in query:
+            if not all(self._matches(f, doc) for f in query["bool"].get("filter", [])):
+                return None
+            return self._score(query["bool"].get("must", [{"match_all": {}}])[0], doc)
+        return 1.0
+
+    def _matches(self, query, doc):
+        # filter 句は term / terms と、それらを組み合わせた bool.filter のみ対応する
+        if "bool" in query:
+            return all(self._matches(f, doc) for f in query["bool"].get("filter", []))
+        if "terms" in query:
+            field, values = next(iter(query["terms"].items()))
+            return doc.get(field) in values
+        if "term" in query:
+            field, value = next(iter(query["term"].items()))
+            return doc.get(field) == value
+        return True
+
+    def _search(self, index, body, search_pipeline=None):
+        with self.state.lock:
+            docs = list(self.state.indices[index]["docs"].items())
+        query = body.get("query", {"match_all": {}})
+        scored = []
+        for _id, doc in docs:
+            score = self._score(query, doc)
+            if score is not None:
+                scored.append((score, _id, doc))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        if search_pipeline and search_pipeline.startswith("collapse"):
+            # collapse レスポンスプロセッサと同様に doc_name ごとに先頭のヒットのみ残す
+            seen = set()
+            collapsed = []
+            for entry in scored:
+                name = entry[2].get("doc_name")
+                if name not in seen:
+                    seen.add(name)
+                    collapsed.append(entry)
+            scored = collapsed
+
+        # 検索時の collapse。inner_hits は同じ値のヒットの上位を返す
+        groups = {}
+        if "collapse" in body:
+            field = body["collapse"]["field"]
+            collapsed = []
+            for entry in scored:
+                value = entry[2].get(field)
+                if value not in groups:
+                    groups[value] = []
+                    collapsed.append(entry)
+                groups[value].append(entry)
+            scored = collapsed
+
+        start = body.get("from", 0)
+        size = body.get("size", 10)
+        fields = body.get("fields", [])
+        hits = []
+        for score, _id, doc in scored[start : start + size]:
+            hit = {
+                "_index": index,
+                "_id": _id,
+                "_score": score,
+                "fields": {f: [doc[f]] for f in fields if f in doc},
+            }
+            if isinstance(body.get("_source"), list):
+                hit["_source"] = {f: doc[f] for f in body["_source"] if f in doc}
+            if "sort" in body:
+                hit["sort"] = [score, _id]
+            inner = body.get("collapse", {}).get("inner_hits")
+            if inner:
+                group = groups[doc.get(body["collapse"]["field"])][: inner.get("size", 3)]
+                hit["inner_hits"] = {
+                    inner["name"]: {
+                        "hits": {
+                            "total": {"value": len(group), "relation": "eq"},
+                            "hits": [
+                                {
+                                    "_index": index,
+                                    "_id": inner_id,
+                                    "_score": inner_score,
+                                    "fields": {
+                                        f: [inner_doc[f]]
+                                        for f in inner.get("fields", [])
+                                        if f in inner_doc
+                                    },
+                                }
+                                for inner_score, inner_id, inner_doc in group
+                            ],
+                        }
+                    }
+                }
+            hits.append(hit)
+        response = {
+            "took": 1,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(scored), "relation": "eq"},
+                "max_score": scored[0][0] if scored else None,
+                "hits": hits,
+            },
+        }
+        # cardinality 集計のみ対応する
+        aggregations = {}
+        for name, agg in body.get("aggs", {}).items():
+            field = agg["cardinality"]["field"]
+            aggregations[name] = {"value": len({doc.get(field) for _, _, doc in scored})}
+        if aggregations:
+            response["aggregations"] = aggregations
+        return response
+
+
+class OpenSearchStub:
+    """
+    with OpenSearchStub() as stub: で起動し、stub.port に OpenSearch クライアントを接続する
+
+    Args:
+        latency_ms (float): 全てのリクエストに加えるレイテンシ
+        reject_rate (float): bulk の各ドキュメントを 429 で拒否する確率
+        store_vectors (bool): ベクトルを保存するかどうか (False の場合 knn のスコアはランダム)
+    """
+
+    def __init__(self, latency_ms=0, reject_rate=0.0, store_vectors=True, port=0):
+        self.state = StubState(latency_ms, reject_rate, store_vectors)
+        handler = type("Handler", (StubHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_index(self, name, body, docs=None):
+        """
+        HTTP を経由せずにインデックスを作成し、ドキュメントを登録する (検索ベンチマークの準備用)
+
+        Args:
+            docs (dict): ドキュメント ID と _source の対応
+        """
+        with self.state.lock:
+            self.state.indices[name] = {"body": body, "docs": dict(docs or {})}
+
+    def client(self, **kwargs):
+        from opensearchpy import OpenSearch
+
+        return OpenSearch(
+            hosts=[{"host": "127.0.0.1", "port": self.port}],
+            use_ssl=False,
+            pool_maxsize=20,
+            **kwargs,
+        )
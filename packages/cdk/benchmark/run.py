@@ -0,0 +1,85 @@
+"""
+ベンチマークをまとめて実行し、結果を 1 つの JSON にまとめる
+
+取り込み処理と検索用 Lambda は同じ名前のモジュール (embedding_cache など) を持つため、
+ベンチマークごとに別のプロセスで実行する。ピークメモリもベンチマークごとに計測される。
+
+    python3 packages/cdk/benchmark/run.py --suites split_text search --output result.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SUITES = {
+    "split_text": ["--sizes", "100000", "--repeat", "3"],
+    "ingest": ["--files", "100"],
+    "search": ["--files", "200", "--queries", "100"],
+    "vectors": ["--docs", "2000", "--queries", "50"],
+}
+SCRIPTS = {
+    "split_text": "split_text.py",
+    "ingest": "bench_ingest.py",
+    "search": "bench_search.py",
+    "vectors": "bench_vectors.py",
+}
+
+
+def run_suite(name, extra_args):
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "result.json")
+        command = [
+            sys.executable,
+            os.path.join(BENCHMARK_DIR, SCRIPTS[name]),
+            *SUITES[name],
+            *extra_args,
+            "--output",
+            output,
+        ]
+        start = time.perf_counter()
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if completed.returncode != 0:
+            return {"error": f"exit code {completed.returncode}"}
+        with open(output) as f:
+            return {"seconds": round(elapsed, 3), "result": json.load(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--suites", nargs="+", choices=list(SUITES), default=list(SUITES)
+    )
+    parser.add_argument("--output", type=str, default="")
+    args, extra_args = parser.parse_known_args()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "suites": {},
+    }
+    for name in args.suites:
+        print(f"Running {name} ...", file=sys.stderr)
+        # --suites に 1 つだけ指定した場合は、残りの引数をそのベンチマークに渡す
+        results["suites"][name] = run_suite(
+            name, extra_args if len(args.suites) == 1 else []
+        )
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if any("error" in suite for suite in results["suites"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+split_text のマイクロベンチマーク
+
+以前の正規表現による実装と chunker.split_text を、日本語・英語・句読点のないテキストで比較する。
+
+    python3 packages/cdk/benchmark/split_text.py [--sizes 100000 1000000] [--max-length 400]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "ecs", "ingest-data", "app")
+)
+
+import chunker  # noqa: E402
+from corpus import generate_text  # noqa: E402
+
+
+def legacy_split_text(text, max_length):
+    # 以前の OpenSearchController.split_text (比較用)
+    chunks = []
+    current_chunk = ""
+    current_length = 0
+
+    period_pattern = re.compile(r"[.!?][\s]")
+    kuten_pattern = re.compile(r"[。！？…\n]")
+
+    split_pattern = re.compile(
+        rf"(.{{1,{max_length}}}?({period_pattern.pattern}|{kuten_pattern.pattern}))",
+        flags=re.DOTALL,
+    )
+    find = split_pattern.finditer(text)
+
+    while list(find)[0].span()[0] != 0:
+        max_length += 10
+        split_pattern = re.compile(
+            rf"(.{{1,{max_length}}}?({period_pattern.pattern}|{kuten_pattern.pattern}))",
+            flags=re.DOTALL,
+        )
+        find = split_pattern.finditer(text)
+
+    for match in split_pattern.finditer(text):
+        chunk = match.group(1)
+        chunk_length = len(chunk)
+
+        if current_length + chunk_length <= max_length:
+            current_chunk += chunk
+            current_length += chunk_length
+        else:
+            chunks.append(current_chunk)
+            current_chunk = chunk
+            current_length = chunk_length
+
+    chunks.append(current_chunk)
+
+    return chunks
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(sizes, max_length=400, overlap=0, repeat=3, legacy_limit=2_000, verbose=True):
+    results = []
+    for kind in ["ja", "en", "nopunct"]:
+        for size in sizes:
+            text = generate_text(kind, size)
+            # 以前の実装は区切りが 1 つもないと例外になるため、末尾に句点を付ける
+            legacy_text = text if kind != "nopunct" else text + "。"
+
+            elapsed, chunks = measure(
+                lambda: chunker.split_text(text, max_length, overlap), repeat
+            )
+            row = {
+                "kind": kind,
+                "size": size,
+                "chunks": len(chunks),
+                "chunker_ms": round(elapsed * 1000, 3),
+                "chunker_mb_per_sec": round(size / elapsed / 1e6, 3),
+            }
+
+            if kind != "nopunct" or size <= legacy_limit:
+                elapsed, legacy_chunks = measure(
+                    lambda: legacy_split_text(legacy_text, max_length), 1
+                )
+                row["legacy_ms"] = round(elapsed * 1000, 3)
+                row["legacy_chunks"] = len(legacy_chunks)
+                row["speedup"] = round(row["legacy_ms"] / row["chunker_ms"], 1)
+
+            if verbose:
+                print(json.dumps(row))
+            results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--max-length", type=int, default=400)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=2_000,
+        help="句読点のないテキストで以前の実装を計測する最大サイズ (4000 文字で数十秒かかるため)",
+    )
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    results = run(
+        args.sizes, args.max_length, args.overlap, args.repeat, args.legacy_limit
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+複数のファイルのチャンクを 1 つのリクエストにまとめて埋め込むバッチャー
+
+Cohere Embed は 1 リクエストで最大 96 件のテキストを埋め込めるが、ファイルごとに分割して送ると
+小さいファイルが多いコーパスではほとんど空のリクエストが大量に発生する。
+各ワーカーから投入されたテキストを件数と文字数の上限まで詰めてから、並列にリクエストを送る。
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """
+    Args:
+        embed_batch (callable): テキストのリストを受け取り、同じ順序でベクトルのリストを返す関数
+        executor (ThreadPoolExecutor): embed_batch を実行するスレッドプール
+        max_texts (int): 1 リクエストあたりのテキスト数の上限
+        max_chars (int): 1 リクエストあたりの合計文字数の上限
+        max_wait (float): 上限に達していないバッチを送るまでに待つ時間 (秒)
+    """
+
+    def __init__(self, embed_batch, executor, max_texts=96, max_chars=50_000, max_wait=0.05):
+        self.embed_batch = embed_batch
+        self.executor = executor
+        self.max_texts = max_texts
+        self.max_chars = max_chars
+        self.max_wait = max_wait
+        self.batches = 0
+        self.texts = 0
+        self._pending = []
+        self._pending_chars = 0
+        self._oldest_at = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def embed(self, texts):
+        """
+        texts を他のワーカーのテキストと一緒にバッチに詰めて埋め込み、texts と同じ順序でベクトルを返す
+        """
+        futures = self.submit(texts)
+        return [future.result() for future in futures]
+
+    def submit(self, texts):
+        futures = [Future() for _ in texts]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            for text, future in zip(texts, futures):
+                self._pending.append((text, future))
+                self._pending_chars += len(text)
+            self._cond.notify()
+        return futures
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_batch_size": round(self.texts / self.batches, 1)
+                if self.batches
+                else 0,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _is_full(self):
+        return (
+            len(self._pending) >= self.max_texts
+            or self._pending_chars >= self.max_chars
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending and (self._is_full() or self._closed):
+                        break
+                    if self._pending:
+                        remaining = self._oldest_at + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._take_batch()
+
+            self.executor.submit(self._dispatch, batch)
+
+    def _take_batch(self):
+        # 件数と文字数の上限まで先頭から詰める。1 件で上限を超えるテキストはそのまま 1 件で送る
+        size = 0
+        chars = 0
+        for text, _ in self._pending:
+            if size >= self.max_texts or (size and chars + len(text) > self.max_chars):
+                break
+            size += 1
+            chars += len(text)
+
+        batch = self._pending[:size]
+        self._pending = self._pending[size:]
+        self._pending_chars -= chars
+        self._oldest_at = time.monotonic() if self._pending else None
+        self.batches += 1
+        self.texts += size
+        return batch
+
+    def _dispatch(self, batch):
+        try:
+            vectors = self.embed_batch([text for text, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
@@ -0,0 +1,322 @@
+"""
+OpenSearch への bulk 登録
+
+helpers.streaming_bulk は件数で区切ったリクエストを 1 つずつ送り、429 (es_rejected_execution_exception)
+で拒否されたアイテムの扱いも呼び出し元に任される。BulkWriter は bulk リクエストをバイト数で区切り、
+複数のワーカーで並列に送る。拒否されたアイテムだけをバックオフしながら再送し、
+最終的に登録できなかったアイテムはデッドレターファイルに書き出す。
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+from opensearchpy.exceptions import TransportError
+
+import utils
+from rate_limit import RETRY, THROTTLED, AdaptiveRateLimiter
+
+# アイテム単位・リクエスト単位で再送する HTTP ステータス
+RETRY_STATUSES = {429, 502, 503, 504}
+# bulk の 1 行目 (アクション行) に含めるメタデータのキー
+METADATA_KEYS = ("_index", "_id", "_routing")
+
+
+def classify_bulk_error(e):
+    """
+    bulk リクエスト全体のエラーを AdaptiveRateLimiter の再試行の分類に変換する
+    """
+    if not isinstance(e, TransportError):
+        return None
+    status = getattr(e, "status_code", None)
+    if status == 429:
+        return THROTTLED
+    # タイムアウトや接続エラーも、ID が決まっているため同じ内容で再送してよい
+    if isinstance(e, OpenSearchConnectionError) or status in RETRY_STATUSES:
+        return RETRY
+    return None
+
+
+def classify_bulk_response(response):
+    # 一部のアイテムだけが 429 で拒否された場合も、同時リクエスト数を下げる
+    if any(
+        next(iter(item.values())).get("status") == 429 for item in response["items"]
+    ):
+        return THROTTLED
+    return None
+
+
+def encode_action(action):
+    """
+    bulk API の NDJSON の行に変換する
+
+    Returns:
+        bytes: アクション行 (delete 以外はドキュメントの行を含む)
+    """
+    action = dict(action)
+    op_type = action.pop("_op_type", "index")
+    metadata = {key: action.pop(key) for key in METADATA_KEYS if key in action}
+    lines = [json.dumps({op_type: metadata}, ensure_ascii=False)]
+    if op_type != "delete":
+        lines.append(json.dumps(action, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class DeadLetterFile:
+    """
+    登録できなかったアイテムを JSON Lines で書き出す。uri に S3 URI を指定した場合は close() でアップロードする
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            if self._file is None:
+                path = self.uri
+                if self.uri.startswith("s3://"):
+                    fd, path = tempfile.mkstemp(suffix=".jsonl")
+                    os.close(fd)
+                self._file = open(path, "w", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            if self.uri.startswith("s3://"):
+                bucket, key, _ = utils.parse_s3_uri(self.uri)
+                utils.s3_client.upload_file(self._file.name, bucket, key)
+                os.remove(self._file.name)
+            print(f"{self.count} failed items were written to {self.uri}")
+            self._file = None
+
+
+class BulkWriter:
+    """
+    Args:
+        client (OpenSearch): OpenSearch クライアント。ワーカーはクライアントのコネクションプールを共有する
+        workers (int): 同時に送る bulk リクエスト数の上限
+        max_bytes (int): 1 回の bulk リクエストのサイズの上限 (バイト)
+        max_docs (int): 1 回の bulk リクエストに含めるアイテム数の上限
+        max_retries (int): 拒否されたアイテムを再送する回数
+        base_delay (float): バックオフの初期値 (秒)
+        max_delay (float): バックオフの最大値 (秒)
+        request_timeout (float): 1 回の bulk リクエストのタイムアウト (秒)
+        dead_letter_uri (str): 登録できなかったアイテムの書き出し先 (ローカルパスか S3 URI)。空の場合は書き出さない
+        metrics (Metrics): bulk リクエストの処理時間を記録する先
+    """
+
+    def __init__(
+        self,
+        client,
+        workers=4,
+        max_bytes=5 * 1024 * 1024,
+        max_docs=1000,
+        max_retries=8,
+        base_delay=0.5,
+        max_delay=30.0,
+        request_timeout=120,
+        dead_letter_uri="",
+        metrics=None,
+    ):
+        self.client = client
+        self.workers = max(1, workers)
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.dead_letter = DeadLetterFile(dead_letter_uri) if dead_letter_uri else None
+        self.metrics = metrics
+
+        # 429 を受け取ったら同時リクエスト数を半分にし、成功するたびに少しずつ戻す (AIMD)。
+        # リクエスト全体のエラーは limiter の中で再送し、拒否されたアイテムの再送は _send() で行う
+        self.limiter = AdaptiveRateLimiter(
+            max_concurrency=self.workers,
+            max_retries=max_retries,
+            base_delay=base_delay,
+            max_delay=max_delay,
+            classify=classify_bulk_error,
+            classify_result=classify_bulk_response,
+        )
+        self.requests = 0
+        self.bytes = 0
+        self.indexed = 0
+        self.rejected = 0
+        self.retried = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def write(self, actions):
+        """
+        actions を bulk 登録し、アイテムごとに (ok, item, elapsed) を返すジェネレータ
+
+        item は helpers.streaming_bulk と同じ {"index": {"_id": ..., "status": ...}} の形式。
+        elapsed はアイテムを含むバッチの登録にかかった時間 (再送とバックオフを含む) をアイテム数で割った秒数で、
+        全アイテムの合計がワーカーの処理時間になる。
+        リクエストは並列に送るため、結果の順序は actions の順序と一致しない。
+        """
+        self.started_at = time.monotonic()
+        pending = set()
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="bulk"
+        ) as executor:
+            for batch in self._batches(actions):
+                # 送信待ちのバッチがたまりすぎないように、結果を受け取ってから次のバッチを作る
+                while len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from self._results(future.result())
+                pending.add(executor.submit(self._send, batch))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self._results(future.result())
+        self.finished_at = time.monotonic()
+
+    def close(self):
+        if self.dead_letter is not None:
+            self.dead_letter.close()
+
+    def stats(self):
+        limiter = self.limiter.stats()
+        with self._lock:
+            end = self.finished_at or time.monotonic()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "indexed": self.indexed,
+                "docs_per_sec": round(self.indexed / elapsed, 1) if elapsed else 0.0,
+                "requests": self.requests,
+                "megabytes": round(self.bytes / 1024 / 1024, 1),
+                "rejected": self.rejected,
+                "retried": self.retried,
+                "failed": self.failed,
+                "concurrency_limit": limiter["concurrency_limit"],
+                # リクエスト全体のエラー (429、5xx、接続エラー) で再送した回数
+                "request_retries": limiter["retried"],
+            }
+
+    def _batches(self, actions):
+        batch = []
+        size = 0
+        for action in actions:
+            line = encode_action(action)
+            # 1 件で上限を超えるアイテムはそのまま 1 件で送る
+            if batch and (
+                size + len(line) > self.max_bytes or len(batch) >= self.max_docs
+            ):
+                yield batch
+                batch = []
+                size = 0
+            batch.append((action, line))
+            size += len(line)
+        if batch:
+            yield batch
+
+    def _send(self, batch):
+        """
+        batch を登録し、アイテムごとに (ok, item, action) のリストと処理時間 (秒) を返す
+        """
+        start = time.perf_counter()
+        results = []
+        attempt = 0
+        while batch:
+            retry = []
+            try:
+                response = self.limiter.call(
+                    self._request, b"".join(line for _, line in batch), len(batch)
+                )
+            except TransportError as e:
+                # 再送しても成功しなかった、または再送しないエラー
+                status = getattr(e, "status_code", None)
+                results.extend(self._failed(batch, status, str(e)))
+                break
+            else:
+                for (action, line), item in zip(batch, response["items"]):
+                    result = next(iter(item.values()))
+                    status = result.get("status", 0)
+                    if status in RETRY_STATUSES:
+                        if status == 429:
+                            self._count(rejected=1)
+                        retry.append((action, line))
+                    else:
+                        ok = 200 <= status < 300 or _is_missing_delete(item)
+                        results.append((ok, item, action))
+
+            if not retry:
+                break
+            if attempt >= self.max_retries:
+                results.extend(self._failed(retry, None, "Retry limit exceeded"))
+                break
+            self._count(retried=len(retry))
+            self.limiter.backoff(attempt)
+            attempt += 1
+            batch = retry
+        return results, time.perf_counter() - start
+
+    def _request(self, body, items):
+        start = time.perf_counter()
+        error = False
+        try:
+            return self.client.bulk(body=body, request_timeout=self.request_timeout)
+        except TransportError as e:
+            error = True
+            if getattr(e, "status_code", None) == 429:
+                self._count(rejected=items)
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe(
+                    "bulk_request", (time.perf_counter() - start) * 1000, error
+                )
+                self.metrics.count("bulk_bytes", len(body))
+            self._count(requests=1, bytes=len(body))
+
+    def _failed(self, batch, status, error):
+        results = []
+        for action, _ in batch:
+            op_type = action.get("_op_type", "index")
+            item = {op_type: {"_id": action.get("_id"), "status": status, "error": error}}
+            results.append((False, item, action))
+        return results
+
+    def _results(self, sent):
+        results, elapsed = sent
+        share = elapsed / len(results) if results else 0.0
+        for ok, item, action in results:
+            if ok:
+                self._count(indexed=1)
+            else:
+                self._count(failed=1)
+                if self.dead_letter is not None:
+                    # ベクトルは再取り込み時に埋め込みのキャッシュから復元できるため書き出さない
+                    self.dead_letter.write(
+                        {
+                            "item": item,
+                            "action": {k: v for k, v in action.items() if k != "vector"},
+                        }
+                    )
+            yield ok, item, share
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+def _is_missing_delete(item):
+    # 削除対象のドキュメントが既に存在しない場合は成功とみなす
+    result = item.get("delete")
+    return result is not None and result.get("status") == 404
@@ -0,0 +1,72 @@
+import re
+
+
+# 文の区切り。英語は「.!?」の後の空白まで、日本語は句点などの 1 文字までを文に含める
+SENTENCE_END_PATTERN = re.compile(r"[.!?]\s|[。！？…\n]")
+
+
+def sentence_spans(text, max_length):
+    """
+    テキストを 1 回だけ走査して、文の開始位置と終了位置を返す
+
+    max_length を超える文 (句読点のない長い文など) は max_length ごとに分割する。
+    """
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        end = match.end()
+        yield from _hard_split(start, end, max_length)
+        start = end
+    if start < len(text):
+        yield from _hard_split(start, len(text), max_length)
+
+
+def _hard_split(start, end, max_length):
+    while end - start > max_length:
+        yield start, start + max_length
+        start += max_length
+    if start < end:
+        yield start, end
+
+
+def split_text_with_offsets(text, max_length, overlap=0):
+    """
+    テキストを文の区切りで max_length 文字以内のチャンクに分割する
+
+    Args:
+        text (str): 分割するテキスト
+        max_length (int): チャンクの最大文字数
+        overlap (int): 前のチャンクの末尾の文を、この文字数以内で次のチャンクの先頭に含める
+    Returns:
+        list[tuple]: (チャンク, 開始位置, 終了位置) のリスト。チャンクは text[開始位置:終了位置]
+    """
+    spans = list(sentence_spans(text, max_length))
+    chunks = []
+
+    i = 0
+    while i < len(spans):
+        begin = spans[i][0]
+        j = i
+        while j < len(spans) and spans[j][1] - begin <= max_length:
+            j += 1
+        end = spans[j - 1][1]
+        chunks.append((text[begin:end], begin, end))
+
+        if j >= len(spans):
+            break
+
+        # 次のチャンクの先頭を、overlap 文字以内に収まる分だけ前の文に戻す
+        k = j
+        if overlap > 0:
+            while k - 1 > i and end - spans[k - 1][0] <= overlap:
+                k -= 1
+            while k < j and spans[j][1] - spans[k][0] > max_length:
+                k += 1
+        i = k
+
+    return chunks
+
+
+def split_text(text, max_length, overlap=0):
+    return [
+        chunk for chunk, _, _ in split_text_with_offsets(text, max_length, overlap)
+    ]
@@ -0,0 +1,134 @@
+"""
+チャンクの重複・ほぼ重複の検出
+
+ヘッダー、フッター、免責事項などの定型文や、別のファイルからコピーされた節は、同じ内容のチャンクになる。
+正規化したテキストのハッシュで完全一致を、文字 n-gram の SimHash でほぼ一致を検出し、
+2 回目以降に現れたチャンクはベクトル変換とインデックス登録を省略する。
+"""
+
+import hashlib
+import threading
+
+from embedding_cache import normalize_text
+
+SIMHASH_BITS = 64
+
+
+def shingles(text, size=3):
+    """
+    文字 n-gram。日本語は単語の区切りがないため、単語ではなく文字単位で分割する
+    """
+    if len(text) <= size:
+        return [text]
+    return [text[i : i + size] for i in range(len(text) - size + 1)]
+
+
+# 各ビットを取り出す変換表。bytes.translate と bytes.count で、ビットごとの 1 の数を C の処理で数える
+_BIT_TABLES = [bytes(byte >> bit & 1 for byte in range(256)) for bit in range(8)]
+
+
+def simhash(text, size=3):
+    """
+    文字 n-gram の 64 ビット SimHash。似たテキストほどハミング距離が小さくなる
+    """
+    grams = shingles(text, size)
+    digests = b"".join(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        for shingle in grams
+    )
+
+    # 半数より多くの n-gram で 1 になったビットを 1 にする。ハッシュ値はリトルエンディアンで扱う
+    fingerprint = 0
+    for i in range(SIMHASH_BITS // 8):
+        column = digests[i::8]
+        for bit, table in enumerate(_BIT_TABLES):
+            if column.translate(table).count(1) * 2 > len(grams):
+                fingerprint |= 1 << (i * 8 + bit)
+    return fingerprint
+
+
+class ChunkDeduplicator:
+    """
+    Args:
+        near (bool): ほぼ一致 (SimHash のハミング距離が max_distance 以下) も重複とみなすかどうか
+        max_distance (int): ほぼ一致とみなす SimHash のハミング距離の上限
+        min_length (int): ほぼ一致の判定を行うチャンクの最小文字数 (短いテキストの SimHash は誤判定しやすい)
+    """
+
+    def __init__(self, near=True, max_distance=3, min_length=50):
+        self.near = near
+        self.max_distance = max_distance
+        self.min_length = min_length
+        # ハミング距離が max_distance 以下の 2 つの値は、max_distance + 1 個に分割したブロックのいずれかが一致する
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.unique = 0
+        self._exact = {}
+        self._fingerprints = {}
+        self._band_tables = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+
+    def fingerprint(self, text):
+        """
+        重複の判定に使う値 (正規化したテキストのハッシュと SimHash) を計算する
+
+        ロックを取らないため、チャンク分割のワーカーなどで並列に計算しておき、find_or_add に渡せる。
+        """
+        normalized = normalize_text(text)
+        digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+        simhash_value = None
+        if self.near and len(normalized) >= self.min_length:
+            simhash_value = simhash(normalized)
+        return digest, simhash_value
+
+    def find_or_add(self, text, key, fingerprint=None):
+        """
+        text と重複するチャンクが登録済みであればそのキーを返し、なければ key で登録して None を返す
+
+        Args:
+            fingerprint (tuple): fingerprint(text) の戻り値。省略時はここで計算する
+        """
+        digest, simhash_value = fingerprint or self.fingerprint(text)
+
+        with self._lock:
+            existing = self._exact.get(digest)
+            if existing is not None:
+                self.exact_duplicates += 1
+                return existing
+
+            if simhash_value is not None:
+                existing = self._find_near(simhash_value)
+                if existing is not None:
+                    self.near_duplicates += 1
+                    return existing
+
+            self._exact[digest] = key
+            if simhash_value is not None:
+                self._fingerprints[key] = simhash_value
+                for band, table in zip(self._bands(simhash_value), self._band_tables):
+                    table.setdefault(band, []).append(key)
+            self.unique += 1
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "unique": self.unique,
+                "exact_duplicates": self.exact_duplicates,
+                "near_duplicates": self.near_duplicates,
+            }
+
+    def _bands(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [
+            fingerprint >> (i * self.band_bits) & mask for i in range(self.bands)
+        ]
+
+    def _find_near(self, fingerprint):
+        for band, table in zip(self._bands(fingerprint), self._band_tables):
+            for key in table.get(band, ()):
+                if (self._fingerprints[key] ^ fingerprint).bit_count() <= self.max_distance:
+                    return key
+        return None
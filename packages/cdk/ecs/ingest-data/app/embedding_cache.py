@@ -0,0 +1,179 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+import utils
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model_id, input_type, text):
+    """
+    モデル ID、入力種別 (Cohere の input_type など) と正規化したテキストのハッシュからキャッシュのキーを作る
+    """
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_id}:{input_type}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルのキャッシュのインターフェース
+
+    get_many / put_many を実装すればバックエンドを差し替えられる。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        Returns:
+            dict: キャッシュにあったキーとベクトルの対応
+        """
+        found = self._get_many(keys)
+        hits = sum(1 for key in keys if key in found)
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """
+        Args:
+            items (list[tuple]): (キー, ベクトル) のリスト
+        """
+        self._put_many(items)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _get_many(self, keys):
+        raise NotImplementedError
+
+    def _put_many(self, items):
+        raise NotImplementedError
+
+
+class LRUEmbeddingCache(EmbeddingCache):
+    def __init__(self, max_entries=10000):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def _put_many(self, items):
+        with self._lock:
+            for key, vector in items:
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """
+    SQLite にベクトルを float32 のバイト列で保存するキャッシュ
+
+    uri に S3 URI を指定した場合は、開始時にダウンロードし、close() でアップロードする。
+    """
+
+    def __init__(self, uri):
+        super().__init__()
+        self.uri = uri
+        self.path = uri
+        if uri.startswith("s3://"):
+            self.path = os.path.join(tempfile.gettempdir(), "embedding-cache.sqlite")
+            self._download()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._conn.commit()
+
+    def _get_many(self, keys):
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # SQLite のプレースホルダー数の上限を超えないように分割して問い合わせる
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _put_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+        if self.uri.startswith("s3://"):
+            self._upload()
+
+    def _download(self):
+        bucket, key, _ = utils.parse_s3_uri(self.uri)
+        try:
+            utils.s3_client.download_file(bucket, key, self.path)
+            print(f"Embedding cache was downloaded: {self.uri}")
+        except Exception as e:
+            print(f"[WARN] Embedding cache was not found, start with empty cache: {e}")
+
+    def _upload(self):
+        bucket, key, _ = utils.parse_s3_uri(self.uri)
+        utils.s3_client.upload_file(self.path, bucket, key)
+        print(f"Embedding cache was uploaded: {self.uri}")
+
+
+def open_embedding_cache(uri):
+    """
+    Args:
+        uri (str): SQLite ファイルのパスか S3 URI。"memory" の場合はメモリ上の LRU キャッシュ、空の場合はキャッシュしない
+    """
+    if not uri:
+        return None
+    if uri == "memory":
+        return LRUEmbeddingCache()
+    return SQLiteEmbeddingCache(uri)
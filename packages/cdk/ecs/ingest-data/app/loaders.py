@@ -0,0 +1,146 @@
+"""
+拡張子ごとのテキスト抽出処理 (ローダー) の登録と呼び出し
+
+ローダーが使うライブラリは、その拡張子のファイルを初めて読み込む時に import する。
+テキストファイルだけのコーパスでは unstructured などの重いライブラリを読み込まない。
+新しい形式に対応する場合は、register_loader() で関数を登録する。
+"""
+
+import importlib
+import threading
+import time
+from html.parser import HTMLParser
+
+# {拡張子: {ローダー名: 関数}}
+LOADERS = {}
+# 拡張子ごとに使用するローダー名
+DEFAULT_LOADERS = {}
+
+# 遅延 import したモジュールと、import にかかった時間 (秒)
+IMPORT_TIMES = {}
+_import_lock = threading.Lock()
+
+
+def register_loader(extension, name, default=False):
+    """
+    ローダーを登録するデコレータ。関数はバイナリモードのファイルオブジェクトを受け取り、テキストを返す
+    """
+
+    def decorator(func):
+        LOADERS.setdefault(extension, {})[name] = func
+        if default or extension not in DEFAULT_LOADERS:
+            DEFAULT_LOADERS[extension] = name
+        return func
+
+    return decorator
+
+
+def lazy_import(module_name):
+    """
+    モジュールを import し、初回の import にかかった時間を記録する
+    """
+    with _import_lock:
+        if module_name in IMPORT_TIMES:
+            return importlib.import_module(module_name)
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        IMPORT_TIMES[module_name] = time.perf_counter() - start
+        return module
+
+
+def import_stats():
+    with _import_lock:
+        return {name: round(seconds, 3) for name, seconds in IMPORT_TIMES.items()}
+
+
+def get_loader(extension, name=None):
+    """
+    Args:
+        extension (str): 拡張子 (.pdf)
+        name (str): ローダー名。省略時は拡張子ごとの既定のローダー
+    Returns:
+        登録された関数。対応していない拡張子の場合は None
+    """
+    loaders = LOADERS.get(extension)
+    if not loaders:
+        return None
+    name = name or DEFAULT_LOADERS[extension]
+    if name not in loaders:
+        raise ValueError(f"Unknown loader {name} for {extension}")
+    return loaders[name]
+
+
+def remove_line_breaks(text):
+    return text.replace("\n", "").replace("\r", "").replace("\u00A0", " ")
+
+
+@register_loader(".txt", "text")
+def load_text(f):
+    return f.read().decode("utf-8")
+
+
+@register_loader(".pdf", "pypdf")
+def load_pdf(f):
+    pypdf = lazy_import("pypdf")
+    reader = pypdf.PdfReader(f)
+    text = ""
+    for page in reader.pages:
+        page_content = page.extract_text()
+        try:
+            text += bytes(page_content, "latin1").decode("shift_jis")
+        except UnicodeEncodeError:
+            text += page_content
+        except UnicodeDecodeError:
+            text += "Unicode Decode Error"
+
+    return remove_line_breaks(text)
+
+
+@register_loader(".docx", "docx2txt")
+def load_word(f):
+    docx2txt = lazy_import("docx2txt")
+    return docx2txt.process(f)
+
+
+@register_loader(".pptx", "unstructured")
+def load_ppt(f):
+    partition = lazy_import("unstructured.partition.pptx")
+    elements = partition.partition_pptx(file=f)
+    return "\n\n".join(str(element) for element in elements)
+
+
+class _TextExtractor(HTMLParser):
+    # 本文として扱わない要素
+    SKIP_TAGS = {"script", "style", "noscript", "template", "head"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth and data.strip():
+            self.parts.append(data.strip())
+
+
+@register_loader(".html", "html.parser")
+def load_html(f):
+    parser = _TextExtractor()
+    parser.feed(f.read().decode("utf-8", errors="replace"))
+    parser.close()
+    return remove_line_breaks("\n\n".join(parser.parts))
+
+
+@register_loader(".html", "unstructured")
+def load_html_unstructured(f):
+    partition = lazy_import("unstructured.partition.html")
+    elements = partition.partition_html(file=f)
+    return remove_line_breaks("\n\n".join(str(element) for element in elements))
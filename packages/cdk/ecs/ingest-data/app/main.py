@@ -1,3 +1,8 @@
+import time
+
+# 起動から取り込み開始までの時間 (ライブラリの import を含む) を計測する
+STARTED_AT = time.perf_counter()
+
 import argparse
 import os
 import requests
@@ -19,6 +24,22 @@ def get_exec_id() -> str:
     return task_id
 
 
+def parse_extension_map(value, cast=str):
+    """
+    ".pdf=600,.html=30" 形式の文字列を拡張子をキーとする dict に変換する
+    """
+    result = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        extension, item_value = item.split("=")
+        extension = extension.strip()
+        if not extension.startswith("."):
+            extension = "." + extension
+        result[extension] = cast(item_value.strip())
+    return result
+
+
 def ingest_data(
     host_http, index_name, dimension, model_id, docs_url, bedrock_region
 ):
@@ -31,6 +52,34 @@ def ingest_data(
         exec_id = "FAILED_TO_GET_ECS_EXEC_ID"
 
     print("exec_id:", exec_id)
+    print(f"Startup took {time.perf_counter() - STARTED_AT:.3f}s")
+
+    # 取り込み済みファイルのマニフェストの保存先。未指定の場合はドキュメントバケットに保存し、"none" の場合は使用しない。
+    # {index} は取り込み先のインデックス名 (バージョン付きの名前) に置き換えられる
+    manifest_uri = os.environ.get("INGEST_MANIFEST_URI", "")
+    if not manifest_uri:
+        bucket = docs_url.split("/")[2]
+        manifest_uri = f"s3://{bucket}/manifests/{{index}}.json"
+    elif manifest_uri == "none":
+        manifest_uri = ""
+
+    # bulk 登録できなかったアイテムの書き出し先。未指定の場合はドキュメントバケットに保存し、"none" の場合は書き出さない
+    dead_letter_uri = os.environ.get("INGEST_BULK_DEAD_LETTER_URI", "")
+    if not dead_letter_uri:
+        bucket = docs_url.split("/")[2]
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        dead_letter_uri = f"s3://{bucket}/dead-letters/{index_name}-{timestamp}.jsonl"
+    elif dead_letter_uri == "none":
+        dead_letter_uri = ""
+
+    # サンプリングプロファイラの結果の書き出し先。未指定の場合はドキュメントバケットに保存する
+    profile_uri = os.environ.get("INGEST_PROFILE_URI", "")
+    if not profile_uri:
+        bucket = docs_url.split("/")[2]
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        profile_uri = f"s3://{bucket}/profiles/{index_name}-{timestamp}.folded"
+
+    vector_decimals = os.environ.get("INGEST_VECTOR_DECIMALS", "6")
 
     cfg = {
         "host_http": host_http,
@@ -40,6 +89,112 @@ def ingest_data(
         "docs_url": docs_url,
         "bedrock_region": bedrock_region,
         "max_chunk_length": 400,
+        # true の場合は新しいバージョンのインデックスを作成して全件を取り込み、検証後にエイリアスを切り替える
+        "rebuild": os.environ.get("INGEST_REBUILD", "false").lower() == "true",
+        # エイリアスを切り替える条件: bulk 登録に失敗したチャンクの割合の上限と、現在のインデックスに対するドキュメント数の比率の下限
+        "swap_max_failure_rate": float(
+            os.environ.get("INGEST_SWAP_MAX_FAILURE_RATE", 0.01)
+        ),
+        "swap_min_doc_ratio": float(os.environ.get("INGEST_SWAP_MIN_DOC_RATIO", 0.9)),
+        # HNSW インデックスのパラメータ
+        "hnsw_m": int(os.environ.get("INGEST_HNSW_M", 16)),
+        "hnsw_ef_construction": int(
+            os.environ.get("INGEST_HNSW_EF_CONSTRUCTION", 100)
+        ),
+        # ベクトルの保存形式 (float、byte、fp16、lucene_sq、binary) と、bulk 登録時に残す小数点以下の桁数 (空の場合は丸めない)
+        "vector_storage": os.environ.get("INGEST_VECTOR_STORAGE", "float"),
+        "vector_decimals": int(vector_decimals) if vector_decimals else None,
+        # 一括構築モード (auto、on、off)。auto の場合は新しく作成したインデックスへの取り込みのみ、
+        # レプリカを 0 にして refresh を止め、取り込み後に force merge する
+        "build_mode": os.environ.get("INGEST_BUILD_MODE", "auto"),
+        "knn_build_threads": int(os.environ.get("INGEST_KNN_BUILD_THREADS", 4)),
+        "force_merge_segments": int(os.environ.get("INGEST_FORCE_MERGE_SEGMENTS", 1)),
+        "force_merge_timeout": int(os.environ.get("INGEST_FORCE_MERGE_TIMEOUT", 3600)),
+        "knn_warmup": os.environ.get("INGEST_KNN_WARMUP", "false").lower() == "true",
+        # 取り込み後の refresh_interval
+        "refresh_interval": os.environ.get("INGEST_REFRESH_INTERVAL", "60s"),
+        # 前のチャンクの末尾の文を、この文字数以内で次のチャンクにも含める
+        "chunk_overlap": int(os.environ.get("INGEST_CHUNK_OVERLAP", 0)),
+        # 重複したチャンクの除去 (off、exact、near) と、ほぼ一致とみなす SimHash の距離、判定する最小文字数
+        "dedup": os.environ.get("INGEST_DEDUP", "off"),
+        "dedup_max_distance": int(os.environ.get("INGEST_DEDUP_MAX_DISTANCE", 3)),
+        "dedup_min_length": int(os.environ.get("INGEST_DEDUP_MIN_LENGTH", 50)),
+        # パイプラインの各ステージのワーカー数とステージ間キューの長さ
+        "download_workers": int(os.environ.get("INGEST_DOWNLOAD_WORKERS", 8)),
+        "parse_workers": int(os.environ.get("INGEST_PARSE_WORKERS", 2)),
+        # PDF などのテキスト変換を行うプロセス数 (0 の場合はスレッドで変換する)、ワーカーの再起動間隔、タイムアウト
+        "parse_processes": int(
+            os.environ.get("INGEST_PARSE_PROCESSES", os.cpu_count() or 1)
+        ),
+        "parse_max_tasks_per_child": int(
+            os.environ.get("INGEST_PARSE_MAX_TASKS_PER_CHILD", 50)
+        ),
+        "parse_timeouts": parse_extension_map(
+            os.environ.get("INGEST_PARSE_TIMEOUTS", ""), float
+        ),
+        # 拡張子ごとに使用するローダー (loaders.py)。例 ".html=unstructured"
+        "loaders": parse_extension_map(os.environ.get("INGEST_LOADERS", "")),
+        "chunk_workers": int(os.environ.get("INGEST_CHUNK_WORKERS", 1)),
+        "embed_workers": int(os.environ.get("INGEST_EMBED_WORKERS", 8)),
+        # 同時に送る bulk リクエスト数 (OpenSearch クライアントのコネクションプールの大きさ 20 まで)
+        "index_workers": int(os.environ.get("INGEST_INDEX_WORKERS", 4)),
+        # Bedrock の同時リクエスト数の上限と、1 秒あたりのリクエスト数の上限 (0 の場合は制限しない)
+        "embed_concurrency": int(os.environ.get("INGEST_EMBED_CONCURRENCY", 16)),
+        "embed_max_tps": float(os.environ.get("INGEST_EMBED_MAX_TPS", 0)),
+        "embed_max_retries": int(os.environ.get("INGEST_EMBED_MAX_RETRIES", 8)),
+        # Cohere で 1 リクエストにまとめるテキスト数と合計文字数の上限、バッチが埋まるのを待つ時間 (秒)
+        "embed_batch_max_texts": int(
+            os.environ.get("INGEST_EMBED_BATCH_MAX_TEXTS", 96)
+        ),
+        "embed_batch_max_chars": int(
+            os.environ.get("INGEST_EMBED_BATCH_MAX_CHARS", 50000)
+        ),
+        "embed_batch_max_wait": float(
+            os.environ.get("INGEST_EMBED_BATCH_MAX_WAIT", 0.05)
+        ),
+        # 埋め込みベクトルのキャッシュ (SQLite ファイルのパスか S3 URI)。空の場合はキャッシュしない
+        "embedding_cache_uri": os.environ.get(
+            "INGEST_EMBEDDING_CACHE_URI", "/tmp/embedding-cache.sqlite"
+        ),
+        # S3 の一覧を 1 回に取得する件数と、大きいファイルのレンジ GET の設定
+        "list_page_size": int(os.environ.get("INGEST_LIST_PAGE_SIZE", 1000)),
+        "download_part_size": int(
+            os.environ.get("INGEST_DOWNLOAD_PART_SIZE", 8 * 1024 * 1024)
+        ),
+        "download_part_concurrency": int(
+            os.environ.get("INGEST_DOWNLOAD_PART_CONCURRENCY", 4)
+        ),
+        # ダウンロードしたファイルをメモリ上に保持するサイズの上限。超えた場合は一時ファイルに書き出す
+        "download_spill_size": int(
+            os.environ.get("INGEST_DOWNLOAD_SPILL_SIZE", 16 * 1024 * 1024)
+        ),
+        "queue_size": int(os.environ.get("INGEST_QUEUE_SIZE", 16)),
+        "report_interval": int(os.environ.get("INGEST_REPORT_INTERVAL", 60)),
+        # bulk リクエストはサイズ (バイト) で区切り、件数の上限は念のための上限として使う
+        "bulk_chunk_size": int(os.environ.get("INGEST_BULK_CHUNK_SIZE", 1000)),
+        "bulk_max_bytes": int(
+            os.environ.get("INGEST_BULK_MAX_BYTES", 5 * 1024 * 1024)
+        ),
+        # 429 で拒否されたアイテムを再送する回数と、1 回の bulk リクエストのタイムアウト (秒)
+        "bulk_max_retries": int(os.environ.get("INGEST_BULK_MAX_RETRIES", 8)),
+        "bulk_request_timeout": float(
+            os.environ.get("INGEST_BULK_REQUEST_TIMEOUT", 120)
+        ),
+        "bulk_dead_letter_uri": dead_letter_uri,
+        "manifest_uri": manifest_uri,
+        "manifest_checkpoint_interval": int(
+            os.environ.get("INGEST_MANIFEST_CHECKPOINT_INTERVAL", 60)
+        ),
+        # 処理時間のメトリクスを EMF のログで出力するかどうかと、その名前空間。
+        # INGEST_METRICS_URI を指定した場合は累計を JSON (拡張子が .prom の場合は Prometheus の形式) でも書き出す
+        "metrics_emf": os.environ.get("INGEST_METRICS_EMF", "true").lower() == "true",
+        "metrics_namespace": os.environ.get(
+            "INGEST_METRICS_NAMESPACE", "IntelligentSearch/Ingest"
+        ),
+        "metrics_uri": os.environ.get("INGEST_METRICS_URI", ""),
+        # サンプリングプロファイラの間隔 (秒)。0 の場合はプロファイルしない
+        "profile_interval": float(os.environ.get("INGEST_PROFILE_INTERVAL", 0)),
+        "profile_uri": profile_uri,
     }
 
     opensearch = OpenSearchController(cfg)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import utils
+
+
+def chunk_id(file_name, index):
+    """
+    チャンクのドキュメント ID を S3 パスとチャンク番号から決定的に生成する
+
+    同じファイルを再登録した場合は同じ ID で上書きされるため、クラッシュ後の再実行でもチャンクが重複しない。
+    """
+    digest = hashlib.sha1(file_name.encode("utf-8")).hexdigest()
+    return f"{digest}-{index}"
+
+
+def make_entry(etag, indices, depends=None):
+    """
+    マニフェストの 1 ファイル分の記録。チャンクの ID は chunk_id() で決まるため、ID ではなく位置を保存する
+
+    重複を除かなかったファイル (位置が 0 から連続する) はチャンク数のみを保存する。
+    depends には、重複として登録を省略したチャンクの代わりに検索される、他のファイルのチャンクを
+    [S3 パス, 位置] で保存する。そのファイルが更新・削除された場合は、このファイルも登録し直す。
+    """
+    indices = list(indices)
+    if indices == list(range(len(indices))):
+        entry = {"etag": etag, "chunks": len(indices)}
+    else:
+        entry = {"etag": etag, "indices": indices}
+    if depends:
+        entry["depends"] = [list(dep) for dep in depends]
+    return entry
+
+
+def entry_indices(entry):
+    if "indices" in entry:
+        return entry["indices"]
+    if "chunk_ids" in entry:
+        # チャンクの ID を保存していた以前の形式
+        return [int(_id.rsplit("-", 1)[1]) for _id in entry["chunk_ids"]]
+    return range(entry.get("chunks", 0))
+
+
+class Manifest:
+    """
+    取り込み済みのファイルを記録するマニフェスト
+
+    S3 パスごとに ETag と登録したチャンクの位置 (make_entry()) を JSON で保存する。
+    保存先はローカルのパスか S3 URI (s3://bucket/key) を指定する。
+    一覧の取得 (select_objects()) と bulk の結果の記録は別のスレッドで行われるため、entries は _lock を取って参照する。
+
+    Args:
+        uri (str): マニフェストの保存先
+        checkpoint_interval (int): commit() の中でマニフェストを保存する間隔 (秒)
+    """
+
+    def __init__(self, uri, checkpoint_interval=60):
+        self.uri = uri
+        self.checkpoint_interval = checkpoint_interval
+        self.entries = {}
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        self._lock = threading.Lock()
+        # 保存は commit() と remove() から別々のスレッドで呼ばれるため、古い内容で上書きしないように直列化する
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        try:
+            if self.uri.startswith("s3://"):
+                bucket, key, _ = utils.parse_s3_uri(self.uri)
+                body = utils.s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+                data = json.loads(body.read())
+            else:
+                with open(self.uri, encoding="utf-8") as f:
+                    data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except utils.s3_client.exceptions.NoSuchKey:
+            data = {}
+
+        self.entries = data.get("files", {})
+        print(f"Manifest loaded: {len(self.entries)} files ({self.uri})")
+        return self
+
+    def save(self):
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        # 各ファイルの記録は置き換えるだけで変更しないため、浅いコピーで十分。
+        # シリアライズの間も bulk の結果の記録 (commit()) を止めない
+        with self._lock:
+            entries = dict(self.entries)
+            self._dirty = False
+            self._last_saved = time.monotonic()
+        body = json.dumps({"files": entries}, ensure_ascii=False, separators=(",", ":"))
+        self._write(body)
+
+    def _write(self, body):
+        if self.uri.startswith("s3://"):
+            bucket, key, _ = utils.parse_s3_uri(self.uri)
+            utils.s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=body.encode("utf-8"),
+                ContentType="application/json",
+            )
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.uri)), exist_ok=True)
+            temp_path = f"{self.uri}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(body)
+            os.replace(temp_path, self.uri)
+
+    def is_unchanged(self, file_name, etag):
+        with self._lock:
+            entry = self.entries.get(file_name)
+        return entry is not None and entry["etag"] == etag
+
+    def chunk_ids(self, file_name):
+        with self._lock:
+            entry = self.entries.get(file_name)
+        if entry is None:
+            return []
+        return [chunk_id(file_name, i) for i in entry_indices(entry)]
+
+    def dependencies(self, file_name):
+        """
+        Returns:
+            list: file_name が重複として参照している他のファイルのチャンク ([S3 パス, 位置] のリスト)
+        """
+        with self._lock:
+            entry = self.entries.get(file_name)
+        return entry.get("depends", []) if entry else []
+
+    def dependents(self, file_names):
+        """
+        file_names のチャンクを重複として参照しているファイル (間接的に参照しているファイルを含む) を返す
+        """
+        reverse = {}
+        with self._lock:
+            for name, entry in self.entries.items():
+                for dep, _ in entry.get("depends", ()):
+                    reverse.setdefault(dep, set()).add(name)
+        found = set()
+        stack = list(file_names)
+        while stack:
+            for name in reverse.get(stack.pop(), ()):
+                if name not in found:
+                    found.add(name)
+                    stack.append(name)
+        return found
+
+    def removed_files(self, file_names):
+        """
+        マニフェストに記録されているが、S3 から削除されたファイルを返す
+
+        select_objects() から呼ばれるため、メインスレッドの commit() と並行して実行される。
+        """
+        current = set(file_names)
+        with self._lock:
+            recorded = list(self.entries)
+        return [f for f in recorded if f not in current]
+
+    def commit(self, file_name, etag, indices, depends=None):
+        """
+        Args:
+            indices (list[int]): 登録したチャンクのファイル内での位置
+            depends (list): 重複として参照している他のファイルのチャンク ([S3 パス, 位置] のリスト)
+        """
+        entry = make_entry(etag, indices, depends)
+        with self._lock:
+            self.entries[file_name] = entry
+            self._dirty = True
+        self._checkpoint()
+
+    def remove(self, file_name):
+        with self._lock:
+            if self.entries.pop(file_name, None) is not None:
+                self._dirty = True
+        self._checkpoint()
+
+    def _checkpoint(self):
+        if (
+            not self._dirty
+            or time.monotonic() - self._last_saved < self.checkpoint_interval
+        ):
+            return
+        # 他のスレッドが保存中の場合は待たずに戻る。保存後の変更は次の checkpoint で保存される
+        if not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            self._save()
+        finally:
+            self._save_lock.release()
@@ -0,0 +1,316 @@
+"""
+取り込み処理の処理時間とスループットのメトリクス
+
+各処理 (S3 からの取得、テキスト変換、チャンク分割、ベクトル変換、bulk 登録) を span() で囲んで処理時間を集計し、
+CloudWatch の Embedded Metric Format (EMF) のログ、または JSON / Prometheus の textfile 形式のファイルに出力する。
+ECS タスクの標準出力は CloudWatch Logs に送られるため、EMF のログは追加の API 呼び出しなしでメトリクスになる。
+
+SamplingProfiler は一定間隔で全スレッドのスタックを記録し、flame graph 用の folded 形式で書き出す。
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import utils
+
+# Prometheus のヒストグラムのバケット (ミリ秒)
+DEFAULT_BUCKETS_MS = (
+    1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000,
+)
+
+
+class SpanStats:
+    """
+    1 種類の span の処理時間の集計。累計と、最後に flush_emf() してからの区間の集計を持つ
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.interval_count = 0
+        self.interval_total_ms = 0.0
+        self.interval_max_ms = 0.0
+
+    def observe(self, elapsed_ms, error=False):
+        self.count += 1
+        self.errors += error
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.interval_count += 1
+        self.interval_total_ms += elapsed_ms
+        self.interval_max_ms = max(self.interval_max_ms, elapsed_ms)
+        for i, bound in enumerate(self.buckets):
+            if elapsed_ms <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, p):
+        """
+        バケットの上限値から求めたおおよそのパーセンタイル (ミリ秒)
+        """
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= target:
+                return min(float(bound), round(self.max_ms, 3))
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class Metrics:
+    """
+    Args:
+        namespace (str): CloudWatch のメトリクスの名前空間
+        dimensions (dict): EMF のディメンション (インデックス名など)
+    """
+
+    def __init__(self, namespace="IntelligentSearch/Ingest", dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.started_at = time.perf_counter()
+        self.spans = {}
+        self.counters = Counter()
+        self._interval_counters = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """
+        with ブロックの処理時間を name の span として記録する。例外が発生した場合はエラーとして数える
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, error)
+
+    def observe(self, name, elapsed_ms, error=False):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.observe(elapsed_ms, error)
+
+    def count(self, name, value=1):
+        """
+        処理した件数やバイト数を加算する。スループットは snapshot() で経過時間から計算する
+        """
+        with self._lock:
+            self.counters[name] += value
+            self._interval_counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self.started_at
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "spans": {name: s.snapshot() for name, s in sorted(self.spans.items())},
+                "counters": {
+                    name: {
+                        "total": value,
+                        "per_sec": round(value / elapsed, 3) if elapsed else 0.0,
+                    }
+                    for name, value in sorted(self.counters.items())
+                },
+            }
+
+    def flush_emf(self):
+        """
+        前回の flush_emf() からの区間の集計を EMF の 1 行として標準出力に書き出す
+        """
+        with self._lock:
+            values = {}
+            definitions = []
+            for name, stats in sorted(self.spans.items()):
+                if not stats.interval_count:
+                    continue
+                values[f"{name}.count"] = stats.interval_count
+                values[f"{name}.avg_ms"] = round(
+                    stats.interval_total_ms / stats.interval_count, 3
+                )
+                values[f"{name}.max_ms"] = round(stats.interval_max_ms, 3)
+                definitions += [
+                    {"Name": f"{name}.count", "Unit": "Count"},
+                    {"Name": f"{name}.avg_ms", "Unit": "Milliseconds"},
+                    {"Name": f"{name}.max_ms", "Unit": "Milliseconds"},
+                ]
+                stats.interval_count = 0
+                stats.interval_total_ms = 0.0
+                stats.interval_max_ms = 0.0
+            for name, value in sorted(self._interval_counters.items()):
+                values[name] = value
+                definitions.append({"Name": name, "Unit": "Count"})
+            self._interval_counters.clear()
+
+        if not definitions:
+            return
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [sorted(self.dimensions)],
+                        "Metrics": definitions,
+                    }
+                ],
+            },
+            **self.dimensions,
+            **values,
+        }
+        print(json.dumps(record, ensure_ascii=False), flush=True)
+
+    def to_prometheus(self, prefix="ingest"):
+        """
+        node_exporter の textfile collector で読み込める形式に変換する
+        """
+        snapshot_spans = {}
+        with self._lock:
+            for name, stats in sorted(self.spans.items()):
+                snapshot_spans[name] = (
+                    list(stats.bucket_counts),
+                    stats.buckets,
+                    stats.count,
+                    stats.total_ms,
+                )
+            counters = sorted(self.counters.items())
+
+        lines = [
+            f"# HELP {prefix}_span_duration_seconds Duration of ingest spans",
+            f"# TYPE {prefix}_span_duration_seconds histogram",
+        ]
+        for name, (bucket_counts, buckets, count, total_ms) in snapshot_spans.items():
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="{bound / 1000:g}"}} {cumulative}'
+                )
+            lines.append(
+                f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}'
+            )
+            lines.append(
+                f'{prefix}_span_duration_seconds_sum{{span="{name}"}} {total_ms / 1000:.6f}'
+            )
+            lines.append(f'{prefix}_span_duration_seconds_count{{span="{name}"}} {count}')
+        for name, value in counters:
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, uri):
+        """
+        集計結果を uri (ローカルパスか S3 URI) に書き出す。拡張子が .prom の場合は Prometheus の形式、それ以外は JSON
+        """
+        if uri.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+        write_output(uri, content)
+
+
+class SamplingProfiler:
+    """
+    interval 秒ごとに全スレッドのスタックを記録するサンプリングプロファイラ
+
+    cProfile と異なり関数呼び出しごとのフックを入れないため、取り込みの処理速度にほとんど影響しない。
+    結果は "関数;関数;... 回数" の folded 形式で、flamegraph.pl や speedscope で可視化できる。
+
+    Args:
+        interval (float): サンプリング間隔 (秒)
+        max_depth (int): 記録するスタックの深さの上限
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self):
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def write(self, uri):
+        write_output(uri, self.folded())
+        print(f"Profile ({self.samples} samples) was written to {uri}")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < self.max_depth:
+                    code = frame.f_code
+                    frames.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                # スレッド名の連番を除き、同じ役割のスレッドのサンプルをまとめる
+                thread_name = names.get(thread_id, "thread").rstrip("0123456789_-")
+                frames.append(thread_name)
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+
+def write_output(uri, content):
+    if uri.startswith("s3://"):
+        bucket, key, _ = utils.parse_s3_uri(uri)
+        utils.s3_client.put_object(
+            Bucket=bucket, Key=key, Body=content.encode("utf-8")
+        )
+        return
+    # textfile collector が書き込み途中のファイルを読まないように、一時ファイルから置き換える
+    directory = os.path.dirname(os.path.abspath(uri))
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(path, uri)
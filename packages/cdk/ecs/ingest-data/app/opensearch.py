@@ -5,21 +5,171 @@ from opensearchpy import (
     helpers,
 )
 import boto3
+from botocore.config import Config
 import json
 import time
-import re
+import os
+import threading
+import chunker
+import loaders
 import utils
+from embedding_cache import cache_key, open_embedding_cache
+from batcher import EmbeddingBatcher
+from bulk_writer import BulkWriter
+from dedup import ChunkDeduplicator
+from manifest import Manifest, chunk_id
+from metrics import Metrics, SamplingProfiler
+from parse_pool import ParsePool
+from pipeline import Pipeline, Stage, StageStats
+from rate_limit import AdaptiveRateLimiter
+from vector_codec import (
+    VECTOR_STORAGE,
+    check_storage,
+    cohere_embedding_type,
+    encode_vector,
+    knn_mapping,
+)
 from concurrent.futures import ThreadPoolExecutor
 
+# OpenSearch クライアントのコネクションプールの大きさ
+AOS_POOL_MAXSIZE = 20
+# k-NN のグラフを構築するスレッド数のクラスター設定
+KNN_THREAD_QTY = "knn.algo_param.index_thread_qty"
+# shared_docs から params.remove のドキュメント名を取り除き、params.add のドキュメント名を追加する
+SHARED_DOCS_SCRIPT = """
+def docs = ctx._source.shared_docs;
+if (docs == null) {
+  docs = new ArrayList();
+} else if (!(docs instanceof List)) {
+  docs = new ArrayList([docs]);
+}
+docs.removeIf(name -> params.remove.contains(name));
+for (name in params.add) {
+  if (!docs.contains(name)) {
+    docs.add(name);
+  }
+}
+if (docs.isEmpty()) {
+  ctx._source.remove('shared_docs');
+} else {
+  ctx._source.shared_docs = docs;
+}
+"""
+
 
 class OpenSearchController:
-    def __init__(self, cfg):
+    def __init__(self, cfg, bedrock_runtime=None, aos_client=None):
+        # bedrock_runtime と aos_client はベンチマークなどで差し替える場合にのみ指定する
         self.cfg = cfg
-        self.bedrock_runtime = boto3.client(
+        embed_concurrency = cfg.get("embed_concurrency", 16)
+        # ベクトルの保存形式 (vector_codec.py)。Cohere は量子化済みの形式で埋め込みを取得する
+        self.vector_storage = cfg.get("vector_storage", "float")
+        check_storage(self.vector_storage)
+        self.embedding_type = "float"
+        if "cohere" in cfg["model_id"]:
+            self.embedding_type = cohere_embedding_type(self.vector_storage)
+        self.bedrock_runtime = bedrock_runtime or boto3.client(
             service_name="bedrock-runtime",
             region_name=cfg["bedrock_region"],
+            # スロットリングと一時的なエラー (5xx、接続エラー) の再試行は AdaptiveRateLimiter で行う
+            config=Config(
+                retries={"mode": "standard", "max_attempts": 1},
+                max_pool_connections=embed_concurrency,
+            ),
+        )
+        self.embed_limiter = AdaptiveRateLimiter(
+            max_concurrency=embed_concurrency,
+            max_tps=cfg.get("embed_max_tps", 0),
+            max_retries=cfg.get("embed_max_retries", 8),
+        )
+        # Titan はリクエストごとに 1 チャンクしか送れないため、チャンク単位で並列に呼び出す
+        self.embed_executor = ThreadPoolExecutor(
+            max_workers=embed_concurrency, thread_name_prefix="embed"
+        )
+        # Cohere は複数のファイルのチャンクを件数と文字数の上限まで 1 つのリクエストにまとめる
+        self.embed_batcher = None
+        if "cohere" in cfg["model_id"]:
+            self.embed_batcher = EmbeddingBatcher(
+                self.invoke_cohere,
+                self.embed_executor,
+                max_texts=cfg.get("embed_batch_max_texts", 96),
+                max_chars=cfg.get("embed_batch_max_chars", 50_000),
+                max_wait=cfg.get("embed_batch_max_wait", 0.05),
+            )
+        self.embedding_cache = open_embedding_cache(cfg.get("embedding_cache_uri"))
+        # 大きいファイルをレンジ GET で分割してダウンロードするためのスレッドプール
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=cfg.get("download_part_concurrency", 4)
+            * cfg.get("download_workers", 8),
+            thread_name_prefix="download-part",
         )
-        self.aos_client = self.get_aos_client()
+        self.aos_client = aos_client or self.get_aos_client()
+        # 存在しないローダー名の指定は、ファイルごとに失敗する前にここでエラーにする
+        for extension, name in cfg.get("loaders", {}).items():
+            if loaders.get_loader(extension, name) is None:
+                raise ValueError(f"No loader is registered for {extension}")
+        # PDF などの CPU 負荷の高いテキスト変換はプロセスプールで行う (0 の場合はスレッドで行う)
+        self.parse_pool = None
+        if cfg.get("parse_processes", 0) > 0:
+            self.parse_pool = ParsePool(
+                cfg["parse_processes"],
+                max_tasks_per_child=cfg.get("parse_max_tasks_per_child", 50),
+                timeouts=cfg.get("parse_timeouts"),
+            )
+        # 定型文などの重複したチャンクは、最初に現れたチャンクだけをベクトル化して登録する
+        self.deduplicator = None
+        dedup = cfg.get("dedup", "off")
+        if dedup not in ("off", "exact", "near"):
+            raise ValueError(f"dedup must be one of off, exact, near: {dedup}")
+        if dedup != "off":
+            self.deduplicator = ChunkDeduplicator(
+                near=dedup == "near",
+                max_distance=cfg.get("dedup_max_distance", 3),
+                min_length=cfg.get("dedup_min_length", 50),
+            )
+        # 登録したチャンクの ID と、同じ内容のチャンクを含んでいた他のドキュメント名の対応。
+        # shared_removals は、再登録・削除したファイルのために shared_docs から取り除くドキュメント名
+        self.shared_docs = {}
+        self.shared_removals = {}
+        self._shared_lock = threading.Lock()
+        # 処理ごとの処理時間とスループット。EMF のログとして出力し、metrics_uri を指定した場合はファイルにも書き出す
+        self.metrics = Metrics(
+            namespace=cfg.get("metrics_namespace", "IntelligentSearch/Ingest"),
+            dimensions={"Index": cfg["index_name"]},
+        )
+        # bulk リクエストはバイト数で区切り、クライアントのコネクションプールを共有する複数のワーカーで送る
+        self.bulk_writer = BulkWriter(
+            self.aos_client,
+            # get_aos_client() のコネクションプール (pool_maxsize=20) を超える同時リクエストは待たされるだけなので制限する
+            workers=min(cfg.get("index_workers", 4), AOS_POOL_MAXSIZE),
+            max_bytes=cfg.get("bulk_max_bytes", 5 * 1024 * 1024),
+            max_docs=cfg.get("bulk_chunk_size", 1000),
+            max_retries=cfg.get("bulk_max_retries", 8),
+            request_timeout=cfg.get("bulk_request_timeout", 120),
+            dead_letter_uri=cfg.get("bulk_dead_letter_uri", ""),
+            metrics=self.metrics,
+        )
+        # bulk 登録はパイプラインの外 (呼び出し元のスレッド) で行うため、統計のみ共有する
+        self.index_stats = StageStats("index", self.bulk_writer.workers)
+        self.pipeline = None
+        # create_index() でインデックスを新しく作成したかどうか
+        self.index_created = False
+        # select_objects() で取り込み対象になったファイル数
+        self.selected_files = 0
+
+        # 検索用 Lambda が参照するエイリアス (cfg の index_name) と、取り込み先のインデックス
+        self.alias = cfg["index_name"]
+        self.index_name = cfg["index_name"]
+        # マニフェストは取り込み先のインデックスが決まってから open_manifest() で読み込む
+        self.manifest = None
+        # bulk 登録が完了していないファイルと、そのチャンク ID の対応
+        self._pending_files = {}
+        self._pending_ids = {}
+        # マニフェストに記録したファイルと、重複の元のファイルの記録を待っているファイル
+        self._finished_files = set()
+        self._waiting_files = {}
+        self._waiters = {}
+        self._pending_lock = threading.Lock()
 
     def get_aos_client(self):
         host = self.cfg["host_http"]
@@ -35,28 +185,179 @@ class OpenSearchController:
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
+            pool_maxsize=AOS_POOL_MAXSIZE,
         )
 
         return client
 
-    def init_cluster_settings(self):
-        # インデックス時のスレッド数を指定
-        self.aos_client.cluster.put_settings(
+    def hnsw_parameters(self):
+        # HNSW グラフの各ノードのエッジ数 (m) と、構築時の探索候補数 (ef_construction)。
+        # 大きくすると再現率が上がるが、インデックス時間とメモリ使用量が増える
+        m = self.cfg.get("hnsw_m", 16)
+        ef_construction = self.cfg.get("hnsw_ef_construction", 100)
+        if not 2 <= m <= 64:
+            raise ValueError(f"hnsw_m must be between 2 and 64: {m}")
+        if not m <= ef_construction <= 1024:
+            raise ValueError(
+                f"hnsw_ef_construction must be between m and 1024: {ef_construction}"
+            )
+        return {"m": m, "ef_construction": ef_construction}
+
+    def resolve_index(self):
+        """
+        取り込み先のインデックスを決め、現在エイリアスが指しているインデックスを返す (なければ None)
+
+        通常はエイリアスが指すインデックスに差分を取り込む。rebuild の場合やまだインデックスがない場合は、
+        バージョン付きの新しいインデックス ({エイリアス}-v{日時}) を作成し、取り込みと検証が終わってからエイリアスを切り替える。
+        """
+        current = None
+        if self.aos_client.indices.exists_alias(name=self.alias):
+            current = next(iter(self.aos_client.indices.get_alias(name=self.alias)))
+        elif self.aos_client.indices.exists(index=self.alias):
+            # エイリアスを使う前に作成したインデックス
+            current = self.alias
+
+        if current is not None and not self.cfg.get("rebuild", False):
+            self.index_name = current
+        else:
+            self.index_name = f"{self.alias}-v{time.strftime('%Y%m%d%H%M%S')}"
+        print(f"Ingest into {self.index_name} (alias {self.alias} -> {current})")
+        return current
+
+    def open_manifest(self):
+        uri = self.cfg.get("manifest_uri")
+        if not uri:
+            return
+        # {index} は取り込み先のインデックス名に置き換える。バージョンごとに別のマニフェストになる
+        self.manifest = Manifest(
+            uri.replace("{index}", self.index_name),
+            checkpoint_interval=self.cfg.get("manifest_checkpoint_interval", 60),
+        )
+        if self.index_created:
+            # 新しいインデックスには全てのファイルを取り込む
+            print(f"Manifest is not loaded for the new index: {self.manifest.uri}")
+        else:
+            self.manifest.load()
+
+    def validate_index(self, current, stats):
+        """
+        エイリアスを切り替える前に、新しいインデックスを検証する。問題があれば RuntimeError を送出する
+
+        Args:
+            current (str): 現在エイリアスが指しているインデックス (なければ None)
+            stats (dict): bulk_index() の戻り値
+        """
+        cfg = self.cfg
+        index_name = self.index_name
+        self.aos_client.indices.refresh(index=index_name)
+        errors = []
+
+        count = self.aos_client.count(index=index_name)["count"]
+        if count == 0:
+            errors.append("no chunks were indexed")
+        attempted = stats["units"] + stats["failed"]
+        failure_rate = stats["failed"] / attempted if attempted else 0.0
+        if failure_rate > cfg.get("swap_max_failure_rate", 0.01):
+            errors.append(f"{stats['failed']} of {attempted} chunks failed")
+
+        # チャンク分割の設定を変えるとチャンク数は変わるため、ドキュメント数で比較する
+        if current is not None and count:
+            new_docs = self.count_documents(index_name)
+            current_docs = self.count_documents(current)
+            if new_docs < current_docs * cfg.get("swap_min_doc_ratio", 0.9):
+                errors.append(
+                    f"{new_docs} documents is too few "
+                    f"compared with {current_docs} in {current}"
+                )
+
+        # 登録したベクトルで k-NN 検索し、そのチャンク自身が見つかることを確認する
+        if count:
+            sample = self.aos_client.search(
+                index=index_name, body={"size": 1, "_source": ["vector"]}
+            )["hits"]["hits"][0]
+            hits = self.aos_client.search(
+                index=index_name,
+                body={
+                    "size": 10,
+                    "_source": False,
+                    "query": {
+                        "knn": {
+                            "vector": {"vector": sample["_source"]["vector"], "k": 10}
+                        }
+                    },
+                },
+            )["hits"]["hits"]
+            if sample["_id"] not in [hit["_id"] for hit in hits]:
+                errors.append("k-NN search did not return the query chunk itself")
+
+        if errors:
+            raise RuntimeError(
+                f"Validation of {index_name} failed, the alias was not switched: "
+                + "; ".join(errors)
+            )
+        print(f"Validation of {index_name} passed: {count} chunks")
+
+    def count_documents(self, index_name):
+        response = self.aos_client.search(
+            index=index_name,
             body={
-                "persistent": {
-                    "knn.algo_param.index_thread_qty": "4",
-                }
-            }
+                "size": 0,
+                "aggs": {"docs": {"cardinality": {"field": "doc_name"}}},
+            },
         )
+        return response["aggregations"]["docs"]["value"]
+
+    def swap_alias(self, current):
+        """
+        エイリアスを新しいインデックスに付け替える。1 回のリクエストで行うため、検索が途切れない
+
+        古いバージョンのインデックスは削除しない (ロールバック用)。不要になったものは delete-opensearch-index の Lambda で削除する。
+        """
+        actions = [{"add": {"index": self.index_name, "alias": self.alias}}]
+        if current == self.alias:
+            # エイリアスと同じ名前の既存のインデックスは、エイリアスの追加と同時に削除する
+            actions.append({"remove_index": {"index": current}})
+        elif current is not None:
+            actions.append({"remove": {"index": current, "alias": self.alias}})
+        self.aos_client.indices.update_aliases(body={"actions": actions})
+        print(f"Alias {self.alias} now points to {self.index_name} (previous: {current})")
+
+    def discard_index(self, current):
+        """
+        取り込みまたは検証に失敗した新しいバージョンのインデックスを削除する
+
+        エイリアスが指しているインデックスへの差分の取り込みでは何もしない。
+        タスクが強制終了された場合に残るインデックスは delete-opensearch-index の Lambda で削除する。
+        """
+        if self.index_name == current or not self.index_created:
+            return
+        try:
+            self.aos_client.indices.delete(index=self.index_name)
+            print(f"Index {self.index_name} was deleted because the ingestion failed")
+        except Exception as e:
+            print(f"[WARN] Failed to delete {self.index_name}: {e}")
 
     def create_index(self):
-        index_name = self.cfg["index_name"]
+        index_name = self.index_name
         model_id = self.cfg["model_id"]
         dimension = self.cfg["dimension"]
+        hnsw_parameters = self.hnsw_parameters()
 
-        if not self.aos_client.indices.exists(index_name):
+        if self.aos_client.indices.exists(index_name):
+            self.index_created = False
+            # 既存のインデックスと保存形式が異なるベクトルを登録しないようにする
+            meta = self.get_index_meta()
+            current = meta.get("vector_storage", "float")
+            if current != self.vector_storage:
+                raise ValueError(
+                    f"Index {index_name} stores {current} vectors, "
+                    f"but vector_storage is {self.vector_storage}"
+                )
+        else:
             print("create index")
+            self.index_created = True
+            version = self.aos_client.info()["version"]["number"]
+            check_storage(self.vector_storage, version)
 
             self.aos_client.indices.create(
                 index_name,
@@ -96,18 +397,14 @@ class OpenSearchController:
                         }
                     },
                     "mappings": {
-                        "_meta": {"model_id": model_id},
+                        "_meta": {
+                            "model_id": model_id,
+                            "vector_storage": self.vector_storage,
+                        },
                         "properties": {
-                            "vector": {
-                                "type": "knn_vector",
-                                "dimension": dimension,
-                                "method": {
-                                    "engine": "lucene",
-                                    "space_type": "cosinesimil",
-                                    "name": "hnsw",
-                                    "parameters": {},
-                                },
-                            },
+                            "vector": knn_mapping(
+                                self.vector_storage, dimension, hnsw_parameters
+                            ),
                             "docs_root": {"type": "keyword"},
                             "doc_name": {"type": "keyword"},
                             "keyword": {
@@ -115,56 +412,174 @@ class OpenSearchController:
                                 "analyzer": "custom_sudachi_analyzer",
                             },
                             "service": {"type": "keyword"},
+                            # 重複として登録を省略したチャンクを含むドキュメント名
+                            "shared_docs": {"type": "keyword"},
                         },
                     },
                 },
             )
 
         print("Index was created.")
-        time.sleep(20)
+        time.sleep(self.cfg.get("index_create_wait", 20))
 
-    def split_text(self, text):
-        chunks = []
-        current_chunk = ""
-        current_length = 0
-        max_length = self.cfg["max_chunk_length"]
+    def get_index_meta(self):
+        mapping = self.aos_client.indices.get_mapping(index=self.index_name)
+        return next(iter(mapping.values()))["mappings"].get("_meta", {})
 
-        # for English sentences
-        period_pattern = re.compile(r"[.!?][\s]")
+    def put_index_meta(self, meta):
+        # _meta は部分的に更新できないため、全体を書き込む
+        self.aos_client.indices.put_mapping(
+            index=self.index_name, body={"_meta": meta}
+        )
 
-        # for Japanese sentences
-        kuten_pattern = re.compile(r"[。！？…\n]")
+    # ---- 一括構築 (bulk build) ----
 
-        split_pattern = re.compile(
-            rf"(.{{1,{max_length}}}?({period_pattern.pattern}|{kuten_pattern.pattern}))",
-            flags=re.DOTALL,
-        )
-        find = split_pattern.finditer(text)
+    def begin_bulk_build(self):
+        """
+        取り込み中の設定に切り替え、一括構築モードで取り込むかどうかを返す
+
+        k-NN のグラフを構築するスレッド数を増やし、一括構築モードではさらにレプリカを 0 にして refresh を止める。
+        元の設定はマッピングの _meta に保存し、取り込みが途中で失敗した場合も次回の実行で元に戻せるようにする。
+        """
+        mode = self.cfg.get("build_mode", "auto")
+        if mode not in ("auto", "on", "off"):
+            raise ValueError(f"build_mode must be one of auto, on, off: {mode}")
+        # auto の場合は、新しく作成したインデックスへの取り込みのみ一括構築モードにする
+        build = mode == "on" or (mode == "auto" and self.index_created)
+        index_name = self.index_name
 
-        while list(find)[0].span()[0] != 0:
-            max_length += 10
-            split_pattern = re.compile(
-                rf"(.{{1,{max_length}}}?({period_pattern.pattern}|{kuten_pattern.pattern}))",
-                flags=re.DOTALL,
+        meta = self.get_index_meta()
+        if "build_settings" in meta:
+            print(
+                "[WARN] The previous ingestion did not finish. "
+                "Its original settings will be restored."
+            )
+            # 一括構築モードの途中で失敗した場合は、再実行も一括構築モードで行う
+            build = build or meta["build_settings"].get("build", False)
+        else:
+            cluster = self.aos_client.cluster.get_settings(flat_settings=True)
+            settings = self.aos_client.indices.get_settings(
+                index=index_name, flat_settings=True
             )
-            find = split_pattern.finditer(text)
+            settings = next(iter(settings.values()))["settings"]
+            meta = dict(
+                meta,
+                build_settings={
+                    # 明示的に設定されていなかった場合は None (既定値に戻す)
+                    "knn_thread_qty": cluster.get("persistent", {}).get(KNN_THREAD_QTY),
+                    "number_of_replicas": settings.get("index.number_of_replicas", "1"),
+                    "build": build,
+                },
+            )
+            self.put_index_meta(meta)
 
-        for match in split_pattern.finditer(text):
-            chunk = match.group(1)
-            chunk_length = len(chunk)
+        self.aos_client.cluster.put_settings(
+            body={
+                "persistent": {
+                    KNN_THREAD_QTY: str(self.cfg.get("knn_build_threads", 4)),
+                }
+            }
+        )
+        if build:
+            print("Start bulk build: replicas and refresh are disabled.")
+            self.aos_client.indices.put_settings(
+                index=index_name,
+                body={"index": {"number_of_replicas": 0, "refresh_interval": "-1"}},
+            )
+        return build
 
-            if current_length + chunk_length <= max_length:
-                current_chunk += chunk
-                current_length += chunk_length
-            else:
+    def finish_bulk_build(self, build, optimize=True):
+        """
+        begin_bulk_build() で変更した設定を元に戻す
 
-                chunks.append(current_chunk)
-                current_chunk = chunk
-                current_length = chunk_length
+        一括構築モードの場合は、レプリカを戻す前にセグメントを force merge する。
+        HNSW のグラフはセグメントごとに作られるため、セグメントが多いと k-NN 検索が遅くなる。
 
-        chunks.append(current_chunk)
+        Args:
+            build (bool): begin_bulk_build() の戻り値
+            optimize (bool): force merge と k-NN のウォームアップを行うかどうか (取り込みに失敗した場合は False)
+        """
+        cfg = self.cfg
+        index_name = self.index_name
+        meta = self.get_index_meta()
+        saved = meta.pop("build_settings", {})
 
-        return chunks
+        if build and optimize:
+            self.aos_client.indices.refresh(index=index_name)
+            if cfg.get("force_merge_segments", 1) > 0:
+                self.force_merge(cfg.get("force_merge_segments", 1))
+
+        # force merge でもグラフが作り直されるため、スレッド数は force merge の後に戻す
+        self.aos_client.cluster.put_settings(
+            body={"persistent": {KNN_THREAD_QTY: saved.get("knn_thread_qty")}}
+        )
+        index_settings = {"refresh_interval": cfg.get("refresh_interval", "60s")}
+        if build:
+            index_settings["number_of_replicas"] = saved.get("number_of_replicas", "1")
+        self.aos_client.indices.put_settings(
+            index=index_name, body={"index": index_settings}
+        )
+        # 検索用 Lambda は generation が変わると検索結果のキャッシュを使わなくなる
+        meta["generation"] = int(time.time())
+        self.put_index_meta(meta)
+
+        if build and optimize and cfg.get("knn_warmup", False):
+            self.warmup_knn()
+
+    def force_merge(self, max_num_segments):
+        index_name = self.index_name
+        print(f"Force merge {index_name} into {max_num_segments} segments per shard.")
+        start = time.perf_counter()
+        # 大きいインデックスでは HTTP のタイムアウトを超えるため、タスクとして実行して完了を待つ
+        response = self.aos_client.http.post(
+            f"/{index_name}/_forcemerge",
+            params={
+                "max_num_segments": max_num_segments,
+                "wait_for_completion": "false",
+            },
+        )
+        if "task" in response:
+            self.wait_for_task(
+                response["task"], self.cfg.get("force_merge_timeout", 3600)
+            )
+        print(f"Force merge took {time.perf_counter() - start:.1f}s")
+
+    def wait_for_task(self, task_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.aos_client.tasks.get(task_id=task_id)
+            if response.get("completed"):
+                if "error" in response:
+                    raise RuntimeError(f"Task {task_id} failed: {response['error']}")
+                return
+            if time.monotonic() >= deadline:
+                # タスクはクラスター側で続行されるため、取り込み自体は失敗にしない
+                print(f"[WARN] Task {task_id} did not finish in {timeout}s")
+                return
+            time.sleep(10)
+
+    def warmup_knn(self):
+        # ウォームアップ API はネイティブライブラリ (faiss) のグラフのみが対象で、lucene のグラフは読み込まれない
+        engine = VECTOR_STORAGE[self.vector_storage]["method"]["engine"]
+        if engine == "lucene":
+            print(f"[WARN] k-NN warmup is not supported by the {engine} engine.")
+            return
+        start = time.perf_counter()
+        response = self.aos_client.http.get(
+            f"/_plugins/_knn/warmup/{self.index_name}"
+        )
+        print(
+            f"k-NN warmup took {time.perf_counter() - start:.1f}s: "
+            f"{response.get('_shards')}"
+        )
+
+    def split_text(self, text):
+        with self.metrics.span("split"):
+            return chunker.split_text(
+                text,
+                self.cfg["max_chunk_length"],
+                overlap=self.cfg.get("chunk_overlap", 0),
+            )
 
     def embed_file(self, file_name):
 
@@ -172,86 +587,509 @@ class OpenSearchController:
 
         chunks = self.split_text(text)
 
-        if "cohere" in self.cfg["model_id"]:
-            vectors = self.embed_with_cohere(chunks)
-        else:
-            vectors = self.embed_with_titan(chunks)
+        vectors = self.embed_chunks(chunks)
 
         return vectors, chunks
 
     def embed_with_titan(self, chunks):
-        vectors = []
-        for chunk in chunks:
-            # API schema is adjust to Titan embedding model
-            body = json.dumps({"inputText": chunk})
-            query_response = self.bedrock_runtime.invoke_model(
+        # executor.map は入力の順序で結果を返すため、チャンクとベクトルの対応は保たれる
+        return list(self.embed_executor.map(self.invoke_titan, chunks))
+
+    def invoke_titan(self, chunk):
+        # API schema is adjust to Titan embedding model
+        body = json.dumps({"inputText": chunk})
+        with self.metrics.span("bedrock_request"):
+            query_response = self.embed_limiter.call(
+                self.bedrock_runtime.invoke_model,
                 body=body,
                 modelId=self.cfg["model_id"],
                 accept="application/json",
                 contentType="application/json",
             )
-            vectors.append(
-                json.loads(query_response["body"].read()).get("embedding")
-            )
-        return vectors
+        return json.loads(query_response["body"].read()).get("embedding")
 
     def embed_with_cohere(self, chunks):
-        vectors = []
-        max_text_num = 96
-        for i in range(0, len(chunks), max_text_num):
-            body = json.dumps(
-                {
-                    "texts": chunks[i : min(len(chunks), i + max_text_num)],
-                    "input_type": "search_document",
-                    "embedding_types": ["float"],
-                }
-            )
-            query_response = self.bedrock_runtime.invoke_model(
+        return self.embed_batcher.embed(chunks)
+
+    def invoke_cohere(self, texts):
+        # 1 リクエストで送るテキストの件数と文字数は EmbeddingBatcher で調整済み
+        body = json.dumps(
+            {
+                "texts": texts,
+                "input_type": "search_document",
+                "embedding_types": [self.embedding_type],
+            }
+        )
+        with self.metrics.span("bedrock_request"):
+            query_response = self.embed_limiter.call(
+                self.bedrock_runtime.invoke_model,
                 body=body,
                 modelId=self.cfg["model_id"],
                 accept="*/*",
                 contentType="application/json",
             )
-            vectors.extend(
-                json.loads(query_response["body"].read()).get("embeddings")[
-                    "float"
-                ]
-            )
-        return vectors
+        embeddings = json.loads(query_response["body"].read()).get("embeddings")
+        return embeddings[self.embedding_type]
 
     def parse_response(query_response):
 
         response_body = json.loads(query_response.get("body").read())
         return response_body.get("embedding")
 
-    def embed_documents(self, file_list):
-        vectors = []
-        counter = 0
-        for file_name in file_list:
-            print(f"embedding: {counter}/{len(file_list)}")
-            counter += 1
-            try:
-                chunk_vectors, texts = self.embed_file(file_name)
+    def embed_chunks(self, chunks):
+        if self.embedding_cache is None:
+            return self.invoke_embedding(chunks)
 
-            except Exception as e:
+        # 同じテキストは Bedrock を呼び出さずにキャッシュのベクトルを使う
+        model_id = self.cfg["model_id"]
+        input_type = "search_document" if "cohere" in model_id else ""
+        # int8 / binary 形式の埋め込みを float のベクトルと取り違えないように、キャッシュのキーに含める
+        if self.embedding_type != "float":
+            input_type = f"{input_type}:{self.embedding_type}"
+        keys = [cache_key(model_id, input_type, chunk) for chunk in chunks]
+        cached = self.embedding_cache.get_many(keys)
+
+        missing = {}
+        for key, chunk in zip(keys, chunks):
+            if key not in cached and key not in missing:
+                missing[key] = chunk
+        if missing:
+            vectors = self.invoke_embedding(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.embedding_cache.put_many(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def invoke_embedding(self, chunks):
+        # キャッシュにないチャンクのベクトル変換のみを計測する (Cohere はバッチが埋まるまでの待ち時間を含む)
+        self.metrics.count("embedded_chunks", len(chunks))
+        with self.metrics.span("embed"):
+            if "cohere" in self.cfg["model_id"]:
+                return self.embed_with_cohere(chunks)
+            return self.embed_with_titan(chunks)
+
+    def build_actions(self, file_name, chunks, vectors, indices=None):
+        """
+        Args:
+            indices (list): 各チャンクのファイル内での位置。重複を除いた場合も、チャンクの ID は元の位置で決める
+        """
+        actions = []
+        quantized = self.embedding_type != "float"
+        decimals = self.cfg.get("vector_decimals", 6)
+        if indices is None:
+            indices = range(len(chunks))
+        for i, (index, embedding) in enumerate(zip(indices, vectors)):
+            actions.append(
+                {
+                    "_index": self.index_name,
+                    "_id": chunk_id(file_name, index),
+                    # bulk リクエストの JSON を小さくするため、保存形式に必要な精度に丸める
+                    "vector": encode_vector(
+                        embedding, self.vector_storage, quantized, decimals
+                    ),
+                    "docs_root": "/".join(file_name.split("/")[:3]),
+                    "doc_name": "/".join(file_name.split("/")[3:]),
+                    "keyword": chunks[i],
+                    "service": file_name.split("/")[-2],
+                }
+            )
+        return actions
+
+    # ---- パイプラインの各ステージ ----
+    # 1 ファイルを dict で表し、ステージごとに必要なキーを追加して後段に渡す
+
+    def download_stage(self, doc):
+        cfg = self.cfg
+        with self.metrics.span("s3_get"):
+            doc["body"] = utils.fetch_object(
+                doc["file_name"],
+                size=doc.get("size"),
+                etag=doc.get("etag"),
+                part_size=cfg.get("download_part_size", utils.DEFAULT_PART_SIZE),
+                spill_size=cfg.get("download_spill_size", utils.DEFAULT_SPILL_SIZE),
+                executor=self.download_executor,
+                part_concurrency=cfg.get("download_part_concurrency", 4),
+            )
+        self.metrics.count("files")
+        self.metrics.count("downloaded_bytes", doc.get("size") or 0)
+        return doc
+
+    def parse_stage(self, doc):
+        body = doc.pop("body")
+        try:
+            extension = os.path.splitext(doc["file_name"])[-1]
+            loader = self.cfg.get("loaders", {}).get(extension)
+            with self.metrics.span("parse"):
+                if self.parse_pool is not None and self.parse_pool.handles(extension):
+                    doc["text"] = self.parse_pool.parse(body.read(), extension, loader)
+                else:
+                    doc["text"] = utils.load_file(body, extension, loader)
+        finally:
+            body.close()
+        return doc
+
+    def chunk_stage(self, doc):
+        text = doc.pop("text")
+        if not text:
+            # 空のファイルもマニフェストに記録して、次回以降の取り込みでスキップする
+            print(f"[WARN] No text was extracted: {doc['file_name']}")
+            doc["chunks"] = []
+            return doc
+        doc["chunks"] = self.split_text(text)
+        self.metrics.count("chunks", len(doc["chunks"]))
+        if self.deduplicator is not None:
+            # SimHash の計算は並列に行える。dedup ステージでは登録済みのチャンクとの比較のみ行う
+            with self.metrics.span("fingerprint"):
+                doc["fingerprints"] = [
+                    self.deduplicator.fingerprint(chunk) for chunk in doc["chunks"]
+                ]
+        return doc
+
+    def dedup_stage(self, doc):
+        file_name = doc["file_name"]
+        doc_name = "/".join(file_name.split("/")[3:])
+        chunks = []
+        indices = []
+        depends = set()
+        fingerprints = doc.pop("fingerprints", None) or [None] * len(doc["chunks"])
+        for i, (chunk, fingerprint) in enumerate(zip(doc["chunks"], fingerprints)):
+            with self.metrics.span("dedup"):
+                # キーは (S3 パス, 位置)。重複の元になったファイルをマニフェストに記録するために使う
+                canonical = self.deduplicator.find_or_add(
+                    chunk, (file_name, i), fingerprint
+                )
+            if canonical is None:
+                chunks.append(chunk)
+                indices.append(i)
+                continue
+            if canonical[0] == file_name:
+                # 同じファイル内の繰り返しは登録を省略するだけで、shared_docs には記録しない
                 continue
+            depends.add(canonical)
+            # 登録済みのチャンクに、このドキュメントにも含まれていることを記録する
+            with self._shared_lock:
+                self.shared_docs.setdefault(chunk_id(*canonical), set()).add(doc_name)
+        doc["chunks"] = chunks
+        doc["chunk_indices"] = indices
+        doc["depends"] = sorted(depends)
+        return doc
 
-            for i, embedding in enumerate(chunk_vectors):
-                vectors.append(
-                    {
-                        "_index": self.cfg["index_name"],
-                        "vector": embedding,
-                        "docs_root": "/".join(file_name.split("/")[:3]),
-                        "doc_name": "/".join(file_name.split("/")[3:]),
-                        "keyword": texts[i],
-                        "service": file_name.split("/")[-2],
-                    }
+    def embed_stage(self, doc):
+        doc["vectors"] = self.embed_chunks(doc["chunks"])
+        return doc
+
+    def build_pipeline(self):
+        cfg = self.cfg
+        queue_size = cfg.get("queue_size", 16)
+
+        def count_chunks(doc):
+            return len(doc["chunks"])
+
+        return Pipeline(
+            [
+                Stage(
+                    "download",
+                    self.download_stage,
+                    workers=cfg.get("download_workers", 8),
+                    queue_size=queue_size,
+                ),
+                Stage(
+                    "parse",
+                    self.parse_stage,
+                    # プロセスプールを使う場合は、待ち時間がタイムアウトに含まれないようにプロセス数と揃える
+                    workers=cfg.get("parse_processes") or cfg.get("parse_workers", 2),
+                    queue_size=queue_size,
+                ),
+                Stage(
+                    "chunk",
+                    self.chunk_stage,
+                    workers=cfg.get("chunk_workers", 1),
+                    queue_size=queue_size,
+                    unit_count=count_chunks,
+                ),
+                *(
+                    [
+                        Stage(
+                            "dedup",
+                            self.dedup_stage,
+                            # SimHash はチャンク分割のステージで計算済みで、ここでは登録済みのチャンクとの
+                            # 比較のみロックを取って行うため、1 スレッドで十分
+                            workers=1,
+                            queue_size=queue_size,
+                            unit_count=count_chunks,
+                        )
+                    ]
+                    if self.deduplicator is not None
+                    else []
+                ),
+                Stage(
+                    "embed",
+                    self.embed_stage,
+                    workers=cfg.get("embed_workers", 8),
+                    queue_size=queue_size,
+                    unit_count=count_chunks,
+                ),
+            ],
+            report_interval=cfg.get("report_interval", 60),
+            output_size=queue_size,
+            extra_stats=[self.index_stats],
+            on_report=self.report_metrics,
+        )
+
+    def embed_documents(self, objects):
+        """
+        objects のファイルをパイプラインで並列にベクトル化し、bulk 用の action を 1 件ずつ返すジェネレータ
+
+        ベクトル化済みのファイルは上限付きのキューで受け渡されるため、
+        コーパス全体をメモリに載せることなく、最初のファイルが終わった時点からインデックス登録を開始できる。
+
+        Args:
+            objects (Iterable[dict]): utils.iter_objects() の値
+        """
+        # ステージごとの統計を取り込み完了後にも参照できるように保持する
+        self.pipeline = pipeline = self.build_pipeline()
+        for doc in pipeline.stream(dict(obj) for obj in objects):
+            actions = self.build_actions(
+                doc["file_name"],
+                doc["chunks"],
+                doc["vectors"],
+                doc.get("chunk_indices"),
+            )
+            indices = doc.get("chunk_indices")
+            if indices is None:
+                indices = list(range(len(doc["chunks"])))
+            self._track_file(doc, indices, [action["_id"] for action in actions])
+            yield from actions
+
+    def _track_file(self, doc, indices, ids):
+        depends = doc.get("depends", [])
+        with self._pending_lock:
+            if not ids:
+                self._finish_file(doc["file_name"], doc.get("etag"), [], depends)
+                return
+            self._pending_files[doc["file_name"]] = {
+                "etag": doc.get("etag"),
+                "indices": indices,
+                "depends": depends,
+                "remaining": len(ids),
+                "failed": False,
+            }
+            for _id in ids:
+                self._pending_ids[_id] = doc["file_name"]
+
+    def _ack_chunk(self, _id, ok):
+        """
+        bulk の結果を受け取り、ファイルの全チャンクが登録できたらマニフェストに記録する
+        """
+        with self._pending_lock:
+            file_name = self._pending_ids.pop(_id, None)
+            if file_name is None:
+                return
+            entry = self._pending_files[file_name]
+            entry["remaining"] -= 1
+            if not ok:
+                entry["failed"] = True
+            if entry["remaining"] > 0:
+                return
+            del self._pending_files[file_name]
+
+            # 一部のチャンクの登録に失敗したファイルは記録せず、次回の取り込みで再登録する
+            if not entry["failed"]:
+                self._finish_file(
+                    file_name, entry["etag"], entry["indices"], entry["depends"]
                 )
 
+    def _finish_file(self, file_name, etag, indices, depends):
+        """
+        全チャンクの登録が終わったファイルをマニフェストに記録する
+
+        重複として登録を省略したチャンクがある場合は、代わりに検索されるチャンクを含むファイルが記録されるまで待つ。
+        そのファイルの登録に失敗した場合は記録しないため、次回の取り込みで両方とも登録し直される。
+        """
+        waiting = {dep for dep, _ in depends} - self._finished_files
+        if waiting:
+            self._waiting_files[file_name] = {
+                "etag": etag,
+                "indices": indices,
+                "depends": depends,
+                "waiting": waiting,
+            }
+            for dep in waiting:
+                self._waiters.setdefault(dep, []).append(file_name)
+            return
+
+        finished = [(file_name, etag, indices, depends)]
+        while finished:
+            name, etag, indices, depends = finished.pop()
+            self._commit_file(name, etag, indices, depends)
+            self._finished_files.add(name)
+            for waiter in self._waiters.pop(name, []):
+                entry = self._waiting_files[waiter]
+                entry["waiting"].discard(name)
+                if not entry["waiting"]:
+                    del self._waiting_files[waiter]
+                    finished.append(
+                        (waiter, entry["etag"], entry["indices"], entry["depends"])
+                    )
+
+    def _commit_file(self, file_name, etag, indices, depends):
+        if self.manifest is None:
+            return
+        # 更新されたファイルでチャンク数が減った場合、古いチャンクを削除する
+        ids = {chunk_id(file_name, i) for i in indices}
+        stale_ids = set(self.manifest.chunk_ids(file_name)) - ids
+        if stale_ids:
+            self.delete_chunks(sorted(stale_ids))
+        self.manifest.commit(file_name, etag, indices, depends)
+
+    def delete_chunks(self, ids):
+        helpers.bulk(
+            self.aos_client,
+            (
+                {
+                    "_op_type": "delete",
+                    "_index": self.index_name,
+                    "_id": _id,
+                }
+                for _id in ids
+            ),
+            chunk_size=self.cfg.get("bulk_chunk_size", 1000),
+            raise_on_error=False,
+            request_timeout=1000,
+        )
+
+    def bulk_index(self, actions):
+        self.index_stats.start()
+        for ok, item, elapsed in self.bulk_writer.write(actions):
+            # item は {"index": {"_id": ..., "status": ...}} の形式
+            result = next(iter(item.values()))
+            self._ack_chunk(result.get("_id"), ok)
+            if ok:
+                self.index_stats.record(elapsed, units=1)
+                self.metrics.count("indexed_chunks")
+            else:
+                self.index_stats.record(elapsed, failed=True)
+                print(f"[ERROR] Failed to index a chunk: {item}")
+        self.index_stats.finish()
+        # パイプラインの最後のログの時点では bulk 登録が終わっていないため、完了後にあらためて出力する
+        print(self.index_stats.format())
+
+        return self.index_stats.snapshot()
+
+    def report_metrics(self):
+        """
+        前回からの区間のメトリクスを EMF で出力し、metrics_uri を指定した場合は累計をファイルに書き出す
+        """
+        if self.cfg.get("metrics_emf", True):
+            self.metrics.flush_emf()
+        if self.cfg.get("metrics_uri"):
+            try:
+                self.metrics.write(self.cfg["metrics_uri"])
+            except Exception as e:
+                print(f"[WARN] Failed to write metrics: {e}")
+
+    def update_shared_docs(self):
+        """
+        重複として登録を省略したチャンクのドキュメント名を、登録したチャンクの shared_docs に書き込む
+
+        以前の取り込みで記録したドキュメント名は残し、再登録・削除したファイルのドキュメント名を取り除いてから追加する。
+        """
+        ids = set(self.shared_docs) | set(self.shared_removals)
+        if not ids:
+            return
+        _, errors = helpers.bulk(
+            self.aos_client,
+            (
+                {
+                    "_op_type": "update",
+                    "_index": self.index_name,
+                    "_id": _id,
+                    "script": {
+                        "source": SHARED_DOCS_SCRIPT,
+                        "lang": "painless",
+                        "params": {
+                            "add": sorted(self.shared_docs.get(_id, ())),
+                            "remove": sorted(self.shared_removals.get(_id, ())),
+                        },
+                    },
+                }
+                for _id in sorted(ids)
+            ),
+            chunk_size=self.cfg.get("bulk_chunk_size", 1000),
+            raise_on_error=False,
+            request_timeout=1000,
+        )
+        for error in errors:
+            # 削除したファイルのチャンクは存在しないため、取り除く対象から外れるだけでよい
+            if next(iter(error.values())).get("status") != 404:
+                print(f"[ERROR] Failed to update shared_docs: {error}")
+
+    def release_shared_docs(self, file_name):
+        """
+        file_name を再登録・削除する前に、重複として参照していたチャンクの shared_docs から取り除く
+        """
+        if self.manifest is None:
+            return
+        doc_name = "/".join(file_name.split("/")[3:])
+        with self._shared_lock:
+            for dep, index in self.manifest.dependencies(file_name):
+                self.shared_removals.setdefault(chunk_id(dep, index), set()).add(
+                    doc_name
+                )
+
+    def select_objects(self, objects):
+        """
+        マニフェストと S3 の一覧を比較し、取り込みが必要なファイルを 1 件ずつ返すジェネレータ
+
+        ETag が変わっていないファイルはスキップし、一覧を最後まで読んだ時点で、
+        S3 から削除されたファイルのチャンクをインデックスから削除する。
+        更新・削除されたファイルのチャンクを重複として参照していたファイルは、変わっていなくても最後に登録し直す。
+
+        Args:
+            objects (Iterable[dict]): utils.iter_objects() の値
+        """
+        found = []
+        targets = []
+        # 重複の元のファイルが変わった場合に登録し直す、変わっていないファイル
+        unchanged_dependents = {}
+        for obj in objects:
+            file_name = obj["file_name"]
+            found.append(file_name)
+            if self.manifest is None or not self.manifest.is_unchanged(
+                file_name, obj["etag"]
+            ):
+                targets.append(file_name)
+                self.release_shared_docs(file_name)
+                yield obj
+            elif self.manifest.dependencies(file_name):
+                unchanged_dependents[file_name] = obj
+
+        removed = []
+        requeued = []
+        if self.manifest is not None:
+            removed = self.manifest.removed_files(found)
+            for file_name in removed:
+                self.release_shared_docs(file_name)
+                self.delete_chunks(self.manifest.chunk_ids(file_name))
+                self.manifest.remove(file_name)
+
+            requeued = sorted(
+                self.manifest.dependents(targets + removed)
+                & unchanged_dependents.keys()
+            )
+            for file_name in requeued:
+                self.release_shared_docs(file_name)
+                yield unchanged_dependents[file_name]
+
         print(
-            f"{len(file_list)} documents ({len(vectors)} chunks) were embedded."
+            f"{len(found)} files were found. "
+            f"{len(targets)} files are new or modified, "
+            f"{len(requeued)} files share chunks with them, "
+            f"{len(found) - len(targets) - len(requeued)} files are unchanged, "
+            f"{len(removed)} files were removed."
         )
-        return vectors
+        self.selected_files = len(targets) + len(requeued)
 
     def create_search_pipeline(self):
         # collapse-hybrid-search-pipeline の作成
@@ -305,34 +1143,90 @@ class OpenSearchController:
             "/_search/pipeline/hybrid-search-pipeline", body=index_body
         )
 
-    def update_index(self):
-        # index 作成時に大きく設定していた refresh_interval を元に戻す
-        index_name = self.cfg["index_name"]
-        self.aos_client.indices.put_settings(
-            index=index_name,
-            body={"index": {"refresh_interval": "60s"}},
+    def print_stats(self, stats):
+        print(
+            f"{self.selected_files} documents ({stats['units']} chunks) were ingested."
         )
+        if self.deduplicator is not None:
+            print(f"Deduplicated chunks: {self.deduplicator.stats()}")
+        print(f"Bulk requests: {self.bulk_writer.stats()}")
+        print(f"Bedrock requests: {self.embed_limiter.stats()}")
+        if self.embed_batcher is not None:
+            print(f"Embedding batches: {self.embed_batcher.stats()}")
+        # プロセスプールで変換した形式の import 時間はワーカープロセス側で計測されるため含まれない
+        print(f"Loader imports: {loaders.import_stats()}")
+        if self.parse_pool is not None:
+            print(f"Parse pool: {self.parse_pool.stats()}")
+        if self.embedding_cache is not None:
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+        print(f"Spans: {self.metrics.snapshot()['spans']}")
 
     def ingest_data(self):
-        self.init_cluster_settings()
+        # ホットパスの分析用。取り込み全体を通して全スレッドのスタックをサンプリングする
+        profiler = None
+        if self.cfg.get("profile_interval", 0) > 0:
+            profiler = SamplingProfiler(self.cfg["profile_interval"]).start()
+        try:
+            self._ingest_data()
+        finally:
+            self.report_metrics()
+            if profiler is not None:
+                profiler.stop()
+                profiler.write(self.cfg.get("profile_uri") or "/tmp/ingest-profile.folded")
+
+    def _ingest_data(self):
         self.create_search_pipeline()
+        current = self.resolve_index()
         self.create_index()
+        build = self.begin_bulk_build()
         docs_url = self.cfg["docs_url"]
 
-        file_list = utils.get_all_filepath(docs_url)
+        self.open_manifest()
+        # 一覧の取得とダウンロード以降の処理を並行させるため、一覧はジェネレータのまま渡す
+        objects = self.select_objects(
+            utils.iter_objects(
+                docs_url, page_size=self.cfg.get("list_page_size", 1000)
+            )
+        )
 
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            thread = executor.submit(self.embed_documents, file_list)
-        vectors = thread.result()
+        try:
+            stats = self.bulk_index(self.embed_documents(objects))
+            self.update_shared_docs()
+            if self._waiting_files:
+                print(
+                    f"[WARN] {len(self._waiting_files)} files were not recorded in the manifest "
+                    "because the files they share chunks with failed. "
+                    "They will be ingested again next time."
+                )
+        except BaseException:
+            # 失敗した場合もレプリカなどの設定は元に戻す
+            self.finish_bulk_build(build, optimize=False)
+            self.discard_index(current)
+            raise
+        else:
+            # 統計はプールやキャッシュを閉じる前に出力する
+            self.print_stats(stats)
+        finally:
+            # 途中で失敗しても、登録が完了したファイルまでは次回の取り込みでスキップできるように保存する
+            if self.manifest is not None:
+                self.manifest.save()
+            self.bulk_writer.close()
+            # 失敗した場合も、プロセスプール・バッチ処理のスレッド・キャッシュを閉じる
+            if self.embed_batcher is not None:
+                self.embed_batcher.close()
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown()
+            if self.embedding_cache is not None:
+                self.embedding_cache.close()
 
-        batch_size = 50
-        for i in range(0, len(vectors), batch_size):
-            helpers.bulk(
-                self.aos_client,
-                vectors[i : min(i + batch_size, len(vectors))],
-                request_timeout=1000,
-            )
+        self.finish_bulk_build(build)
 
-        self.update_index()
+        if self.index_name != current:
+            try:
+                self.validate_index(current, stats)
+            except RuntimeError:
+                self.discard_index(current)
+                raise
+            self.swap_alias(current)
 
         print("Process finished.")
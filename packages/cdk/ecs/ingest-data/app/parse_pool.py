@@ -0,0 +1,111 @@
+"""
+テキスト変換をプロセスプールで実行する
+
+PDF や PowerPoint のテキスト抽出は CPU 処理で GIL を保持するため、スレッドを増やしても vCPU を使い切れない。
+ファイル形式ごとのタイムアウトと、一定数のファイルを処理したワーカーの再起動 (メモリリーク対策) を行う。
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import utils
+
+# プロセスプールで変換する拡張子。テキストファイルはデコードのみのためスレッドで変換する
+PROCESS_EXTENSIONS = (".pdf", ".pptx", ".docx", ".html")
+DEFAULT_TIMEOUTS = {".pdf": 300, ".pptx": 300, ".docx": 120, ".html": 60}
+
+
+class ParsePool:
+    """
+    Args:
+        processes (int): ワーカープロセス数
+        max_tasks_per_child (int): ワーカーを再起動するまでに処理するファイル数
+        timeouts (dict): 拡張子ごとのタイムアウト (秒)
+        default_timeout (float): timeouts にない拡張子のタイムアウト (秒)
+    """
+
+    def __init__(
+        self, processes, max_tasks_per_child=50, timeouts=None, default_timeout=300
+    ):
+        self.processes = processes
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.default_timeout = default_timeout
+        self.timed_out = 0
+        self.restarts = 0
+        self._executor = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def handles(self, extension):
+        return extension in PROCESS_EXTENSIONS
+
+    def timeout_for(self, extension):
+        return self.timeouts.get(extension, self.default_timeout)
+
+    def parse(self, data, extension, loader=None):
+        """
+        ワーカープロセスで utils.load_file() を実行してテキストを返す
+
+        Args:
+            data (bytes): ファイルの中身
+            extension (str): 拡張子 (.pdf)
+            loader (str): 使用するローダー名 (loaders.py)
+        """
+        timeout = self.timeout_for(extension)
+        # 他のファイルのタイムアウトでプールが作り直された場合に備えて、1 度だけやり直す
+        for _ in range(2):
+            executor, generation = self._get_executor()
+            try:
+                future = executor.submit(utils.load_file, data, extension, loader)
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                with self._lock:
+                    self.timed_out += 1
+                self._restart(generation)
+                raise TimeoutError(f"Parsing {extension} timed out after {timeout}s")
+            except (BrokenProcessPool, CancelledError):
+                # 待機中のタスクはプールの再作成時にキャンセルされる
+                self._restart(generation)
+        raise BrokenProcessPool(f"Parse worker crashed twice ({extension})")
+
+    def stats(self):
+        with self._lock:
+            return {"timed_out": self.timed_out, "restarts": self.restarts}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # fork はスレッドと併用できず、max_tasks_per_child も指定できないため forkserver を使う
+                context = multiprocessing.get_context("forkserver")
+                # 再起動したワーカーがライブラリを読み込み直さないよう、forkserver で先に import しておく
+                context.set_forkserver_preload(["utils"])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=context,
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+                self._generation += 1
+            return self._executor, self._generation
+
+    def _restart(self, generation):
+        with self._lock:
+            # 同じプールに対する再作成は 1 回だけ行う
+            if generation != self._generation or self._executor is None:
+                return
+            executor, self._executor = self._executor, None
+            self.restarts += 1
+
+        # shutdown() は実行中のタスクの完了を待つため、応答しないワーカーを先に終了させる。
+        # 実行中だった他のファイルは BrokenProcessPool となり、新しいプールでやり直される
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
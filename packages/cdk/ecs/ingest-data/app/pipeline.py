@@ -0,0 +1,238 @@
+import queue
+import threading
+import time
+import traceback
+
+
+# ステージ間のキューでワーカーに終了を伝えるための目印
+_SENTINEL = object()
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.units = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def record(self, elapsed, units=0, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+                self.units += units
+            self.busy_seconds += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            end = self.finished_at or time.perf_counter()
+            wall = end - self.started_at if self.started_at else 0.0
+            done = self.processed + self.failed
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "processed": self.processed,
+                "failed": self.failed,
+                "units": self.units,
+                "wall_seconds": round(wall, 3),
+                "items_per_sec": round(self.processed / wall, 3) if wall else 0.0,
+                "units_per_sec": round(self.units / wall, 3) if wall else 0.0,
+                "avg_latency_ms": (
+                    round(self.busy_seconds / done * 1000, 3) if done else 0.0
+                ),
+                # 1.0 に近いほどワーカーが常に処理中 (= このステージがボトルネック)
+                "utilization": (
+                    round(self.busy_seconds / (wall * self.workers), 3)
+                    if wall
+                    else 0.0
+                ),
+            }
+
+    def format(self):
+        s = self.snapshot()
+        return (
+            f"[{s['stage']}] workers={s['workers']} processed={s['processed']} "
+            f"failed={s['failed']} {s['items_per_sec']} items/s "
+            f"{s['units_per_sec']} units/s avg={s['avg_latency_ms']}ms "
+            f"utilization={s['utilization']}"
+        )
+
+
+class Stage:
+    """
+    パイプラインの 1 ステージ
+
+    Args:
+        name (str): ステージ名 (スループットのログに使用)
+        func (callable): 1 件の item を受け取り、次のステージに渡す item を返す。None を返した場合は後続に渡さない
+        workers (int): このステージのワーカースレッド数
+        queue_size (int): このステージの入力キューの最大長
+        unit_count (callable): 処理した item から units (チャンク数など) を数える関数
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=16, unit_count=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.unit_count = unit_count
+        self.stats = StageStats(name, self.workers)
+        self._threads = []
+
+    def start(self, output_queue):
+        self.stats.start()
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(output_queue,),
+                name=f"{self.name}-{i}",
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        self.stats.finish()
+
+    def _work(self, output_queue):
+        while True:
+            item = self.queue.get()
+            if item is _SENTINEL:
+                break
+
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                self.stats.record(time.perf_counter() - start, failed=True)
+                print(f"[ERROR] {self.name} failed: {e}")
+                traceback.print_exc()
+                continue
+
+            units = self.unit_count(result) if self.unit_count and result else 0
+            self.stats.record(time.perf_counter() - start, units=units)
+
+            if result is not None:
+                output_queue.put(result)
+
+
+class Pipeline:
+    """
+    ステージごとにワーカー数とキュー長を指定できるスレッドパイプライン
+
+    各ステージは上限付きのキューで接続されているため、後段が詰まると前段が待機し、
+    メモリ使用量はキュー長 x ステージ数で頭打ちになる。
+
+    Args:
+        stages (list[Stage]): 実行順に並べたステージ
+        report_interval (int): スループットをログに出力する間隔 (秒)
+        output_size (int): stream() で最終ステージの結果を受け渡すキューの最大長
+        extra_stats (list[StageStats]): パイプラインの外で計測しているステージの統計 (定期的なログ出力のみ。
+            パイプラインの終了後も処理が続くため、最終的な値は呼び出し元で出力する)
+        on_report (callable): スループットのログを出力するたびに呼び出す関数 (メトリクスの出力など)
+    """
+
+    def __init__(
+        self,
+        stages,
+        report_interval=60,
+        output_size=16,
+        extra_stats=None,
+        on_report=None,
+    ):
+        self.stages = stages
+        self.report_interval = report_interval
+        self.output = queue.Queue(maxsize=max(1, int(output_size)))
+        self.extra_stats = extra_stats or []
+        self.on_report = on_report
+        self._done = threading.Event()
+        self._feed_error = None
+
+    def stream(self, items):
+        """
+        items をパイプラインに流し、最終ステージの結果を完了した順に返すジェネレータ
+        """
+        for i, stage in enumerate(self.stages):
+            if i + 1 < len(self.stages):
+                stage.start(self.stages[i + 1].queue)
+            else:
+                stage.start(self.output)
+
+        feeder = threading.Thread(target=self._feed, args=(items,), daemon=True)
+        feeder.start()
+        reporter = threading.Thread(target=self._report, daemon=True)
+        reporter.start()
+
+        while True:
+            result = self.output.get()
+            if result is _SENTINEL:
+                break
+            yield result
+
+        feeder.join()
+        self._done.set()
+        reporter.join()
+        self.report(include_extra=False)
+        if self._feed_error is not None:
+            raise self._feed_error
+
+    def run(self, items):
+        for _ in self.stream(items):
+            pass
+        return self.snapshot()
+
+    def snapshot(self):
+        return [stage.stats.snapshot() for stage in self.stages] + [
+            stats.snapshot() for stats in self.extra_stats
+        ]
+
+    def report(self, include_extra=True):
+        for stage in self.stages:
+            print(stage.stats.format())
+        if include_extra:
+            for stats in self.extra_stats:
+                print(stats.format())
+        if self.on_report is not None:
+            self.on_report()
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                first.queue.put(item)
+        except Exception as e:
+            # items がジェネレータの場合 (S3 の一覧取得など) の例外は、投入済みの処理を終えてから stream() で送出する
+            self._feed_error = e
+
+        # 前段のワーカーが全て終了してから、次段のワーカー数だけ終了の目印を流す
+        for _ in range(first.workers):
+            first.queue.put(_SENTINEL)
+        for i, stage in enumerate(self.stages):
+            stage.join()
+            if i + 1 < len(self.stages):
+                next_stage = self.stages[i + 1]
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(_SENTINEL)
+
+        self.output.put(_SENTINEL)
+
+    def _report(self):
+        while not self._done.wait(self.report_interval):
+            self.report()
@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+
+# Bedrock がリクエスト過多の時に返すエラーコード
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+# スロットリング以外の一時的なエラー (モデル側の内部エラーなど)
+TRANSIENT_ERROR_CODES = {
+    "InternalServerException",
+    "ModelErrorException",
+    "ModelTimeoutException",
+}
+
+# classify_error() の戻り値
+THROTTLED = "throttled"
+RETRY = "retry"
+
+
+def is_throttling_error(e):
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+def is_transient_error(e):
+    # 接続エラーと読み取りのタイムアウト (EndpointConnectionError、ReadTimeoutError など)
+    if isinstance(e, (ConnectionError, HTTPClientError)):
+        return True
+    if not isinstance(e, ClientError):
+        return False
+    status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    code = e.response.get("Error", {}).get("Code")
+    return code in TRANSIENT_ERROR_CODES or status >= 500
+
+
+def classify_error(e):
+    """
+    Bedrock の呼び出しのエラーを分類する
+
+    Returns:
+        str: スロットリングは THROTTLED、再試行すれば成功しうるエラーは RETRY、それ以外は None
+    """
+    if is_throttling_error(e):
+        return THROTTLED
+    if is_transient_error(e):
+        return RETRY
+    return None
+
+
+class TokenBucket:
+    """
+    1 秒あたりのリクエスト数を rate に制限するトークンバケット。rate が 0 の場合は制限しない
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter:
+    """
+    同時実行数を AIMD (加算増加・乗算減少) で調整しながら Bedrock や OpenSearch の bulk API を呼び出す
+
+    成功するたびに同時実行数の上限を少しずつ増やし、スロットリングされたら半分にする。
+    スロットリングされたリクエストと一時的なエラー (5xx、接続エラー) はジッター付きの指数バックオフで再試行する。
+    一時的なエラーでは同時実行数の上限は下げない。
+
+    Args:
+        max_concurrency (int): 同時実行数の上限の最大値
+        min_concurrency (int): 同時実行数の上限の最小値
+        max_tps (float): 1 秒あたりのリクエスト数の上限。0 の場合は制限しない
+        max_retries (int): スロットリング時と一時的なエラーの再試行回数
+        base_delay (float): バックオフの初期値 (秒)
+        max_delay (float): バックオフの最大値 (秒)
+        classify (callable): 例外を THROTTLED、RETRY、None に分類する関数
+        classify_result (callable): 成功した呼び出しの戻り値がスロットリングを示す場合に THROTTLED を返す関数
+            (一部のアイテムだけが拒否される bulk のレスポンスなど)。戻り値は再試行せず、同時実行数の上限だけを下げる
+    """
+
+    def __init__(
+        self,
+        max_concurrency=16,
+        min_concurrency=1,
+        max_tps=0,
+        max_retries=8,
+        base_delay=0.5,
+        max_delay=30.0,
+        classify=classify_error,
+        classify_result=None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.bucket = TokenBucket(max_tps)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.classify_result = classify_result
+
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.retried = 0
+        self._cond = threading.Condition()
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = self.classify(e)
+                self._release(throttled=kind == THROTTLED)
+                if kind is None or attempt >= self.max_retries:
+                    raise
+                self._count_retry()
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            throttled = (
+                self.classify_result is not None
+                and self.classify_result(result) == THROTTLED
+            )
+            self._release(throttled=throttled)
+            return result
+
+    def backoff(self, attempt):
+        # full jitter: 0 から指数的に伸びる上限までの間でランダムに待つ
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        time.sleep(random.uniform(0, delay))
+
+    def _acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        self.bucket.acquire()
+
+    def _release(self, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _count_retry(self):
+        with self._cond:
+            self.retried += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retried": self.retried,
+            }
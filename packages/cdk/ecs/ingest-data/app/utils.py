@@ -1,17 +1,19 @@
 import boto3
+import io
+import shutil
 import tempfile
 import os
+from botocore.config import Config
 
-# from unstructured.partition.auto import partition
-from langchain_community.document_loaders import (
-    Docx2txtLoader,
-    TextLoader,
-    UnstructuredHTMLLoader,
-    UnstructuredPowerPointLoader,
-    PyPDFLoader,
-)
+import loaders
 
-s3_client = boto3.client("s3")
+# ダウンロードのワーカーとレンジ GET を並列に実行するため、コネクションプールを大きくする
+s3_client = boto3.client("s3", config=Config(max_pool_connections=64))
+
+# fetch_object() の既定値。これより大きいファイルはレンジ GET で分割して並列にダウンロードする
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# メモリ上に保持するファイルサイズの上限。超えた分は一時ファイルに書き出す
+DEFAULT_SPILL_SIZE = 16 * 1024 * 1024
 
 
 def parse_s3_uri(s3_uri):
@@ -33,123 +35,148 @@ def parse_s3_uri(s3_uri):
 
 
 def read_file(file_url):
-    bucket, key, extension = parse_s3_uri(file_url)
-
-    text = ""
-
-    with tempfile.NamedTemporaryFile(
-        delete=True, suffix=extension
-    ) as temp_file:
-        temp_file_path = temp_file.name
-        s3_client.download_file(bucket, key, temp_file_path)
+    _, key, extension = parse_s3_uri(file_url)
 
+    with fetch_object(file_url) as body:
         print(f"Load file: {os.path.basename(key)}")
-
-        if extension == ".txt":
-            text = load_text(temp_file_path)
-        if extension == ".pdf":
-            text = load_pdf(temp_file_path)
-            text = (
-                text.replace("\n", "").replace("\r", "").replace("\u00A0", " ")
-            )
-        if extension == ".docx":
-            text = load_word(temp_file_path)
-        if extension == ".pptx":
-            text = load_ppt(temp_file_path)
-        if extension == ".html":
-            text = load_html(temp_file_path)
-            text = (
-                text.replace("\n", "").replace("\r", "").replace("\u00A0", " ")
-            )
+        text = load_file(body, extension)
 
     return text
 
 
-def load_text(file_path):
-    try:
-        loader = TextLoader(str(file_path))
-    except Exception as e:
-        print(e)
-    pages = loader.load_and_split()
-    text = ""
-    for page in pages:
-        text += page.page_content
-    return text
+def fetch_object(
+    file_url,
+    size=None,
+    etag=None,
+    part_size=DEFAULT_PART_SIZE,
+    spill_size=DEFAULT_SPILL_SIZE,
+    executor=None,
+    part_concurrency=4,
+):
+    """
+    S3 のファイルを、一定サイズを超えるとディスクに書き出されるバッファにダウンロードする
+
+    size が part_size より大きく executor が指定された場合は、レンジ GET で分割して並列にダウンロードする。
 
+    Args:
+        file_url (str): 例's3://bucket_name/test/test.txt'
+        size (int): ファイルサイズ。get_all_objects() の値を使い、不明な場合は None
+        etag (str): 指定した場合、ダウンロード中にファイルが更新されると失敗させる
+        part_size (int): レンジ GET 1 回あたりのバイト数
+        spill_size (int): メモリ上に保持するバイト数の上限
+        executor (ThreadPoolExecutor): レンジ GET を実行するスレッドプール
+        part_concurrency (int): 1 ファイルあたりの同時レンジ GET 数
+    Returns:
+        SpooledTemporaryFile: 先頭にシーク済みのバッファ。使い終わったら呼び出し側で close する
+    """
+    bucket, key, _ = parse_s3_uri(file_url)
+    kwargs = {"Bucket": bucket, "Key": key}
+    if etag:
+        kwargs["IfMatch"] = etag
 
-def load_pdf(file_path):
+    buffer = tempfile.SpooledTemporaryFile(max_size=spill_size)
     try:
-        loader = PyPDFLoader(str(file_path))
-    except Exception as e:
-        print(e)
+        if size is None or size <= part_size or executor is None:
+            body = s3_client.get_object(**kwargs)["Body"]
+            shutil.copyfileobj(body, buffer, length=1024 * 1024)
+        else:
+            ranges = [
+                (start, min(start + part_size, size) - 1)
+                for start in range(0, size, part_size)
+            ]
+            # 未書き込みのパートがメモリを使い過ぎないよう、part_concurrency 個ずつ取得して順に書き込む
+            window = max(1, part_concurrency)
+            for i in range(0, len(ranges), window):
+                futures = [
+                    executor.submit(_get_range, kwargs, start, end)
+                    for start, end in ranges[i : i + window]
+                ]
+                for future in futures:
+                    buffer.write(future.result())
+        buffer.seek(0)
+    except Exception:
+        buffer.close()
+        raise
+
+    return buffer
+
+
+def _get_range(kwargs, start, end):
+    response = s3_client.get_object(Range=f"bytes={start}-{end}", **kwargs)
+    return response["Body"].read()
+
+
+def _open_source(source):
+    """
+    load_file() に渡されたパス、bytes、ファイルオブジェクトをバイナリのファイルオブジェクトにする
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb")
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
 
-    pages = loader.load_and_split()
-    text = ""
-    for page in pages:
-        try:
-            text += bytes(page.page_content, "latin1").decode("shift_jis")
-        except UnicodeEncodeError:
-            text += page.page_content
-        except UnicodeDecodeError:
-            text += "Unicode Decode Error"
 
-    return text
+def load_file(source, extension, loader=None):
+    """
+    ファイルからテキストを抽出する
 
+    Args:
+        source (str | bytes | file-like): ファイルのパス、中身、またはバイナリモードのファイルオブジェクト
+        extension (str): 拡張子 (.txt)
+        loader (str): 使用するローダー名 (loaders.py)。省略時は拡張子ごとの既定のローダー
+    Returns:
+        str: 抽出したテキスト。対応していない拡張子の場合は空文字列
+    """
+    func = loaders.get_loader(extension, loader)
+    if func is None:
+        return ""
 
-def load_word(file_path):
+    f = _open_source(source)
     try:
-        loader = Docx2txtLoader(str(file_path))
-    except Exception as e:
-        print(e)
-    pages = loader.load_and_split()
-    text = ""
-    for page in pages:
-        text += page.page_content
-    return text
+        return func(f)
+    finally:
+        # 呼び出し側から渡されたファイルオブジェクトは閉じない
+        if f is not source:
+            f.close()
 
 
-def load_ppt(file_path):
-    try:
-        loader = UnstructuredPowerPointLoader(str(file_path))
-    except Exception as e:
-        print(e)
-    pages = loader.load_and_split()
-    text = ""
-    for page in pages:
-        text += page.page_content
-    return text
+def get_all_filepath(file_url):
+    return [obj["file_name"] for obj in get_all_objects(file_url)]
 
 
-def load_html(file_path):
-    try:
-        loader = UnstructuredHTMLLoader(str(file_path))
-    except Exception as e:
-        print(e)
-    pages = loader.load_and_split()
-    text = ""
+def get_all_objects(file_url):
+    """
+    S3 のプレフィックス配下のオブジェクトを S3 パス、ETag、サイズの組で返す
 
-    for page in pages:
-        text += page.page_content
-    return text
+    Returns:
+        list[dict]: 例 [{"file_name": "s3://bucket_name/test/test.txt", "etag": "...", "size": 1024}]
+    """
+    return list(iter_objects(file_url))
 
 
-def get_all_filepath(file_url):
+def iter_objects(file_url, page_size=1000):
+    """
+    get_all_objects() と同じ値を、一覧のページを取得するたびに 1 件ずつ返すジェネレータ
+
+    一覧の取得が終わる前から、取得済みのファイルの処理を開始できる。
+    """
     bucket_name = file_url.split("/")[2]
     prefix = "/".join(file_url.split("/")[3:])
 
-    file_list = []
-    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
-    while True:
-        response = s3_client.list_objects_v2(**kwargs)
-        if response.get("Contents"):
-            file_list.extend(
-                [f's3://{bucket_name}/{content["Key"]}' for content in response["Contents"]]
-            )
-        if not response.get("IsTruncated"):  # レスポンスが切り捨てられていない場合
-            break
-        kwargs["ContinuationToken"] = response["NextContinuationToken"]
-
-    return file_list
+    paginator = s3_client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=bucket_name,
+        Prefix=prefix,
+        PaginationConfig={"PageSize": page_size},
+    )
+    for page in pages:
+        for content in page.get("Contents", []):
+            yield {
+                "file_name": f's3://{bucket_name}/{content["Key"]}',
+                "etag": content["ETag"].strip('"'),
+                "size": content["Size"],
+            }
 
 
 def get_all_keys(file_url):
@@ -0,0 +1,146 @@
+"""
+ベクトルの保存形式 (INGEST_VECTOR_STORAGE) ごとのマッピングと、bulk 登録用のエンコード
+
+| 保存形式  | エンジン | 1 次元あたり | OpenSearch |
+| --------- | -------- | ------------ | ---------- |
+| float     | lucene   | 4 バイト     | 2.9 以降   |
+| byte      | lucene   | 1 バイト     | 2.9 以降   |
+| fp16      | faiss    | 2 バイト     | 2.13 以降  |
+| lucene_sq | lucene   | 1 バイト     | 2.16 以降  |
+| binary    | faiss    | 1 ビット     | 2.16 以降  |
+
+byte と binary は Cohere の int8 / binary 形式の埋め込みをそのまま登録し、
+Titan の場合はクライアント側で量子化する。検索時のクエリも同じ方法でエンコードする必要があるため、
+保存形式はマッピングの _meta に記録し、検索用 Lambda はそれを参照する。
+"""
+
+import math
+
+VECTOR_STORAGE = {
+    "float": {
+        "method": {"engine": "lucene", "space_type": "cosinesimil"},
+        "min_version": (2, 9),
+    },
+    "byte": {
+        # cosinesimil はベクトルの大きさに依存しないため、ベクトルごとに異なる倍率で量子化できる
+        "data_type": "byte",
+        "method": {"engine": "lucene", "space_type": "cosinesimil"},
+        "min_version": (2, 9),
+    },
+    "fp16": {
+        # 2.13 の faiss は cosinesimil に対応していないため、正規化したベクトルの内積で代用する
+        "method": {
+            "engine": "faiss",
+            "space_type": "innerproduct",
+            "encoder": {"name": "sq", "parameters": {"type": "fp16", "clip": True}},
+        },
+        "min_version": (2, 13),
+    },
+    "lucene_sq": {
+        "method": {
+            "engine": "lucene",
+            "space_type": "cosinesimil",
+            "encoder": {"name": "sq"},
+        },
+        "min_version": (2, 16),
+    },
+    "binary": {
+        "data_type": "binary",
+        "method": {"engine": "faiss", "space_type": "hamming"},
+        "min_version": (2, 16),
+    },
+}
+
+
+def check_storage(storage, version=None):
+    """
+    Args:
+        storage (str): 保存形式
+        version (str): OpenSearch のバージョン (2.13.0)。指定した場合は対応しているか確認する
+    """
+    if storage not in VECTOR_STORAGE:
+        raise ValueError(
+            f"vector_storage must be one of {', '.join(VECTOR_STORAGE)}: {storage}"
+        )
+    if version is not None:
+        current = tuple(int(v) for v in version.split(".")[:2])
+        required = VECTOR_STORAGE[storage]["min_version"]
+        if current < required:
+            raise ValueError(
+                f"vector_storage={storage} requires OpenSearch "
+                f"{required[0]}.{required[1]} or later (current: {version})"
+            )
+
+
+def knn_mapping(storage, dimension, hnsw_parameters):
+    """
+    vector フィールドのマッピング。binary の場合の dimension はビット数 (8 の倍数)
+    """
+    spec = VECTOR_STORAGE[storage]
+    method = dict(spec["method"], name="hnsw")
+    parameters = dict(hnsw_parameters)
+    if "encoder" in method:
+        parameters["encoder"] = method.pop("encoder")
+    method["parameters"] = parameters
+
+    mapping = {"type": "knn_vector", "dimension": dimension, "method": method}
+    if "data_type" in spec:
+        mapping["data_type"] = spec["data_type"]
+    if storage == "binary" and int(dimension) % 8:
+        raise ValueError(f"dimension must be a multiple of 8 for binary: {dimension}")
+    return mapping
+
+
+def cohere_embedding_type(storage):
+    # Cohere が量子化済みの値を返せる保存形式は、その値をそのまま使う
+    return {"byte": "int8", "binary": "binary"}.get(storage, "float")
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def quantize_byte(vector):
+    """
+    最大の絶対値が 127 になるように倍率をかけて整数にする
+    """
+    max_abs = max((abs(v) for v in vector), default=0.0) or 1.0
+    scale = 127 / max_abs
+    return [int(round(v * scale)) for v in vector]
+
+
+def pack_binary(vector):
+    """
+    各次元の符号 (正なら 1) を 8 次元ずつ符号付き 8 ビット整数に詰める (Cohere の binary 形式と同じ)
+    """
+    packed = []
+    for i in range(0, len(vector), 8):
+        byte = 0
+        for v in vector[i : i + 8]:
+            byte = (byte << 1) | (1 if v > 0 else 0)
+        packed.append(byte - 256 if byte > 127 else byte)
+    return packed
+
+
+def encode_vector(vector, storage, quantized=False, decimals=6):
+    """
+    埋め込みベクトルを保存形式に合わせて bulk 登録用の値に変換する
+
+    Args:
+        vector (list): 埋め込みベクトル
+        storage (str): 保存形式
+        quantized (bool): Cohere の int8 / binary 形式で取得済みの場合は True
+        decimals (int): float の場合に残す小数点以下の桁数。JSON の大きさを減らすために丸める (None の場合は丸めない)
+    """
+    if storage in ("byte", "binary"):
+        if quantized:
+            return [int(v) for v in vector]
+        return quantize_byte(vector) if storage == "byte" else pack_binary(vector)
+    if storage == "fp16":
+        vector = normalize(vector)
+        # fp16 の有効桁数は 3 桁程度のため、それ以上の桁は送らない
+        decimals = 5 if decimals is None else min(decimals, 5)
+    if decimals is None:
+        return list(vector)
+    return [round(v, decimals) for v in vector]
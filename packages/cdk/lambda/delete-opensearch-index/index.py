@@ -5,7 +5,10 @@ from opensearchpy import (
     AWSV4SignerAuth,
 )
 import boto3
+import calendar
 import os
+import re
+import time
 
 
 logger = Logger(service="DeleteIndex")
@@ -32,7 +35,28 @@ def get_aoss_client(host_http):
     return client
 
 
+def list_versions(client, index_name):
+    """
+    取り込み処理が作成したバージョン付きのインデックス ({index_name}-v{日時}) を古い順に返す
+    """
+    pattern = re.compile(rf"^{re.escape(index_name)}-v\d{{14}}$")
+    indices = [idx["index"] for idx in client.cat.indices(format="json")]
+    return sorted(name for name in indices if pattern.match(name))
+
+
+def get_alias_target(client, index_name):
+    if not client.indices.exists_alias(name=index_name):
+        return None
+    return next(iter(client.indices.get_alias(name=index_name)))
+
+
 def delete_index(client, index_name):
+    # エイリアスを指定した場合は、エイリアスが指すインデックスを含む全てのバージョンを削除する
+    if get_alias_target(client, index_name) is not None:
+        for version in list_versions(client, index_name):
+            client.indices.delete(version)
+            logger.info(f"Index {version} is successfully deleted")
+        return True
     try:
         client.indices.delete(index_name)
         logger.info(f"Index {index_name} is successfylly deleted")
@@ -41,6 +65,44 @@ def delete_index(client, index_name):
         return True
 
 
+def version_age(index_name, version):
+    """
+    バージョン付きのインデックスの作成からの経過秒数。日時はインデックス名 (UTC) から求める
+    """
+    created = time.strptime(version[len(index_name) + 2 :], "%Y%m%d%H%M%S")
+    return time.time() - calendar.timegm(created)
+
+
+def delete_old_versions(client, index_name, keep, grace_hours=24):
+    """
+    エイリアスが指していない古いバージョンのインデックスを削除する
+
+    エイリアスが指しているバージョンより新しいものは取り込み中の可能性があるため、
+    作成から grace_hours 時間が経ったもの (検証に失敗した、または中断された取り込みの残り) のみ削除する。
+
+    Args:
+        keep (int): ロールバック用に残す、エイリアスが指していないバージョンの数 (新しい順)
+        grace_hours (float): エイリアスより新しいバージョンを削除するまでの時間
+    """
+    target = get_alias_target(client, index_name)
+    if target is None:
+        logger.info(f"Alias {index_name} not found, nothing to delete")
+        return []
+
+    versions = list_versions(client, index_name)
+    old_versions = [v for v in versions if v < target]
+    deleted = old_versions[: max(0, len(old_versions) - keep)]
+    deleted += [
+        v
+        for v in versions
+        if v > target and version_age(index_name, v) > grace_hours * 3600
+    ]
+    for version in deleted:
+        client.indices.delete(version)
+        logger.info(f"Index {version} is successfully deleted")
+    return deleted
+
+
 def handler(event, context):
     host_http = os.environ["OPENSEARCH_ENDPOINT"]
     index_name = os.environ["INDEX_NAME"]
@@ -48,6 +110,13 @@ def handler(event, context):
         index_name = event["index_name"]
 
     client = get_aoss_client(host_http)
-    delete_index(client, index_name)
+    if event.get("garbage_collect", False):
+        keep = int(event.get("keep", os.environ.get("KEEP_VERSIONS", 1)))
+        grace_hours = float(
+            event.get("grace_hours", os.environ.get("STALE_BUILD_GRACE_HOURS", 24))
+        )
+        delete_old_versions(client, index_name, keep, grace_hours)
+    else:
+        delete_index(client, index_name)
 
     logger.info("Process finished.")
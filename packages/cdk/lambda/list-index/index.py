@@ -1,5 +1,6 @@
 import json
 import os
+import re
 import boto3
 import requests
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
@@ -12,6 +13,9 @@ from opensearchpy import (
 
 logger = Logger(service="ListIndex")
 
+# 取り込み処理が作成するバージョン付きのインデックス名 ({エイリアス}-v{日時})
+VERSIONED_INDEX = re.compile(r"-v\d{14}$")
+
 def get_aos_client(endpoint):
     host = endpoint
     region = host.split(".")[1]
@@ -42,12 +46,23 @@ def handler(event, context):
 
     try:
         index_list = client.cat.indices(format="json")
-        indices = [idx['index'] for idx in index_list if not idx['index'].startswith('.')]
+        alias_list = client.cat.aliases(format="json")
+        # 検索はエイリアスに対して行うため、バージョン付きのインデックスの代わりにエイリアスを返す
+        aliases = {
+            a['alias']: a['index'] for a in alias_list if not a['alias'].startswith('.')
+        }
+        indices = sorted(aliases) + [
+            idx['index']
+            for idx in index_list
+            if not idx['index'].startswith('.')
+            and not VERSIONED_INDEX.search(idx['index'])
+        ]
         return {
             'statusCode': 200,
             'headers': headers,
             'body': json.dumps({
-                'indices': indices
+                'indices': indices,
+                'aliases': aliases,
             })
         }
         
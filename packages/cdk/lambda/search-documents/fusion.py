@@ -0,0 +1,151 @@
+"""
+ハイブリッド検索のスコア統合をクライアント側で行うための関数
+
+検索パイプラインの normalization-processor (min_max / l2 と arithmetic_mean / geometric_mean /
+harmonic_mean) および score-ranker-processor (rrf) と同じ計算を行う。
+"""
+
+import math
+
+# neural-search の min_max 正規化は、最小スコアのヒットが 0 にならないように下限を設けている
+MIN_MAX_LOWER_BOUND = 0.001
+
+NORMALIZATION_TECHNIQUES = ("min_max", "l2")
+COMBINATION_TECHNIQUES = ("arithmetic_mean", "geometric_mean", "harmonic_mean")
+
+
+def normalize_min_max(scores):
+    if not scores:
+        return []
+    min_score = min(scores)
+    max_score = max(scores)
+    if max_score == min_score:
+        return [1.0 for _ in scores]
+    normalized = []
+    for score in scores:
+        value = (score - min_score) / (max_score - min_score)
+        normalized.append(value if value > 0 else MIN_MAX_LOWER_BOUND)
+    return normalized
+
+
+def normalize_l2(scores):
+    norm = math.sqrt(sum(score * score for score in scores))
+    if norm == 0:
+        return [0.0 for _ in scores]
+    return [score / norm for score in scores]
+
+
+def combine_scores(scores, weights, technique="arithmetic_mean"):
+    """
+    サブクエリごとの正規化済みスコアを重み付き平均で統合する
+
+    neural-search と同様に、算術平均ではスコア 0 (そのサブクエリに含まれないヒット) も平均に含め、
+    幾何平均と調和平均では 0 より大きいスコアのみで平均をとる。
+    """
+    if technique == "arithmetic_mean":
+        return sum(w * s for s, w in zip(scores, weights)) / sum(weights)
+    pairs = [(s, w) for s, w in zip(scores, weights) if s > 0]
+    if not pairs:
+        return 0.0
+    total_weight = sum(w for _, w in pairs)
+    if technique == "geometric_mean":
+        return math.exp(sum(w * math.log(s) for s, w in pairs) / total_weight)
+    if technique == "harmonic_mean":
+        return total_weight / sum(w / s for s, w in pairs)
+    raise ValueError(f"Invalid combination technique: {technique}")
+
+
+def hit_id(hit):
+    return hit["_id"]
+
+
+def document_key(hit):
+    return hit["fields"]["doc_name"][0]
+
+
+def fuse_hits(
+    hit_lists,
+    weights=None,
+    normalization="min_max",
+    combination="arithmetic_mean",
+    key=hit_id,
+):
+    """
+    サブクエリごとの検索結果を正規化し、重み付き平均でスコアを統合する
+
+    あるサブクエリに含まれないヒットは、そのサブクエリのスコアを 0 として扱う。
+
+    Args:
+        hit_lists (list[list[dict]]): サブクエリごとの hits.hits
+        weights (list[float]): サブクエリごとの重み。省略時は均等
+        normalization (str): min_max または l2
+        combination (str): arithmetic_mean、geometric_mean または harmonic_mean
+        key (callable): 同じ結果とみなすヒットのキー。document_key の場合はドキュメント単位で統合し、
+            サブクエリごとに最良のチャンクが異なる場合は、正規化後のスコアが高い方のチャンクを残す
+    Returns:
+        list[dict]: スコアの降順に並べたヒット。_score は統合後のスコア
+    """
+    weights = weights or [1.0] * len(hit_lists)
+    if normalization == "min_max":
+        normalize = normalize_min_max
+    elif normalization == "l2":
+        normalize = normalize_l2
+    else:
+        raise ValueError(f"Invalid normalization technique: {normalization}")
+
+    combined = {}
+    for i, hits in enumerate(hit_lists):
+        normalized = normalize([hit["_score"] for hit in hits])
+        for hit, score in zip(hits, normalized):
+            entry = combined.setdefault(
+                key(hit), {"hit": hit, "best": -1.0, "scores": [0.0] * len(hit_lists)}
+            )
+            entry["scores"][i] = score
+            if weights[i] * score > entry["best"]:
+                entry["hit"] = hit
+                entry["best"] = weights[i] * score
+
+    fused = []
+    for entry in combined.values():
+        hit = dict(entry["hit"])
+        hit["_score"] = combine_scores(entry["scores"], weights, combination)
+        fused.append(hit)
+    fused.sort(key=lambda hit: hit["_score"], reverse=True)
+    return fused
+
+
+def fuse_hits_rrf(hit_lists, weights=None, rank_constant=60, key=hit_id):
+    """
+    Reciprocal Rank Fusion。スコアの分布に依存せず、各サブクエリでの順位 (1 始まり) から
+    weight / (rank_constant + rank) の和を統合後のスコアとする
+
+    Args:
+        hit_lists (list[list[dict]]): サブクエリごとの hits.hits (スコアの降順)
+        weights (list[float]): サブクエリごとの重み。省略時は均等
+        rank_constant (int): 上位と下位の差を緩める定数
+        key (callable): 同じ結果とみなすヒットのキー (fuse_hits と同じ)
+    Returns:
+        list[dict]: スコアの降順に並べたヒット。_score は統合後のスコア
+    """
+    weights = weights or [1.0] * len(hit_lists)
+
+    combined = {}
+    for hits, weight in zip(hit_lists, weights):
+        for rank, hit in enumerate(hits, start=1):
+            score = weight / (rank_constant + rank)
+            entry = combined.setdefault(
+                key(hit), {"hit": hit, "best": score, "score": 0.0}
+            )
+            entry["score"] += score
+            if score > entry["best"]:
+                entry["hit"] = hit
+                entry["best"] = score
+
+    fused = []
+    for entry in combined.values():
+        hit = dict(entry["hit"])
+        hit["_score"] = entry["score"]
+        fused.append(hit)
+    fused.sort(key=lambda hit: hit["_score"], reverse=True)
+    return fused
+
@@ -1,31 +1,208 @@
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
 from opensearchpy import (
     OpenSearch,
     RequestsHttpConnection,
     AWSV4SignerAuth,
+    NotFoundError,
+    RequestError,
 )
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import LRUEmbeddingCache, cache_key
+from fusion import document_key, fuse_hits, fuse_hits_rrf, hit_id
+from result_cache import ResultCache, result_cache_key
+from search_pipelines import SearchPipelineRegistry, parse_fusion_options
+from timing import Spans
+from vector_codec import cohere_embedding_type, encode_query_vector
 import boto3
 import json
 import os
+import threading
+import time
 
 logger = Logger(service="SearchDocuments")
+# 処理ごとの時間をリクエストごとに EMF のログで出力する (EMIT_METRICS が false の場合は出力しない)
+metrics = Metrics(
+    namespace=os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "IntelligentSearch"),
+    service="SearchDocuments",
+)
+EMIT_METRICS = os.environ.get("EMIT_METRICS", "true").lower() == "true"
+spans = Spans()
 bedrock_runtime = boto3.client(
     service_name="bedrock-runtime", region_name=os.environ["BEDROCK_REGION"]
 )
+# 同じクエリの埋め込みベクトルを実行環境ごとにキャッシュする
+embedding_cache = LRUEmbeddingCache(
+    int(os.environ.get("EMBEDDING_CACHE_SIZE", 1024))
+)
 
+# 同じクエリの検索結果 (シリアライズ済みのレスポンス) を実行環境ごとにキャッシュする。件数が 0 の場合はキャッシュしない
+result_cache = ResultCache(
+    int(os.environ.get("RESULT_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 60)),
+)
 
-def get_vector(client, text, index_name):
-    # モデル ID を取得
-    model_id = client.indices.get(index=index_name)[index_name]["mappings"][
-        "_meta"
-    ]["model_id"]
+# OpenSearch クライアントは実行環境ごとに 1 つ作成し、コネクションを再利用する
+aos_client = None
+aos_client_lock = threading.Lock()
 
-    if "cohere" in model_id:
+# ハイブリッド検索の実行方法。"pipeline" は hybrid クエリと検索パイプライン、
+# "concurrent" はキーワード検索とクエリの埋め込みを並行に実行してクライアント側でスコアを統合する
+HYBRID_SEARCH_MODE = os.environ.get("HYBRID_SEARCH_MODE", "pipeline")
+# concurrent モードでクエリの埋め込みを待つ時間の上限。超えた場合はキーワード検索の結果のみ返す
+EMBEDDING_TIMEOUT_MS = int(os.environ.get("EMBEDDING_TIMEOUT_MS", 2000))
+# リクエストの embeddingTimeoutMs に指定できる値の上限
+MAX_EMBEDDING_TIMEOUT_MS = int(
+    os.environ.get("MAX_EMBEDDING_TIMEOUT_MS", EMBEDDING_TIMEOUT_MS * 5)
+)
+# リクエストで指定されたスコア統合のパラメータごとに作成した検索パイプライン。
+# RRF_SEARCH_PIPELINE が true の場合は RRF も検索パイプライン (OpenSearch 2.19 以降) で行う
+# 検索パイプラインの数は MAX_SEARCH_PIPELINES までとし、超えた設定はクライアント側で統合する
+search_pipelines = SearchPipelineRegistry(
+    rrf_pipeline=os.environ.get("RRF_SEARCH_PIPELINE", "false").lower() == "true",
+    max_pipelines=int(os.environ.get("MAX_SEARCH_PIPELINES", 32)),
+)
+executor = ThreadPoolExecutor(max_workers=4)
+# Titan で複数のクエリを並列に埋め込むためのスレッドプール
+embed_executor = ThreadPoolExecutor(max_workers=8)
+# バッチ検索で 1 リクエストに含められるクエリ数の上限
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 100))
+
+# 1 回の検索で返す件数、ページングできる範囲、k-NN の k の上限
+MAX_RESULT_SIZE = int(os.environ.get("MAX_RESULT_SIZE", 100))
+MAX_RESULT_WINDOW = int(os.environ.get("MAX_RESULT_WINDOW", 1000))
+MAX_K = int(os.environ.get("MAX_K", 1000))
+# document 単位の検索で、各ドキュメントの最良のチャンクに加えて返せるチャンク数の上限
+MAX_EXTRA_CHUNKS = int(os.environ.get("MAX_EXTRA_CHUNKS", 10))
+# document 単位のベクトル検索で、返すドキュメント数に対して取得する近傍の数の倍率。
+# collapse は k-NN で取得した近傍をドキュメントごとにまとめるため、同じドキュメントのチャンクが多いと件数が不足する
+COLLAPSE_K_FACTOR = int(os.environ.get("COLLAPSE_K_FACTOR", 4))
+# 絞り込み条件 (filters) の 1 つのフィールドに指定できる値の数の上限
+MAX_FILTER_VALUES = int(os.environ.get("MAX_FILTER_VALUES", 100))
+# 絞り込みに使えるリクエストのキーと、インデックスのフィールド (keyword 型)
+FILTER_FIELDS = {"service": "service", "docsRoot": "docs_root"}
+
+FIELDS = ["keyword", "service", "docs_root", "doc_name", "shared_docs"]
+# searchAfter によるページングで使う並び順。_id はチャンクごとに一意なので同点の並びが安定する
+SEARCH_AFTER_SORT = [{"_score": "desc"}, {"_id": "asc"}]
+
+# エイリアスが指しているインデックス名のキャッシュ。blue/green の切り替えを数秒で反映するため、有効期限を短くする
+INDEX_ALIAS_TTL = float(os.environ.get("INDEX_ALIAS_TTL", 5))
+index_alias_cache = {}
+# インデックスごとのメタデータ (モデル ID、次元数) のキャッシュ。キーは実際のインデックス名
+INDEX_META_TTL = int(os.environ.get("INDEX_META_TTL", 300))
+index_meta_cache = {}
+# インデックスの世代 (検索結果のキャッシュのキー) のキャッシュ。検索結果のキャッシュより短い有効期限にする
+INDEX_GENERATION_TTL = float(os.environ.get("INDEX_GENERATION_TTL", 5))
+index_generation_cache = {}
+index_meta_lock = threading.Lock()
+
+
+def resolve_index(client, index_name):
+    """
+    エイリアスが指している実際のインデックス名を返す。エイリアスでない場合はそのまま返す
+
+    結果は INDEX_ALIAS_TTL 秒キャッシュする。
+    """
+    now = time.monotonic()
+    with index_meta_lock:
+        cached = index_alias_cache.get(index_name)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    with spans.span("metadata"):
+        response = client.indices.get_alias(index=index_name)
+    # 切り替え中に複数のインデックスを指している場合は、新しいバージョンを使う
+    physical_index = max(response)
+
+    with index_meta_lock:
+        index_alias_cache[index_name] = (now + INDEX_ALIAS_TTL, physical_index)
+    return physical_index
+
+
+def get_index_meta(client, index_name):
+    """
+    インデックスのマッピングから、埋め込みに使ったモデル ID、ベクトルの次元数と保存形式を取得する
+
+    メタデータはエイリアスが指している実際のインデックスごとに INDEX_META_TTL 秒キャッシュするため、
+    エイリアスを別のモデルのインデックスに切り替えた場合も INDEX_ALIAS_TTL 秒以内に反映される。
+    """
+    physical_index = resolve_index(client, index_name)
+    now = time.monotonic()
+    with index_meta_lock:
+        cached = index_meta_cache.get(physical_index)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    with spans.span("metadata"):
+        response = client.indices.get_mapping(index=physical_index)
+    mappings = response[physical_index]["mappings"]
+    meta = {
+        "index": physical_index,
+        "model_id": mappings["_meta"]["model_id"],
+        "dimension": mappings["properties"]["vector"]["dimension"],
+        "vector_storage": mappings["_meta"].get("vector_storage", "float"),
+    }
+
+    with index_meta_lock:
+        index_meta_cache[physical_index] = (now + INDEX_META_TTL, meta)
+    return meta
+
+
+def get_index_generation(client, index_name):
+    """
+    検索結果のキャッシュのキーに含めるインデックスの世代を返す。エイリアスの切り替えと取り込みのたびに変わる
+
+    取り込みで更新されるマッピングの _meta の generation のみを取得し、INDEX_GENERATION_TTL 秒キャッシュする。
+    """
+    physical_index = resolve_index(client, index_name)
+    now = time.monotonic()
+    with index_meta_lock:
+        cached = index_generation_cache.get(physical_index)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    with spans.span("metadata"):
+        response = client.indices.get_mapping(
+            index=physical_index, filter_path="*.mappings._meta.generation"
+        )
+    meta = response.get(physical_index, {}).get("mappings", {}).get("_meta", {})
+    generation = f"{physical_index}:{meta.get('generation', '')}"
+
+    with index_meta_lock:
+        index_generation_cache[physical_index] = (
+            now + INDEX_GENERATION_TTL,
+            generation,
+        )
+    return generation
+
+
+def invalidate_index_meta(index_name=None):
+    """
+    インデックスの削除・再作成時やエイリアスの切り替え時にメタデータのキャッシュを破棄する。
+    index_name を省略した場合は全て破棄する
+    """
+    with index_meta_lock:
+        if index_name is None:
+            index_alias_cache.clear()
+            index_meta_cache.clear()
+            index_generation_cache.clear()
+            return
+        cached = index_alias_cache.pop(index_name, None)
+        for physical_index in {index_name, cached[1] if cached else index_name}:
+            index_meta_cache.pop(physical_index, None)
+            index_generation_cache.pop(physical_index, None)
+
+
+def embed_with_cohere(model_id, texts, embedding_type="float"):
+    vectors = []
+    max_text_num = 96
+    for i in range(0, len(texts), max_text_num):
         body = json.dumps(
             {
-                "texts": [text],
+                "texts": texts[i : i + max_text_num],
                 "input_type": "search_query",
-                "embedding_types": ["float"],
+                "embedding_types": [embedding_type],
             }
         )
         query_response = bedrock_runtime.invoke_model(
@@ -34,102 +211,585 @@ def get_vector(client, text, index_name):
             accept="*/*",
             contentType="application/json",
         )
-        vector = json.loads(query_response["body"].read()).get("embeddings")[
-            "float"
-        ][0]
-    else:
-
-        # Bedrock のモデルからベクトルを取得
-        query_response = bedrock_runtime.invoke_model(
-            body=json.dumps({"inputText": text}),
-            modelId=model_id,
-            accept="application/json",
-            contentType="application/json",
+        vectors.extend(
+            json.loads(query_response["body"].read()).get("embeddings")[
+                embedding_type
+            ]
         )
+    return vectors
 
-        vector = json.loads(query_response["body"].read()).get("embedding")
 
-    return vector
+def embed_with_titan(model_id, text):
+    # Bedrock のモデルからベクトルを取得
+    query_response = bedrock_runtime.invoke_model(
+        body=json.dumps({"inputText": text}),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    return json.loads(query_response["body"].read()).get("embedding")
 
 
-def find_similar_docs(client, search_query, index_name, search_pipeline=None):
-    if search_pipeline:
-        results = client.search(
-            index=index_name, body=search_query, search_pipeline=search_pipeline
-        )
-    else:
-        results = client.search(index=index_name, body=search_query)
+def get_vectors(client, texts, index_name):
+    """
+    複数のクエリをまとめてベクトルに変換する
 
-    search_results = []
-    for hit in results["hits"]["hits"]:
-        search_results.append(
-            {
-                "text": hit["fields"]["keyword"][0],
-                "score": hit["_score"],
-                "service": hit["fields"]["service"][0],
-                "docs_root": hit["fields"]["docs_root"][0],
-                "doc_name": hit["fields"]["doc_name"][0],
-            }
-        )
-    return search_results
+    Cohere は 1 リクエストで最大 96 件、Titan は 1 件ずつ並列にリクエストする。
+    ベクトルはインデックスの保存形式に合わせてエンコードした値を返す。
+    """
+    # モデル ID を取得
+    meta = get_index_meta(client, index_name)
+    model_id = meta["model_id"]
+    storage = meta.get("vector_storage", "float")
+
+    embedding_type = "float"
+    input_type = ""
+    if "cohere" in model_id:
+        embedding_type = cohere_embedding_type(storage)
+        input_type = "search_query"
+    # 保存形式が異なるインデックスのベクトルを取り違えないように、キャッシュのキーに含める
+    if storage != "float":
+        input_type = f"{input_type}:{storage}"
+    keys = [cache_key(model_id, input_type, text) for text in texts]
+    vectors = {}
+    for key, text in zip(keys, texts):
+        vector = embedding_cache.get(key)
+        if vector is not None:
+            vectors[key] = vector
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors and key not in missing:
+            missing[key] = text
+
+    if len(missing) < len(texts):
+        logger.info("Embedding cache hit", extra=embedding_cache.stats())
+
+    if missing:
+        missing_texts = list(missing.values())
+        with spans.span("embedding"):
+            if "cohere" in model_id:
+                new_vectors = embed_with_cohere(
+                    model_id, missing_texts, embedding_type
+                )
+            elif len(missing_texts) == 1:
+                new_vectors = [embed_with_titan(model_id, missing_texts[0])]
+            else:
+                new_vectors = list(
+                    embed_executor.map(
+                        lambda text: embed_with_titan(model_id, text), missing_texts
+                    )
+                )
+        quantized = embedding_type != "float"
+        for key, vector in zip(missing.keys(), new_vectors):
+            vector = encode_query_vector(vector, storage, quantized)
+            embedding_cache.put(key, vector)
+            vectors[key] = vector
+
+    return [vectors[key] for key in keys]
+
+
+def get_vector(client, text, index_name):
+    return get_vectors(client, [text], index_name)[0]
 
 
-def find_similar_docs_keyword(client, text, index_name, search_result_unit):
+def parse_int_option(body, name, default, min_value, max_value):
+    value = body.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{name} must be an integer")
+    if value < min_value or value > max_value:
+        raise ValueError(f"{name} must be between {min_value} and {max_value}")
+    return value
+
+
+def parse_filters(filters):
+    """
+    リクエストの filters (例 {"service": ["ec2", "s3"], "docsRoot": "s3://bucket/docs"}) を
+    bool クエリの filter 句のリストに変換する。値を複数指定した場合はいずれかに一致するチャンクを検索する
+    """
+    if filters is None:
+        return []
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+
+    clauses = []
+    for key, values in sorted(filters.items()):
+        field = FILTER_FIELDS.get(key)
+        if field is None:
+            raise ValueError(
+                f"filters supports only {', '.join(sorted(FILTER_FIELDS))}: {key}"
+            )
+        if isinstance(values, str):
+            values = [values]
+        if (
+            not isinstance(values, list)
+            or not values
+            or any(not isinstance(value, str) for value in values)
+        ):
+            raise ValueError(f"filters.{key} must be a string or a list of strings")
+        if len(values) > MAX_FILTER_VALUES:
+            raise ValueError(
+                f"filters.{key} must have at most {MAX_FILTER_VALUES} values"
+            )
+        clauses.append({"terms": {field: sorted(set(values))}})
+    return clauses
+
+
+def parse_search_options(body):
+    """
+    リクエストから検索件数、ページング、k-NN のパラメータ、スコア統合の方法、絞り込み条件を取り出す
+
+    Returns:
+        dict: size, from, search_after, k, ef_search, extra_chunks, fusion, filters
+    """
+    size = parse_int_option(body, "size", 5, 1, MAX_RESULT_SIZE)
+    from_ = parse_int_option(body, "from", 0, 0, MAX_RESULT_WINDOW - size)
+    k = parse_int_option(body, "k", size, 1, MAX_K)
+    ef_search = parse_int_option(body, "efSearch", None, 1, MAX_K)
+
+    search_after = body.get("searchAfter")
+    if search_after is not None:
+        if not isinstance(search_after, list) or len(search_after) != len(
+            SEARCH_AFTER_SORT
+        ):
+            raise ValueError("searchAfter must be the sort value of the last result")
+        if from_:
+            raise ValueError("from and searchAfter cannot be used together")
+
+    return {
+        "size": size,
+        "from": from_,
+        "search_after": search_after,
+        "k": k,
+        "ef_search": ef_search,
+        "extra_chunks": parse_int_option(
+            body, "extraChunks", 0, 0, MAX_EXTRA_CHUNKS
+        ),
+        "fusion": parse_fusion_options(body.get("fusion")),
+        "filters": parse_filters(body.get("filters")),
+    }
+
+
+DEFAULT_SEARCH_OPTIONS = parse_search_options({})
+
+
+def knn_k(options, collapse=False):
+    # lucene エンジンでは k がセグメントごとの HNSW 探索の候補数 (ef_search 相当) になるため、
+    # ef_search が指定された場合は k を引き上げ、返す件数は size で絞る
+    window = options["from"] + options["size"]
+    if collapse:
+        window *= COLLAPSE_K_FACTOR
+    return min(MAX_K, max(options["k"], window, options["ef_search"] or 0))
+
+
+def build_knn_query(vector, options, collapse=False):
+    knn = {"vector": vector, "k": knn_k(options, collapse)}
+    if options["filters"]:
+        # lucene / faiss エンジンの efficient filtering。HNSW の探索中に条件に一致するチャンクだけを候補にし、
+        # 一致する件数が少ない場合は自動的に全件の距離計算に切り替わるため、絞り込んでも k 件が返る
+        knn["filter"] = {"bool": {"filter": options["filters"]}}
+    return {"knn": {"vector": knn}}
+
+
+def build_keyword_query(text, options):
+    query = {"match": {"keyword": {"query": text}}}
+    if options["filters"]:
+        # filter 句はスコアに影響せず、結果はフィルターキャッシュで再利用される
+        return {"bool": {"must": [query], "filter": options["filters"]}}
+    return query
+
+
+def build_collapse(options):
+    """
+    doc_name で結果をまとめる collapse。検索時に畳み込むため、size 件の異なるドキュメントが返る。
+    extra_chunks を指定した場合は、inner_hits で同じドキュメントの上位のチャンクも取得する
+    """
+    collapse = {"field": "doc_name"}
+    if options["extra_chunks"]:
+        collapse["inner_hits"] = {
+            "name": "chunks",
+            # 先頭は collapse で返るチャンク自身なので 1 件多く取得する
+            "size": options["extra_chunks"] + 1,
+            "_source": False,
+            "fields": ["keyword"],
+        }
+    return collapse
+
+
+def build_search_body(query, options, collapse=False):
     search_query = {
-        "size": 5,
+        "size": options["size"],
         "_source": False,
-        "fields": ["keyword", "service", "docs_root", "doc_name"],
-        "query": {"match": {"keyword": {"query": text}}},
+        "fields": FIELDS,
+        "query": query,
     }
-    if search_result_unit == "document":
-        search_pipeline = "collapse-search-pipeline"
-    elif search_result_unit == "chunk":
-        search_pipeline = None
-    else:
-        raise ValueError("Invalid search result unit")
-    return find_similar_docs(client, search_query, index_name, search_pipeline)
+    if options["from"]:
+        search_query["from"] = options["from"]
+    if collapse:
+        if options["search_after"] is not None:
+            raise ValueError("searchAfter is not supported for the document unit")
+        search_query["collapse"] = build_collapse(options)
+    if options["search_after"] is not None:
+        search_query["sort"] = SEARCH_AFTER_SORT
+        search_query["search_after"] = options["search_after"]
+    return search_query
 
 
-def find_similar_docs_vector(client, vector, index_name, search_result_unit):
-    search_query = {
-        "size": 5,
+def build_leg_body(query, options, collapse=False):
+    """
+    クライアント側でスコアを統合するサブクエリの検索リクエスト。ページングは統合後に行うため from + size 件取得する
+
+    collapse が True の場合は from + size 件のドキュメントを取得し、統合もドキュメント単位で行う。
+    """
+    if options["search_after"] is not None:
+        raise ValueError("searchAfter is not supported for hybrid search")
+    body = {
+        "size": options["from"] + options["size"],
         "_source": False,
-        "fields": ["keyword", "service", "docs_root", "doc_name"],
-        "query": {"knn": {"vector": {"vector": vector, "k": 5}}},
+        "fields": FIELDS,
+        "query": query,
     }
-    if search_result_unit == "document":
-        search_pipeline = "collapse-search-pipeline"
-    elif search_result_unit == "chunk":
-        search_pipeline = None
-    else:
+    if collapse:
+        body["collapse"] = build_collapse(options)
+    return body
+
+
+def fuse_legs(hit_lists, fusion, collapse=False):
+    """
+    キーワード検索とベクトル検索の結果を、リクエストで指定された方法でクライアント側で統合する
+
+    collapse が True の場合は、doc_name で畳み込んだ結果をドキュメント単位で統合する。
+    """
+    key = document_key if collapse else hit_id
+    if fusion["method"] == "rrf":
+        return fuse_hits_rrf(
+            hit_lists, fusion["weights"], fusion["rank_constant"], key=key
+        )
+    return fuse_hits(
+        hit_lists,
+        fusion["weights"],
+        fusion["normalization"],
+        fusion["combination"],
+        key=key,
+    )
+
+
+def page_hits(hits, options):
+    return hits[options["from"] : options["from"] + options["size"]]
+
+
+def search_hits(client, search_query, index_name, search_pipeline=None):
+    with spans.span("search"):
+        if search_pipeline:
+            results = client.search(
+                index=index_name, body=search_query, search_pipeline=search_pipeline
+            )
+        else:
+            results = client.search(index=index_name, body=search_query)
+    return results["hits"]["hits"]
+
+
+def msearch_hits(client, index_name, search_queries):
+    """
+    複数の検索を 1 回の _msearch で実行し、検索ごとの hits.hits を返す
+    """
+    body = []
+    for search_query in search_queries:
+        body.append({"index": index_name})
+        body.append(search_query)
+    with spans.span("search"):
+        responses = client.msearch(body=body)["responses"]
+
+    hit_lists = []
+    for response in responses:
+        if "error" in response:
+            if response.get("status") == 404:
+                raise NotFoundError(404, "index_not_found_exception", response)
+            if response.get("status") == 400:
+                raise RequestError(400, "search_phase_execution_exception", response)
+            raise RuntimeError(f"Search failed: {response['error']}")
+        hit_lists.append(response["hits"]["hits"])
+    return hit_lists
+
+
+def format_hits(hits):
+    search_results = []
+    for hit in hits:
+        result = {
+            "text": hit["fields"]["keyword"][0],
+            "score": hit["_score"],
+            "service": hit["fields"]["service"][0],
+            "docs_root": hit["fields"]["docs_root"][0],
+            "doc_name": hit["fields"]["doc_name"][0],
+        }
+        # 取り込み時に重複として登録を省略した、同じ内容のチャンクを含む他のドキュメント
+        if "shared_docs" in hit["fields"]:
+            result["shared_docs"] = hit["fields"]["shared_docs"]
+        # 次のページを取得する時に searchAfter に指定する値
+        if "sort" in hit:
+            result["sort"] = hit["sort"]
+        # document 単位の検索で extraChunks を指定した場合の、同じドキュメントの他のチャンク
+        if "inner_hits" in hit:
+            inner_hits = hit["inner_hits"]["chunks"]["hits"]["hits"]
+            result["chunks"] = [
+                {"text": inner["fields"]["keyword"][0], "score": inner["_score"]}
+                for inner in inner_hits
+                if inner["_id"] != hit["_id"]
+            ][: max(0, len(inner_hits) - 1)]
+        search_results.append(result)
+    return search_results
+
+
+def find_similar_docs(client, search_query, index_name, search_pipeline=None):
+    return format_hits(
+        search_hits(client, search_query, index_name, search_pipeline)
+    )
+
+
+def check_result_unit(search_result_unit):
+    """
+    Returns:
+        bool: document 単位 (doc_name で collapse する) かどうか
+    """
+    if search_result_unit not in ("document", "chunk"):
         raise ValueError("Invalid search result unit")
-    return find_similar_docs(client, search_query, index_name, search_pipeline)
+    return search_result_unit == "document"
+
+
+def find_similar_docs_keyword(
+    client, text, index_name, search_result_unit, options=DEFAULT_SEARCH_OPTIONS
+):
+    collapse = check_result_unit(search_result_unit)
+    search_query = build_search_body(
+        build_keyword_query(text, options), options, collapse
+    )
+    return find_similar_docs(client, search_query, index_name)
+
+
+def find_similar_docs_vector(
+    client, vector, index_name, search_result_unit, options=DEFAULT_SEARCH_OPTIONS
+):
+    collapse = check_result_unit(search_result_unit)
+    search_query = build_search_body(
+        build_knn_query(vector, options, collapse), options, collapse
+    )
+    return find_similar_docs(client, search_query, index_name)
 
 
 def find_similar_docs_hybrid(
-    client, vector, text, index_name, search_result_unit
+    client,
+    vector,
+    text,
+    index_name,
+    search_result_unit,
+    options=DEFAULT_SEARCH_OPTIONS,
 ):
-    search_query = {
-        "size": 5,
-        "_source": False,
-        "fields": ["keyword", "service", "docs_root", "doc_name"],
-        "query": {
+    collapse = check_result_unit(search_result_unit)
+    search_pipeline = None
+    if not collapse:
+        search_pipeline = search_pipelines.get(client, options["fusion"])
+    if search_pipeline is None:
+        # hybrid クエリは collapse と併用できないため、document 単位の場合はキーワード検索とベクトル検索を
+        # それぞれ collapse して 1 回の _msearch で実行し、ドキュメント単位でスコアを統合する。
+        # 検索パイプラインの数が上限に達した場合も、同じ方法でクライアント側で統合する
+        hit_lists = msearch_hits(
+            client,
+            index_name,
+            [
+                build_leg_body(build_keyword_query(text, options), options, collapse),
+                build_leg_body(
+                    build_knn_query(vector, options, collapse), options, collapse
+                ),
+            ],
+        )
+        hits = fuse_legs(hit_lists, options["fusion"], collapse=collapse)
+        return format_hits(page_hits(hits, options))
+
+    # hybrid クエリは from をサポートしていないため、from + size 件取得してから切り出す
+    search_query = build_leg_body(
+        {
             "hybrid": {
                 "queries": [
-                    {"match": {"keyword": {"query": text}}},
-                    {"knn": {"vector": {"vector": vector, "k": 5}}},
+                    build_keyword_query(text, options),
+                    build_knn_query(vector, options),
                 ]
             }
         },
-    }
+        options,
+    )
+
+    hits = search_hits(client, search_query, index_name, search_pipeline)
+    return format_hits(page_hits(hits, options))
+
+
+def find_similar_docs_hybrid_concurrent(
+    client,
+    text,
+    index_name,
+    search_result_unit,
+    timeout,
+    options=DEFAULT_SEARCH_OPTIONS,
+):
+    """
+    クエリの埋め込みと並行してキーワード検索を実行し、ベクトル検索の結果とクライアント側で統合する
 
-    if search_result_unit == "document":
-        search_pipeline = "collapse-hybrid-search-pipeline"
-    elif search_result_unit == "chunk":
-        search_pipeline = "hybrid-search-pipeline"
+    埋め込みが timeout 秒以内に終わらない場合や失敗した場合は、キーワード検索の結果のみで統合する。
+
+    Returns:
+        tuple: (検索結果, キーワード検索のみで統合したかどうか)
+    """
+    collapse = check_result_unit(search_result_unit)
+
+    started_at = time.monotonic()
+    vector_future = executor.submit(get_vector, client, text, index_name)
+
+    keyword_hits = search_hits(
+        client,
+        build_leg_body(build_keyword_query(text, options), options, collapse),
+        index_name,
+    )
+
+    vector_hits = []
+    degraded = False
+    try:
+        remaining = max(0.0, timeout - (time.monotonic() - started_at))
+        vector = vector_future.result(timeout=remaining)
+    except Exception as e:
+        # Bedrock の遅延やスロットリング時は、キーワード検索の結果だけを返す
+        logger.warning(f"Falling back to keyword search: {type(e).__name__} {e}")
+        degraded = True
     else:
-        raise ValueError("Invalid search result unit")
-    return find_similar_docs(client, search_query, index_name, search_pipeline)
+        vector_hits = search_hits(
+            client,
+            build_leg_body(
+                build_knn_query(vector, options, collapse), options, collapse
+            ),
+            index_name,
+        )
+
+    hits = fuse_legs([keyword_hits, vector_hits], options["fusion"], collapse)
+    return format_hits(page_hits(hits, options)), degraded
+
+
+def build_batch_queries(body):
+    """
+    バッチ検索のリクエストを (テキスト, 検索方法, 検索単位) のリストに展開する
+
+    queries で 1 件ずつ指定するか、texts と searchMethods の全ての組み合わせを指定する。
+    """
+    if "queries" in body:
+        default_unit = body.get("searchResultUnit", "chunk")
+        queries = [
+            (
+                q["text"],
+                q["searchMethod"],
+                q.get("searchResultUnit", default_unit),
+            )
+            for q in body["queries"]
+        ]
+    else:
+        queries = [
+            (text, method, body.get("searchResultUnit", "chunk"))
+            for text in body["texts"]
+            for method in body["searchMethods"]
+        ]
+
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"Too many queries (max: {MAX_BATCH_QUERIES})")
+    for _, method, unit in queries:
+        if method not in ("keyword", "vector", "hybrid"):
+            raise ValueError(f"Invalid search method: {method}")
+        if unit not in ("document", "chunk"):
+            raise ValueError("Invalid search result unit")
+    return queries
+
+
+def batch_search(client, index_name, queries, options=DEFAULT_SEARCH_OPTIONS):
+    """
+    複数のクエリのベクトル化を 1 回にまとめ、全ての検索を 1 回の _msearch で実行する
+
+    ハイブリッド検索はキーワード検索とベクトル検索を別々に実行し、クライアント側でスコアを統合する。
+    """
+    timings = {}
+    started_at = time.perf_counter()
+
+    vector_texts = list(
+        dict.fromkeys(text for text, method, _ in queries if method != "keyword")
+    )
+    vectors = {}
+    if vector_texts:
+        vectors = dict(
+            zip(vector_texts, get_vectors(client, vector_texts, index_name))
+        )
+    timings["embed_ms"] = round((time.perf_counter() - started_at) * 1000, 3)
+
+    searches = []
+    # クエリごとに、_msearch の中で何番目の検索結果を使うか
+    legs = []
+    for text, method, unit in queries:
+        # document 単位の場合は各サブクエリを collapse し、ドキュメント単位で統合する
+        collapse = unit == "document"
+        query_legs = []
+        if method in ("keyword", "hybrid"):
+            query_legs.append(len(searches))
+            searches.append(
+                build_leg_body(build_keyword_query(text, options), options, collapse)
+            )
+        if method in ("vector", "hybrid"):
+            query_legs.append(len(searches))
+            searches.append(
+                build_leg_body(
+                    build_knn_query(vectors[text], options, collapse),
+                    options,
+                    collapse,
+                )
+            )
+        legs.append(query_legs)
+
+    msearch_body = []
+    for search_query in searches:
+        msearch_body.append({"index": index_name})
+        msearch_body.append(search_query)
+
+    msearch_started_at = time.perf_counter()
+    with spans.span("search"):
+        responses = client.msearch(body=msearch_body)["responses"] if searches else []
+    timings["msearch_ms"] = round(
+        (time.perf_counter() - msearch_started_at) * 1000, 3
+    )
+
+    results = []
+    for (text, method, unit), query_legs in zip(queries, legs):
+        fusion_started_at = time.perf_counter()
+        item = {"text": text, "searchMethod": method, "searchResultUnit": unit}
+
+        errors = [
+            responses[i]["error"] for i in query_legs if "error" in responses[i]
+        ]
+        if errors:
+            # ベクトルが受け付けられない場合は、次のリクエストでメタデータを取り直す
+            if any(responses[i].get("status") == 400 for i in query_legs):
+                invalidate_index_meta(index_name)
+            item["error"] = errors[0]
+            results.append(item)
+            continue
+
+        hit_lists = [responses[i]["hits"]["hits"] for i in query_legs]
+        if method == "hybrid":
+            hits = fuse_legs(hit_lists, options["fusion"], unit == "document")
+        else:
+            hits = hit_lists[0]
+
+        item["results"] = format_hits(page_hits(hits, options))
+        item["fusion_ms"] = round(
+            (time.perf_counter() - fusion_started_at) * 1000, 3
+        )
+        results.append(item)
+
+    timings["total_ms"] = round((time.perf_counter() - started_at) * 1000, 3)
+    return {"results": results, "timings": timings}
 
 
 def get_aos_client(endpoint):
@@ -152,38 +812,130 @@ def get_aos_client(endpoint):
     return client
 
 
+def get_client():
+    global aos_client
+    with aos_client_lock:
+        if aos_client is None:
+            aos_client = get_aos_client(os.environ["OPENSEARCH_ENDPOINT"])
+        return aos_client
+
+
 def handler(event, context):
-    endpoint = os.environ["OPENSEARCH_ENDPOINT"]
+    spans.reset()
+    with spans.span("total"):
+        response = handle(event, context)
+    record_metrics(event, response)
+    return response
 
-    body = json.loads(event["body"])
-    client = get_aos_client(endpoint)
 
-    index_name = body["indexName"]
-    text = body["text"]
-    search_method = body["searchMethod"]
-    search_result_unit = body["searchResultUnit"]
+def record_metrics(event, response):
+    """
+    処理ごとの時間を Server-Timing ヘッダーに付与し、EMF のログでメトリクスとして出力する
+    """
+    headers = response.setdefault("headers", {})
+    headers["Server-Timing"] = spans.server_timing()
+    headers["Timing-Allow-Origin"] = "*"
+    if not EMIT_METRICS:
+        return
+
+    if event.get("resource") == "/search/batch":
+        method = "batch"
+    else:
+        method = json.loads(event["body"]).get("searchMethod")
+    # ディメンションの値が増えすぎないように、不正な検索方法はまとめる
+    if method not in ("keyword", "vector", "hybrid", "batch"):
+        method = "invalid"
+    metrics.add_dimension(name="SearchMethod", value=method)
+    for name, ms in spans.items():
+        metrics.add_metric(
+            name=f"{name.capitalize()}Latency", unit=MetricUnit.Milliseconds, value=ms
+        )
+    metrics.add_metric(
+        name="ResultCacheHit",
+        unit=MetricUnit.Count,
+        value=int(headers.get("X-Cache") == "hit"),
+    )
+    if response["statusCode"] >= 500:
+        metrics.add_metric(name="Errors", unit=MetricUnit.Count, value=1)
+    metrics.flush_metrics()
+
+
+def handle(event, context, retry=True):
+    body = json.loads(event["body"])
+    client = get_client()
 
     headers = {
         "Content-Type": "application/json",
         "Access-Control-Allow-Origin": "*",
     }
 
+    index_name = body["indexName"]
+    if event.get("resource") == "/search/batch":
+        return batch_handler(client, body, index_name, headers, retry)
+
+    text = body["text"]
+    search_method = body["searchMethod"]
+    search_result_unit = body["searchResultUnit"]
+
     try:
-        if search_method == "hybrid":
+        options = parse_search_options(body)
+        hybrid_mode = body.get("hybridMode", HYBRID_SEARCH_MODE)
+        embedding_timeout_ms = parse_int_option(
+            body,
+            "embeddingTimeoutMs",
+            EMBEDDING_TIMEOUT_MS,
+            0,
+            MAX_EMBEDDING_TIMEOUT_MS,
+        )
+
+        result_key = None
+        if result_cache.enabled and body.get("useCache", True):
+            generation = get_index_generation(client, index_name)
+            result_key = result_cache_key(
+                generation,
+                search_method,
+                search_result_unit,
+                text,
+                dict(options, hybrid_mode=hybrid_mode),
+            )
+            cached = result_cache.get(result_key)
+            if cached is not None:
+                headers["X-Cache"] = "hit"
+                headers["Access-Control-Expose-Headers"] = "X-Cache"
+                return {"statusCode": 200, "headers": headers, "body": cached}
+
+        degraded = False
+        # 検索パイプラインで実行できないスコア統合 (RRF) は、クライアント側で統合する
+        if search_method == "hybrid" and (
+            hybrid_mode == "concurrent"
+            or not search_pipelines.supports(options["fusion"])
+        ):
+            search_results, degraded = find_similar_docs_hybrid_concurrent(
+                client,
+                text,
+                index_name,
+                search_result_unit,
+                embedding_timeout_ms / 1000,
+                options,
+            )
+            if degraded:
+                headers["X-Search-Degraded"] = "keyword-only"
+
+        elif search_method == "hybrid":
             vector = get_vector(client, text, index_name)
             search_results = find_similar_docs_hybrid(
-                client, vector, text, index_name, search_result_unit
+                client, vector, text, index_name, search_result_unit, options
             )
 
         elif search_method == "vector":
             vector = get_vector(client, text, index_name)
             search_results = find_similar_docs_vector(
-                client, vector, index_name, search_result_unit
+                client, vector, index_name, search_result_unit, options
             )
 
         elif search_method == "keyword":
             search_results = find_similar_docs_keyword(
-                client, text, index_name, search_result_unit
+                client, text, index_name, search_result_unit, options
             )
 
         else:
@@ -193,10 +945,40 @@ def handler(event, context):
                 "body": json.dumps({"error": "invalid search method"}),
             }
 
+        response_body = json.dumps(search_results, ensure_ascii=False)
+        # キーワード検索のみにフォールバックした結果はキャッシュしない
+        if result_key is not None and not degraded:
+            result_cache.put(result_key, response_body)
+        headers["X-Cache"] = "miss"
+        headers["Access-Control-Expose-Headers"] = "X-Cache, X-Search-Degraded"
         return {
             "statusCode": 200,
             "headers": headers,
-            "body": json.dumps(search_results, ensure_ascii=False),
+            "body": response_body,
+        }
+
+    except NotFoundError as e:
+        # インデックスが削除された場合に、古いメタデータを使い続けないようにする
+        invalidate_index_meta(index_name)
+        logger.error(f"Index not found: {e}")
+        return {
+            "statusCode": 404,
+            "headers": headers,
+            "body": json.dumps({"error": f"index {index_name} not found"}),
+        }
+
+    except RequestError as e:
+        # エイリアスが別のモデル・保存形式のインデックスに切り替わった場合、キャッシュしたメタデータで
+        # 作ったベクトルは受け付けられない。メタデータを破棄して 1 回だけやり直す
+        invalidate_index_meta(index_name)
+        if retry:
+            logger.warning(f"Retrying after the index metadata was refreshed: {e}")
+            return handle(event, context, retry=False)
+        logger.error(f"Search request was rejected: {e}")
+        return {
+            "statusCode": 400,
+            "headers": headers,
+            "body": json.dumps({"error": f"search request was rejected: {e.error}"}),
         }
 
     except ValueError as e:
@@ -214,3 +996,54 @@ def handler(event, context):
             "headers": headers,
             "body": json.dumps({"error": "Internal server error"}),
         }
+
+
+def batch_handler(client, body, index_name, headers, retry=True):
+    try:
+        queries = build_batch_queries(body)
+        options = parse_search_options(body)
+        response = batch_search(client, index_name, queries, options)
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": json.dumps(response, ensure_ascii=False),
+        }
+
+    except NotFoundError as e:
+        invalidate_index_meta(index_name)
+        logger.error(f"Index not found: {e}")
+        return {
+            "statusCode": 404,
+            "headers": headers,
+            "body": json.dumps({"error": f"index {index_name} not found"}),
+        }
+
+    except RequestError as e:
+        # エイリアスが別のモデル・保存形式のインデックスに切り替わった場合、キャッシュしたメタデータで
+        # 作ったベクトルは受け付けられない。メタデータを破棄して 1 回だけやり直す
+        invalidate_index_meta(index_name)
+        if retry:
+            logger.warning(f"Retrying after the index metadata was refreshed: {e}")
+            return batch_handler(client, body, index_name, headers, retry=False)
+        logger.error(f"Search request was rejected: {e}")
+        return {
+            "statusCode": 400,
+            "headers": headers,
+            "body": json.dumps({"error": f"search request was rejected: {e.error}"}),
+        }
+
+    except (KeyError, ValueError) as e:
+        logger.error(f"Batch handler encountered an invalid request: {e}")
+        return {
+            "statusCode": 400,
+            "headers": headers,
+            "body": json.dumps({"error": f"invalid request: {e}"}),
+        }
+
+    except Exception as e:
+        logger.exception("Batch handler encountered an unexpected error")
+        return {
+            "statusCode": 500,
+            "headers": headers,
+            "body": json.dumps({"error": "Internal server error"}),
+        }
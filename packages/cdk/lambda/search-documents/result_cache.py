@@ -0,0 +1,151 @@
+"""
+検索結果のキャッシュ
+
+同じクエリの再送信 (検索単位の切り替えやボタンの二度押しなど) では、クエリの埋め込みと検索を省略し、
+シリアライズ済みのレスポンスをそのまま返す。キーにはインデックスの世代 (エイリアスが指すインデックス名と、
+取り込みのたびに更新される _meta の generation) を含める。世代は数秒ごとに確認するため、
+再取り込み後に古い結果が返るのは確認の間隔 (INDEX_ALIAS_TTL、INDEX_GENERATION_TTL) の間のみ。
+
+Lambda の実行環境ごとの LRU キャッシュの後ろに、実行環境間で共有するキャッシュ (SharedResultCache) を置ける。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from embedding_cache import normalize_text
+
+
+def result_cache_key(generation, method, unit, text, options):
+    """
+    Args:
+        generation (str): インデックスの世代
+        method (str): 検索方法
+        unit (str): 検索単位
+        text (str): クエリ (正規化してからハッシュにする)
+        options (dict): 検索件数やページングなど、結果に影響するパラメータ
+    """
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    params = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return f"{generation}:{method}:{unit}:{params}:{digest}"
+
+
+class SharedResultCache:
+    """
+    実行環境間で共有するキャッシュのインターフェース (ElastiCache、DynamoDB など)
+    """
+
+    def get(self, key):
+        """
+        Returns:
+            str: シリアライズ済みのレスポンス。なければ None
+        """
+        raise NotImplementedError
+
+    def put(self, key, value, ttl):
+        raise NotImplementedError
+
+
+class InMemorySharedResultCache(SharedResultCache):
+    """
+    SharedResultCache の代わりにローカルの開発やベンチマークで使う、プロセス内の実装
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+
+class ResultCache:
+    """
+    件数と有効期限 (TTL) に上限のある LRU キャッシュ。shared を指定した場合は、ローカルになければ shared を参照する
+
+    Args:
+        max_entries (int): 保持する件数の上限。0 の場合はキャッシュしない
+        ttl (float): 有効期限 (秒)
+        shared (SharedResultCache): 実行環境間で共有するキャッシュ
+    """
+
+    def __init__(self, max_entries=1024, ttl=60, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._put_local(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self._put_local(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    round((self.hits + self.shared_hits) / total, 4) if total else 0.0
+                ),
+                "entries": len(self._entries),
+            }
+
+    def _put_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,199 @@
+"""
+ハイブリッド検索のスコア統合のパラメータごとの検索パイプライン
+
+取り込み処理が作成する hybrid-search-pipeline は、
+min_max 正規化と重み [0.5, 0.5] の算術平均に固定されている。リクエストで別のパラメータが指定された場合は、
+パラメータのハッシュを名前に含む検索パイプラインを初回の利用時に作成する。同じパラメータは同じ名前になるため、
+Lambda の実行環境間やデプロイをまたいで使い回され、作成済みかどうかは実行環境ごとに記録して 2 回目以降は作成しない。
+重みは WEIGHT_STEP 単位に丸め、作成する検索パイプラインの数には上限を設ける。上限を超える設定はクライアント側で統合する。
+"""
+
+import hashlib
+import json
+import re
+import threading
+
+from opensearchpy import NotFoundError
+
+from fusion import COMBINATION_TECHNIQUES, NORMALIZATION_TECHNIQUES
+
+FUSION_METHODS = ("score", "rrf")
+
+DEFAULT_FUSION = {
+    "method": "score",
+    "normalization": "min_max",
+    "combination": "arithmetic_mean",
+    "weights": [0.5, 0.5],
+    "rank_constant": 60,
+}
+
+# 取り込み処理が作成する、DEFAULT_FUSION と同じ設定の検索パイプライン
+DEFAULT_PIPELINE = "hybrid-search-pipeline"
+# リクエストで指定された重みを丸める単位。作成される検索パイプラインの種類を抑える
+WEIGHT_STEP = 0.05
+PIPELINE_NAME_PATTERN = re.compile(r"^hybrid-[0-9a-f]{16}$")
+
+
+def parse_fusion_options(fusion):
+    """
+    リクエストの fusion を検証し、省略された項目を既定値で補う
+
+    Args:
+        fusion (dict): method (score / rrf)、normalization、combination、weights ([キーワード, ベクトル])、rankConstant
+    Returns:
+        dict: method, normalization, combination, weights, rank_constant
+    """
+    if fusion is None:
+        return dict(DEFAULT_FUSION)
+    if not isinstance(fusion, dict):
+        raise ValueError("fusion must be an object")
+
+    method = fusion.get("method", DEFAULT_FUSION["method"])
+    if method not in FUSION_METHODS:
+        raise ValueError(f"fusion.method must be one of {', '.join(FUSION_METHODS)}")
+    normalization = fusion.get("normalization", DEFAULT_FUSION["normalization"])
+    if normalization not in NORMALIZATION_TECHNIQUES:
+        raise ValueError(
+            f"fusion.normalization must be one of {', '.join(NORMALIZATION_TECHNIQUES)}"
+        )
+    combination = fusion.get("combination", DEFAULT_FUSION["combination"])
+    if combination not in COMBINATION_TECHNIQUES:
+        raise ValueError(
+            f"fusion.combination must be one of {', '.join(COMBINATION_TECHNIQUES)}"
+        )
+
+    weights = fusion.get("weights", DEFAULT_FUSION["weights"])
+    if (
+        not isinstance(weights, list)
+        or len(weights) != 2
+        or any(isinstance(w, bool) or not isinstance(w, (int, float)) for w in weights)
+        or any(w < 0 for w in weights)
+        or sum(weights) <= 0
+    ):
+        raise ValueError("fusion.weights must be two non-negative numbers")
+    # normalization-processor は重みの合計が 1 であることを要求する。
+    # WEIGHT_STEP 単位に丸めておくことで、近い比率の重みが同じ検索パイプラインになる
+    steps = round(weights[0] / sum(weights) / WEIGHT_STEP)
+    keyword_weight = round(steps * WEIGHT_STEP, 2)
+    weights = [keyword_weight, round(1 - keyword_weight, 2)]
+
+    rank_constant = fusion.get("rankConstant", DEFAULT_FUSION["rank_constant"])
+    if isinstance(rank_constant, bool) or not isinstance(rank_constant, int):
+        raise ValueError("fusion.rankConstant must be an integer")
+    if rank_constant < 1:
+        raise ValueError("fusion.rankConstant must be positive")
+
+    return {
+        "method": method,
+        "normalization": normalization,
+        "combination": combination,
+        "weights": weights,
+        "rank_constant": rank_constant,
+    }
+
+
+def pipeline_body(fusion):
+    if fusion["method"] == "rrf":
+        # score-ranker-processor は OpenSearch 2.19 以降で利用できる
+        processor = {
+            "score-ranker-processor": {
+                "combination": {
+                    "technique": "rrf",
+                    "rank_constant": fusion["rank_constant"],
+                }
+            }
+        }
+        description = "Pipeline for hybrid search with reciprocal rank fusion"
+    else:
+        processor = {
+            "normalization-processor": {
+                "normalization": {"technique": fusion["normalization"]},
+                "combination": {
+                    "technique": fusion["combination"],
+                    "parameters": {"weights": fusion["weights"]},
+                },
+            }
+        }
+        description = "Pipeline for hybrid search"
+
+    return {"description": description, "phase_results_processors": [processor]}
+
+
+def pipeline_name(fusion):
+    """
+    検索パイプラインの設定のハッシュから名前を決める
+    """
+    body = pipeline_body(fusion)
+    digest = hashlib.sha256(
+        json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"hybrid-{digest}"
+
+
+class SearchPipelineRegistry:
+    """
+    Args:
+        rrf_pipeline (bool): RRF を検索パイプライン (score-ranker-processor) で行うかどうか。
+            False の場合、RRF はクライアント側で統合する
+        max_pipelines (int): ドメイン全体で作成する検索パイプライン (hybrid-{ハッシュ}) の数の上限
+    """
+
+    def __init__(self, rrf_pipeline=False, max_pipelines=32):
+        self.rrf_pipeline = rrf_pipeline
+        self.max_pipelines = max_pipelines
+        self.created = 0
+        self._names = set()
+        # 上限に達した場合、この実行環境では新しい検索パイプラインを作成しない
+        self._full = False
+        self._lock = threading.Lock()
+
+    def supports(self, fusion):
+        """
+        fusion を検索パイプラインで実行できるかどうか
+        """
+        if fusion["method"] != "rrf":
+            return True
+        # score-ranker-processor はサブクエリごとの重みを指定できないため、重みが均等な場合のみ使う
+        return self.rrf_pipeline and fusion["weights"][0] == fusion["weights"][1]
+
+    def existing_names(self, client):
+        """
+        作成済みの検索パイプラインの名前を返す
+        """
+        try:
+            response = client.http.get("/_search/pipeline/hybrid-*")
+        except NotFoundError:
+            return set()
+        return {name for name in response if PIPELINE_NAME_PATTERN.match(name)}
+
+    def get(self, client, fusion):
+        """
+        fusion の検索パイプラインの名前を返す。この実行環境で初めて使う設定の場合は作成 (上書き) する
+
+        作成済みの検索パイプラインが max_pipelines 個以上ある場合は作成せずに None を返すため、
+        呼び出し側はクライアント側でスコアを統合する。
+        document 単位の検索は hybrid クエリを使わずにクライアント側で統合するため、collapse の検索パイプラインは作成しない。
+        """
+        if fusion == DEFAULT_FUSION:
+            return DEFAULT_PIPELINE
+
+        name = pipeline_name(fusion)
+        if name in self._names:
+            return name
+        with self._lock:
+            if name in self._names:
+                return name
+            if self._full:
+                return None
+            # 他の実行環境が作成したものを含めて数える
+            self._names |= self.existing_names(client)
+            if name in self._names:
+                return name
+            if len(self._names) >= self.max_pipelines:
+                self._full = True
+                return None
+            # 同じ名前の検索パイプラインは同じ内容のため、他の実行環境と同時に作成しても問題ない
+            client.http.put(f"/_search/pipeline/{name}", body=pipeline_body(fusion))
+            self._names.add(name)
+            self.created += 1
+        return name
@@ -0,0 +1,43 @@
+"""
+検索リクエストの処理ごとの時間 (メタデータの取得、クエリの埋め込み、検索)
+
+Lambda の実行環境は同時に 1 つのリクエストしか処理しないため、リクエストの開始時に reset() して使う。
+concurrent モードのように別スレッドで実行される処理も同じ Spans に記録される。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Spans:
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+
+    @contextmanager
+    def span(self, name):
+        """
+        with ブロックの処理時間を name に加算する (1 リクエストで複数回実行される処理は合計になる)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._totals[name] = self._totals.get(name, 0.0) + elapsed
+
+    def items(self):
+        with self._lock:
+            return [(name, round(ms, 3)) for name, ms in self._totals.items()]
+
+    def server_timing(self):
+        """
+        Server-Timing ヘッダーの値。ブラウザの開発者ツールで処理ごとの時間を確認できる
+        """
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.items())
@@ -0,0 +1,56 @@
+"""
+インデックスのベクトルの保存形式 (マッピングの _meta.vector_storage) に合わせてクエリのベクトルをエンコードする
+
+取り込み処理 (ecs/ingest-data/app/vector_codec.py) と同じ方法でエンコードする必要がある。
+"""
+
+import math
+
+
+def cohere_embedding_type(storage):
+    # Cohere が量子化済みの値を返せる保存形式は、その値をそのまま使う
+    return {"byte": "int8", "binary": "binary"}.get(storage, "float")
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def quantize_byte(vector):
+    """
+    最大の絶対値が 127 になるように倍率をかけて整数にする (cosinesimil は倍率に依存しない)
+    """
+    max_abs = max((abs(v) for v in vector), default=0.0) or 1.0
+    scale = 127 / max_abs
+    return [int(round(v * scale)) for v in vector]
+
+
+def pack_binary(vector):
+    """
+    各次元の符号 (正なら 1) を 8 次元ずつ符号付き 8 ビット整数に詰める (Cohere の binary 形式と同じ)
+    """
+    packed = []
+    for i in range(0, len(vector), 8):
+        byte = 0
+        for v in vector[i : i + 8]:
+            byte = (byte << 1) | (1 if v > 0 else 0)
+        packed.append(byte - 256 if byte > 127 else byte)
+    return packed
+
+
+def encode_query_vector(vector, storage, quantized=False):
+    """
+    Args:
+        vector (list): クエリの埋め込みベクトル
+        storage (str): インデックスのベクトルの保存形式
+        quantized (bool): Cohere の int8 / binary 形式で取得済みの場合は True
+    """
+    if storage in ("byte", "binary"):
+        if quantized:
+            return [int(v) for v in vector]
+        return quantize_byte(vector) if storage == "byte" else pack_binary(vector)
+    if storage == "fp16":
+        # faiss の内積で cosinesimil を代用しているため、正規化する
+        return normalize(vector)
+    return vector
@@ -41,6 +41,13 @@ export class Api extends Construct {
           actions: ['es:ESHttpPost', 'es:ESHttpGet'],
           resources: [`${props.opensearchDomain.domainArn}/*`],
         }),
+        new PolicyStatement({
+          // スコア統合のパラメータごとの検索パイプラインの作成
+          actions: ['es:ESHttpPut'],
+          resources: [
+            `${props.opensearchDomain.domainArn}/_search/pipeline/hybrid-*`,
+          ],
+        }),
       ],
       environment: {
         OPENSEARCH_ENDPOINT: props.opensearchDomain.domainEndpoint,
@@ -103,6 +110,15 @@ export class Api extends Construct {
       authorizer,
       authorizationType: AuthorizationType.COGNITO,
     });
+    const searchBatchResource = searchResource.addResource('batch');
+    searchBatchResource.addMethod(
+      'POST',
+      new LambdaIntegration(searchDocuments),
+      {
+        authorizer,
+        authorizationType: AuthorizationType.COGNITO,
+      }
+    );
     const indexResource = api.root.addResource('index');
     indexResource.addMethod('GET', new LambdaIntegration(listIndex), {
       authorizer,
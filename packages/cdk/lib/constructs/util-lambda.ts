@@ -31,7 +31,7 @@ export class UtilLambda extends Construct {
 
     deleteIndexLambdaRole.addToPolicy(
       new iam.PolicyStatement({
-        actions: ['es:ESHttpDelete'],
+        actions: ['es:ESHttpDelete', 'es:ESHttpGet', 'es:ESHttpHead'],
         resources: [`${props.opensearchDomain.domainArn}/*`],
       })
     );
@@ -45,6 +45,8 @@ export class UtilLambda extends Construct {
       environment: {
         OPENSEARCH_ENDPOINT: props.opensearchDomain.domainEndpoint,
         INDEX_NAME: '',
+        KEEP_VERSIONS: '1',
+        STALE_BUILD_GRACE_HOURS: '24',
       },
     });
 
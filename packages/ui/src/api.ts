@@ -19,12 +19,38 @@ api.interceptors.request.use(async (config) => {
 
 export type SearchMethod = 'hybrid' | 'keyword' | 'vector';
 export type SearchResultUnit = 'document' | 'chunk';
+export type HybridMode = 'pipeline' | 'concurrent';
+
+// 値を複数指定した場合はいずれかに一致する結果を返す
+export interface SearchFilters {
+  service?: string | string[];
+  docsRoot?: string | string[];
+}
+
+export interface FusionOptions {
+  method?: 'score' | 'rrf';
+  normalization?: 'min_max' | 'l2';
+  combination?: 'arithmetic_mean' | 'geometric_mean' | 'harmonic_mean';
+  // [キーワード検索, ベクトル検索]
+  weights?: [number, number];
+  rankConstant?: number;
+}
 
 export interface PostSearchRequest {
   indexName: string;
   text: string;
   searchMethod: SearchMethod;
   searchResultUnit: SearchResultUnit;
+  hybridMode?: HybridMode;
+  embeddingTimeoutMs?: number;
+  size?: number;
+  from?: number;
+  searchAfter?: [number, string];
+  k?: number;
+  efSearch?: number;
+  fusion?: FusionOptions;
+  filters?: SearchFilters;
+  extraChunks?: number;
 }
 
 export interface PostSearchResponseItem {
@@ -33,6 +59,9 @@ export interface PostSearchResponseItem {
   service: string;
   docs_root: string;
   doc_name: string;
+  shared_docs?: string[];
+  sort?: [number, string];
+  chunks?: { text: string; score: number }[];
 }
 
 export async function postSearch(
@@ -48,8 +77,55 @@ export async function postSearch(
   }
 }
 
+export interface PostSearchBatchQuery {
+  text: string;
+  searchMethod: SearchMethod;
+  searchResultUnit?: SearchResultUnit;
+}
+
+export interface PostSearchBatchRequest {
+  indexName: string;
+  queries?: PostSearchBatchQuery[];
+  texts?: string[];
+  searchMethods?: SearchMethod[];
+  searchResultUnit?: SearchResultUnit;
+}
+
+export interface PostSearchBatchResponseItem {
+  text: string;
+  searchMethod: SearchMethod;
+  searchResultUnit: SearchResultUnit;
+  results?: PostSearchResponseItem[];
+  error?: unknown;
+  fusion_ms?: number;
+}
+
+export interface PostSearchBatchResponse {
+  results: PostSearchBatchResponseItem[];
+  timings: {
+    embed_ms: number;
+    msearch_ms: number;
+    total_ms: number;
+  };
+}
+
+export async function postSearchBatch(
+  request: PostSearchBatchRequest,
+  reqConfig?: AxiosRequestConfig
+): Promise<PostSearchBatchResponse> {
+  try {
+    const response = await api.post('/search/batch', request, reqConfig);
+    return response.data;
+  } catch (err) {
+    console.log(err);
+    throw err;
+  }
+}
+
 export interface getIndicesResponse {
   indices: string[];
+  // エイリアス名と、エイリアスが指しているインデックス名
+  aliases?: Record<string, string>;
 }
 
 export async function getIndices(): Promise<getIndicesResponse> {